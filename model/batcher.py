@@ -2,10 +2,11 @@
 Module that handles batching logic
 """
 
-from typing import List, Any, Tuple, Callable
+from typing import List, Any, Tuple, Callable, Iterator, Optional, Dict
 import numpy as np
 import torch as t
 from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Sampler
 
 from model.modules.masked import mask_sequence
 from model.qa import EncodedSample, QuestionId
@@ -19,8 +20,17 @@ class QABatch:
     question_words[question_len_idxs] = length_sorted_questions
     length_sorted_questions[question_orig_idxs] = question_words
 
-    masks, and question_ids come in original ordering
+    masks, question_ids and context_offsets come in original ordering
     lengths come sorted
+
+    context_offsets hold the index of the first token of each sample's context
+    in its paragraph, which is nonzero for windows of longer paragraphs
+
+    If the batch is context-grouped each distinct context is held once in the
+    unique_context_* fields (with the same conventions as above) and
+    context_idxs maps each sample to its unique context, i.e.
+    unique_context_words[context_idxs] = context_words
+    context_chars is not built for context-grouped batches
     """
 
     question_ids: List[QuestionId]
@@ -31,13 +41,20 @@ class QABatch:
     question_orig_idxs: t.LongTensor
     question_mask: t.LongTensor
     context_words: t.LongTensor
-    context_chars: t.LongTensor
+    context_chars: Optional[t.LongTensor]
     context_lens: t.LongTensor
     context_len_idxs: t.LongTensor
     context_orig_idxs: t.LongTensor
     context_mask: t.LongTensor
     answer_span_starts: t.LongTensor
     answer_span_ends: t.LongTensor
+    context_offsets: Optional[t.LongTensor]
+    context_idxs: Optional[t.LongTensor]
+    unique_context_words: Optional[t.LongTensor]
+    unique_context_chars: Optional[t.LongTensor]
+    unique_context_lens: Optional[t.LongTensor]
+    unique_context_len_idxs: Optional[t.LongTensor]
+    unique_context_orig_idxs: Optional[t.LongTensor]
 
     def __init__(
         self,
@@ -49,13 +66,20 @@ class QABatch:
         question_orig_idxs: t.LongTensor,
         question_mask: t.LongTensor,
         context_words: t.LongTensor,
-        context_chars: t.LongTensor,
+        context_chars: Optional[t.LongTensor],
         context_lens: t.LongTensor,
         context_len_idxs: t.LongTensor,
         context_orig_idxs: t.LongTensor,
         context_mask: t.LongTensor,
         answer_span_starts: t.LongTensor,
         answer_span_ends: t.LongTensor,
+        context_offsets: Optional[t.LongTensor] = None,
+        context_idxs: Optional[t.LongTensor] = None,
+        unique_context_words: Optional[t.LongTensor] = None,
+        unique_context_chars: Optional[t.LongTensor] = None,
+        unique_context_lens: Optional[t.LongTensor] = None,
+        unique_context_len_idxs: Optional[t.LongTensor] = None,
+        unique_context_orig_idxs: Optional[t.LongTensor] = None,
     ) -> None:
         self.question_ids = question_ids
         self.question_words = question_words
@@ -72,6 +96,17 @@ class QABatch:
         self.context_mask = context_mask
         self.answer_span_starts = answer_span_starts
         self.answer_span_ends = answer_span_ends
+        self.context_offsets = context_offsets
+        self.context_idxs = context_idxs
+        self.unique_context_words = unique_context_words
+        self.unique_context_chars = unique_context_chars
+        self.unique_context_lens = unique_context_lens
+        self.unique_context_len_idxs = unique_context_len_idxs
+        self.unique_context_orig_idxs = unique_context_orig_idxs
+
+    @property
+    def is_context_grouped(self) -> bool:
+        return self.context_idxs is not None
 
     def to(self, device: t.device) -> "QABatch":
         """
@@ -86,13 +121,23 @@ class QABatch:
         self.question_orig_idxs = self.question_orig_idxs.to(device)
         self.question_mask = self.question_mask.to(device)
         self.context_words = self.context_words.to(device)
-        self.context_chars = self.context_chars.to(device)
+        if self.context_chars is not None:
+            self.context_chars = self.context_chars.to(device)
         self.context_lens = self.context_lens.to(device)
         self.context_len_idxs = self.context_len_idxs.to(device)
         self.context_orig_idxs = self.context_orig_idxs.to(device)
         self.context_mask = self.context_mask.to(device)
         self.answer_span_starts = self.answer_span_starts.to(device)
         self.answer_span_ends = self.answer_span_ends.to(device)
+        if self.context_offsets is not None:
+            self.context_offsets = self.context_offsets.to(device)
+        if self.is_context_grouped:
+            self.context_idxs = self.context_idxs.to(device)
+            self.unique_context_words = self.unique_context_words.to(device)
+            self.unique_context_chars = self.unique_context_chars.to(device)
+            self.unique_context_lens = self.unique_context_lens.to(device)
+            self.unique_context_len_idxs = self.unique_context_len_idxs.to(device)
+            self.unique_context_orig_idxs = self.unique_context_orig_idxs.to(device)
 
         return self
 
@@ -101,19 +146,25 @@ class QABatch:
 
 
 def get_collator(
-    max_question_size: int = 0, max_context_size: int = 0
+    max_question_size: int = 0, max_context_size: int = 0, group_contexts: bool = False
 ) -> Callable[[List[EncodedSample]], QABatch]:
     """
     Returns an instance of the collate_batch function that prepares the batch with the given length limits
     :param max_question_size: Questions beyond this size are trimmed (default 0: unlimited)
     :param max_context_size: Contexts beyond this size are trimmed (default 0: unlimited)
+    :param group_contexts: If True build context-grouped batches (default False)
     :returns: A lambda that takes a list of encoded samples and returns a QABatch
     """
-    return lambda batch: collate_batch(batch, max_question_size, max_context_size)
+    return lambda batch: collate_batch(
+        batch, max_question_size, max_context_size, group_contexts
+    )
 
 
 def collate_batch(
-    batch: List[EncodedSample], max_question_size: int = 0, max_context_size: int = 0
+    batch: List[EncodedSample],
+    max_question_size: int = 0,
+    max_context_size: int = 0,
+    group_contexts: bool = False,
 ) -> QABatch:
     """
     Takes a list of EncodedSample objects and creates a PyTorch batch limiting context and question lengths if specified
@@ -122,34 +173,25 @@ def collate_batch(
     :param batch: List[EncodedSample] QA samples
     :param max_question_size: Questions beyond this size are trimmed (default 0: unlimited)
     :param max_context_size: Contexts beyond this size are trimmed (default 0: unlimited)
+    :param group_contexts: If True samples of the same paragraph share a single
+        padded context in the batch (default False)
     :returns: a QABatch
     """
+    if group_contexts:
+        return collate_grouped_batch(batch, max_question_size, max_context_size)
+
     question_words_list = []
-    question_chars_list = []
     question_ids = []
     context_words_list = []
-    context_chars_list = []
     answer_span_starts = []
     answer_span_ends = []
 
-    batch_size = len(batch)
-    max_question_word_len = 0
-    max_ctx_word_len = 0
-
     for sample in batch:
         question_words_list.append(sample.question_words)
         question_ids.append(sample.question_id)
         context_words_list.append(sample.context_words)
         answer_span_starts.append(sample.span_starts)
         answer_span_ends.append(sample.span_ends)
-        question_chars_list.append(sample.question_chars)
-        max_question_word_len = max(
-            max_question_word_len, max(word.size for word in sample.question_chars)
-        )
-        context_chars_list.append(sample.context_chars)
-        max_ctx_word_len = max(
-            max_ctx_word_len, max(word.size for word in sample.context_chars)
-        )
 
     question_words, question_orig_idxs, question_len_idxs, question_lens = pad_and_sort(
         question_words_list, max_question_size
@@ -157,16 +199,11 @@ def collate_batch(
 
     question_words = question_words[question_orig_idxs]
     question_mask = mask_sequence(question_words)
-
-    # TODO: Is there a more efficient way of doing this?
-    max_question_len = question_lens[0]
-    question_chars = np.zeros((batch_size, max_question_len, max_question_word_len))
-    for batch_idx, q_chars in enumerate(question_chars_list):
-        for word_idx, word in enumerate(q_chars):
-            if max_question_size > 0 and word_idx >= max_question_size:
-                break
-            question_chars[batch_idx, word_idx, : word.size] = word
-    question_chars = t.LongTensor(question_chars)
+    question_chars = pad_chars(
+        [sample.question_flat_chars for sample in batch],
+        [sample.question_char_offsets for sample in batch],
+        max_question_size,
+    )
 
     context_words, context_orig_idxs, context_len_idxs, context_lens = pad_and_sort(
         context_words_list, max_context_size
@@ -174,16 +211,11 @@ def collate_batch(
 
     context_words = context_words[context_orig_idxs]
     context_mask = mask_sequence(context_words)
-
-    # TODO: Is there a more efficient way of doing this?
-    max_context_len = context_lens[0]
-    context_chars = np.zeros((batch_size, max_context_len, max_ctx_word_len))
-    for batch_idx, c_chars in enumerate(context_chars_list):
-        for word_idx, word in enumerate(c_chars):
-            if max_context_size > 0 and word_idx >= max_context_size:
-                break
-            context_chars[batch_idx, word_idx, : word.size] = word
-    context_chars = t.LongTensor(context_chars)
+    context_chars = pad_chars(
+        [sample.context_flat_chars for sample in batch],
+        [sample.context_char_offsets for sample in batch],
+        max_context_size,
+    )
 
     answer_span_starts, _, _, _ = pad_and_sort(answer_span_starts, max_context_size)
     answer_span_starts = answer_span_starts[context_orig_idxs]
@@ -207,6 +239,98 @@ def collate_batch(
         context_mask=context_mask,
         answer_span_starts=answer_span_starts,
         answer_span_ends=answer_span_ends,
+        context_offsets=t.LongTensor([sample.context_offset for sample in batch]),
+    )
+
+
+def collate_grouped_batch(
+    batch: List[EncodedSample], max_question_size: int = 0, max_context_size: int = 0
+) -> QABatch:
+    """
+    Creates a context-grouped QABatch where each distinct context of the batch is
+    padded and char-expanded only once
+    Samples are grouped by their context_id, or by their context word array if
+    they have none
+    :param batch: List[EncodedSample] QA samples
+    :param max_question_size: Questions beyond this size are trimmed (default 0: unlimited)
+    :param max_context_size: Contexts beyond this size are trimmed (default 0: unlimited)
+    :returns: a context-grouped QABatch
+    """
+    unique_context_keys: Dict[Any, int] = {}
+    unique_contexts: List[EncodedSample] = []
+    context_idxs = []
+    for sample in batch:
+        key = (
+            sample.context_id
+            if sample.context_id is not None
+            else id(sample.context_words)
+        )
+        if key not in unique_context_keys:
+            unique_context_keys[key] = len(unique_contexts)
+            unique_contexts.append(sample)
+        context_idxs.append(unique_context_keys[key])
+    context_idxs = t.LongTensor(context_idxs)
+
+    question_words, question_orig_idxs, question_len_idxs, question_lens = pad_and_sort(
+        [sample.question_words for sample in batch], max_question_size
+    )
+    question_words = question_words[question_orig_idxs]
+    question_mask = mask_sequence(question_words)
+    question_chars = pad_chars(
+        [sample.question_flat_chars for sample in batch],
+        [sample.question_char_offsets for sample in batch],
+        max_question_size,
+    )
+
+    unique_words, unique_orig_idxs, unique_len_idxs, unique_lens = pad_and_sort(
+        [sample.context_words for sample in unique_contexts], max_context_size
+    )
+    unique_words = unique_words[unique_orig_idxs]
+    unique_chars = pad_chars(
+        [sample.context_flat_chars for sample in unique_contexts],
+        [sample.context_char_offsets for sample in unique_contexts],
+        max_context_size,
+    )
+
+    context_words = unique_words[context_idxs]
+    context_mask = mask_sequence(context_words)
+    context_lens, context_len_idxs = unique_lens[unique_orig_idxs][context_idxs].sort(
+        0, descending=True
+    )
+    _, context_orig_idxs = context_len_idxs.sort()
+
+    answer_span_starts, span_orig_idxs, _, _ = pad_and_sort(
+        [sample.span_starts for sample in batch], max_context_size
+    )
+    answer_span_starts = answer_span_starts[span_orig_idxs]
+    answer_span_ends, span_orig_idxs, _, _ = pad_and_sort(
+        [sample.span_ends for sample in batch], max_context_size
+    )
+    answer_span_ends = answer_span_ends[span_orig_idxs]
+
+    return QABatch(
+        question_ids=[sample.question_id for sample in batch],
+        question_words=question_words,
+        question_chars=question_chars,
+        question_lens=question_lens,
+        question_len_idxs=question_len_idxs,
+        question_orig_idxs=question_orig_idxs,
+        question_mask=question_mask,
+        context_words=context_words,
+        context_chars=None,
+        context_lens=context_lens,
+        context_len_idxs=context_len_idxs,
+        context_orig_idxs=context_orig_idxs,
+        context_mask=context_mask,
+        answer_span_starts=answer_span_starts,
+        answer_span_ends=answer_span_ends,
+        context_offsets=t.LongTensor([sample.context_offset for sample in batch]),
+        context_idxs=context_idxs,
+        unique_context_words=unique_words,
+        unique_context_chars=unique_chars,
+        unique_context_lens=unique_lens,
+        unique_context_len_idxs=unique_len_idxs,
+        unique_context_orig_idxs=unique_orig_idxs,
     )
 
 
@@ -224,17 +348,191 @@ def pad_and_sort(
         - Length-sorted-to-original sort indices (meaning batch[orig_idxs] == seq)
         - lengths of sequences
     """
+    if max_sequence_size > 0:
+        seq = [el[:max_sequence_size] for el in seq]
     if len(seq) == 1:
         batch = t.LongTensor(seq)
-        orig_idxs = t.zeros((1))
-        length_idxs = t.zeros((1))
+        orig_idxs = t.zeros((1), dtype=t.long)
+        length_idxs = t.zeros((1), dtype=t.long)
         lengths = t.LongTensor([len(seq[0])])
         return batch, orig_idxs, length_idxs, lengths
-    if max_sequence_size > 0:
-        seq = [el[:max_sequence_size] for el in seq]
     lengths = t.LongTensor([el.shape[0] for el in seq])
     lengths, length_idxs = lengths.sort(0, descending=True)
     seq = [t.LongTensor(seq[i]) for i in length_idxs]
     batch = pad_sequence(seq, batch_first=True)
     _, orig_idxs = length_idxs.sort()
     return batch, orig_idxs, length_idxs, lengths
+
+
+def pad_chars(
+    flat_chars: List[Any], char_offsets: List[Any], max_sequence_size: int = 0
+) -> t.LongTensor:
+    """
+    Builds the padded char tensor of a batch of sequences from their flat char ids
+    without iterating over the words of each sequence
+    :param flat_chars: List of flat char id arrays, one per sequence
+    :param char_offsets: List of char offset arrays, one per sequence, where the
+        chars of word i are flat_chars[char_offsets[i]:char_offsets[i + 1]]
+    :param max_sequence_size: If nonzero sequences are trimmed to that many words
+    :returns: LongTensor of shape (batch_len, max_seq_len, max_word_len) holding the
+        char ids of each word padded with 0's, in the original batch order
+    """
+    if max_sequence_size > 0:
+        char_offsets = [offsets[: max_sequence_size + 1] for offsets in char_offsets]
+    seq_lens = np.array([len(offsets) - 1 for offsets in char_offsets])
+    word_lens = np.concatenate([np.diff(offsets) for offsets in char_offsets])
+    chars = np.concatenate(
+        [chars[: offsets[-1]] for chars, offsets in zip(flat_chars, char_offsets)]
+    )
+    max_seq_len = int(seq_lens.max()) if seq_lens.size else 0
+    max_word_len = int(word_lens.max()) if word_lens.size else 0
+    padded = t.zeros((len(char_offsets), max_seq_len, max_word_len), dtype=t.long)
+    if not chars.size:
+        return padded
+
+    # batch and word index of each word, then of each char through its word
+    word_batch_idxs = np.repeat(np.arange(len(seq_lens)), seq_lens)
+    word_idxs = np.arange(len(word_lens)) - np.repeat(
+        np.cumsum(seq_lens) - seq_lens, seq_lens
+    )
+    char_words = np.repeat(np.arange(len(word_lens)), word_lens)
+    char_idxs = np.arange(len(chars)) - np.repeat(
+        np.cumsum(word_lens) - word_lens, word_lens
+    )
+    padded[
+        t.from_numpy(word_batch_idxs[char_words]),
+        t.from_numpy(word_idxs[char_words]),
+        t.from_numpy(char_idxs),
+    ] = t.from_numpy(chars.astype(np.int64))
+    return padded
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler that puts samples with similar context lengths into the same batch
+    to minimize padding.
+    Samples are sorted by context length (ties broken randomly when shuffling) and
+    split into buckets of bucket_size batches. When shuffling, samples are shuffled
+    within each bucket before being split into batches and the batches of all buckets
+    are shuffled as well.
+    Batches either hold batch_size samples or, if max_tokens is specified, as many
+    samples as fit in max_tokens padded context tokens.
+    If context_ids are given, samples of the same context are kept next to each other
+    so that they end up in the same batches and can share a context encoding.
+    """
+
+    lengths: Any  # numpy array
+    batch_size: int
+    bucket_size: int
+    max_tokens: int
+    shuffle: bool
+    context_ids: Optional[Any]  # numpy array
+    batches: List[List[int]]
+
+    def __init__(
+        self,
+        lengths: Any,
+        batch_size: int,
+        shuffle: bool = True,
+        bucket_size: int = 20,
+        max_tokens: int = 0,
+        max_length: int = 0,
+        context_ids: Optional[Any] = None,
+    ) -> None:
+        """
+        :param lengths: Context length of each sample of the dataset
+        :param batch_size: Number of samples in each batch (also used to size
+            buckets if max_tokens is specified)
+        :param shuffle: If True shuffle samples within buckets and shuffle batch order
+            (default True)
+        :param bucket_size: Number of batches worth of samples in each bucket
+            (default 20)
+        :param max_tokens: If nonzero build batches that hold at most this many
+            padded context tokens instead of batch_size samples (default 0)
+        :param max_length: If nonzero contexts are trimmed to this length when
+            batched, so longer lengths are capped to it (default 0: unlimited)
+        :param context_ids: If specified, id of the context of each sample used to
+            group samples of the same context together (default None)
+        """
+        self.lengths = np.asarray(lengths)
+        if max_length > 0:
+            self.lengths = np.minimum(self.lengths, max_length)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.max_tokens = max_tokens
+        self.context_ids = None
+        if context_ids is not None:
+            _, self.context_ids = np.unique(
+                np.asarray(context_ids), return_inverse=True
+            )
+        self.batches = self.make_batches()
+
+    def make_batches(self) -> List[List[int]]:
+        """
+        Sorts the samples into buckets and splits the buckets into batches
+        :returns: List of batches, each a list of sample indices
+        """
+        if self.context_ids is not None:
+            # Random context order within each length, samples of a context together
+            context_keys = self.context_ids
+            if self.shuffle:
+                context_keys = np.random.permutation(self.context_ids.max() + 1)[
+                    self.context_ids
+                ]
+            order = np.lexsort((context_keys, self.lengths))
+        elif self.shuffle:
+            order = np.lexsort((np.random.rand(len(self.lengths)), self.lengths))
+        else:
+            order = np.argsort(self.lengths, kind="stable")
+        samples_per_bucket = self.bucket_size * self.batch_size
+        batches: List[List[int]] = []
+        for bucket_start in range(0, len(order), samples_per_bucket):
+            bucket = order[bucket_start : bucket_start + samples_per_bucket]
+            if self.shuffle and self.context_ids is None:
+                bucket = np.random.permutation(bucket)
+            if self.max_tokens > 0:
+                batches.extend(self.split_by_tokens(bucket))
+            else:
+                batches.extend(
+                    bucket[batch_start : batch_start + self.batch_size].tolist()
+                    for batch_start in range(0, len(bucket), self.batch_size)
+                )
+        if self.shuffle:
+            np.random.shuffle(batches)
+        return batches
+
+    def split_by_tokens(self, bucket: Any) -> List[List[int]]:
+        """
+        Greedily splits a bucket into batches of at most max_tokens padded tokens
+        :param bucket: Array of sample indices
+        :returns: List of batches, each a list of sample indices
+        """
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_max_len = 0
+        for idx in bucket.tolist():
+            max_len = max(batch_max_len, self.lengths[idx])
+            if batch and max_len * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                max_len = self.lengths[idx]
+            batch.append(idx)
+            batch_max_len = max_len
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.batches
+        if self.shuffle:
+            # Reshuffle for the next epoch up front, so __len__ always counts the
+            # batches the next iteration yields even if they're sized by tokens
+            self.batches = self.make_batches()
+        return iter(batches)
+
+    def __len__(self) -> int:
+        """
+        :returns: Number of batches the next iteration over the sampler yields
+        """
+        return len(self.batches)
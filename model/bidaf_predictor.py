@@ -30,19 +30,22 @@ class BidafConfig:
     contextual_encoder_config: ContextualEncoderConfig
     modeling_layer_config: ContextualEncoderConfig
     output_config: ContextualEncoderConfig
+    attention_block_size: int
 
     def __init__(
         self,
         contextual_encoder_config: ContextualEncoderConfig,
         modeling_layer_config: ContextualEncoderConfig,
         output_config: ContextualEncoderConfig,
+        attention_block_size: int = 0,
     ) -> None:
         self.contextual_encoder_config = contextual_encoder_config
         self.modeling_layer_config = modeling_layer_config
         self.output_config = output_config
+        self.attention_block_size = attention_block_size
 
     @classmethod
-    def get_default_bidaf_config(cls) -> "BidafConfig":
+    def get_default_bidaf_config(cls, attention_block_size: int = 0) -> "BidafConfig":
         return BidafConfig(
             contextual_encoder_config=ContextualEncoderConfig(
                 hidden_size=100, num_layers=1, dropout_input=False, dropout_prob=0.2
@@ -53,6 +56,7 @@ class BidafConfig:
             output_config=ContextualEncoderConfig(
                 hidden_size=100, num_layers=1, dropout_input=False, dropout_prob=0.2
             ),
+            attention_block_size=attention_block_size,
         )
 
 
@@ -106,6 +110,8 @@ class BidafOutput(nn.Module):
             start_logits=start_predictions,
             end_logits=end_predictions,
             no_ans_logits=None,
+            start_scores=start_logits,
+            end_scores=end_logits,
         )
 
 
@@ -129,7 +135,7 @@ class BidafPredictor(PredictorModel):
             self.embed.embedding_dim, self.config.contextual_encoder_config
         )
         self.bi_attention = BidafBidirectionalAttention(
-            self.embedding_encoder.output_size
+            self.embedding_encoder.output_size, self.config.attention_block_size
         )
         self.modeling_layer = ContextualEncoder(
             self.bi_attention.final_encoding_size, self.config.modeling_layer_config
@@ -145,18 +151,8 @@ class BidafPredictor(PredictorModel):
         Check base class method for docs
         """
 
-        question = self.embed(batch.question_words, batch.question_chars)
-        question = self.embedding_encoder(
-            question,
-            batch.question_lens,
-            batch.question_len_idxs,
-            batch.question_orig_idxs,
-        )
-
-        context = self.embed(batch.context_words, batch.context_chars)
-        context = self.embedding_encoder(
-            context, batch.context_lens, batch.context_len_idxs, batch.context_orig_idxs
-        )
+        question = self.encode_question(batch)
+        context = self.encode_context(batch)
 
         attended_context = self.bi_attention(
             context, question, context_mask=batch.context_mask
@@ -0,0 +1,226 @@
+"""
+Module that holds a checkpointer that writes training checkpoints from a
+background thread so training doesn't wait on disk writes
+"""
+
+import copy
+import glob
+import json
+import os
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Pattern, Tuple
+
+import numpy as np
+import torch as t
+import torch.nn as nn
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints in a single background thread. The state to save is first
+    snapshotted to CPU memory synchronously, so training can keep updating the
+    weights while the snapshot is written. Saving only blocks once max_pending
+    snapshots are already waiting to be written. Every file is written to a temporary
+    path first and then atomically renamed over its final path, so a crash never
+    leaves a truncated checkpoint behind.
+    Training checkpoints are written to <prefix>-step<step>.ckpt and only the
+    last keep_last of them are kept
+    """
+
+    STEP_PATTERN: ClassVar[Pattern] = re.compile(r"-step(\d+)\.ckpt$")
+
+    prefix: str
+    keep_last: int
+    max_pending: int
+    executor: ThreadPoolExecutor
+    pending: List[Future]
+
+    def __init__(self, prefix: str, keep_last: int = 3, max_pending: int = 2) -> None:
+        """
+        :param prefix: Path prefix of the training checkpoints
+        :param keep_last: Number of training checkpoints to keep, older ones are
+            deleted (0 to keep all of them, default 3)
+        :param max_pending: Number of snapshots that can wait in memory to be
+            written before saving another one blocks (default 2)
+        """
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.max_pending = max(max_pending, 1)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+
+    def save_checkpoint(self, step: int, state: Dict[str, Any]) -> None:
+        """
+        Snapshots a training state and writes it in the background
+        :param step: Global training step of the state
+        :param state: Dict of state_dicts and plain values to save
+        """
+        snapshot = AsyncCheckpointer.to_cpu(state)
+        path = f"{self.prefix}-step{step:09d}.ckpt"
+        self.submit(lambda: self.write_checkpoint(path, snapshot))
+
+    def save_model(self, model: nn.Module, path: str) -> None:
+        """
+        Snapshots a whole model and pickles it to path in the background, so it
+        can be loaded with t.load. Parameters and buffers are copied straight to
+        CPU memory and the module is copied around them, so no second copy of the
+        weights is made on the model's device
+        :param model: Model to save
+        :param path: Path to save the model to
+        """
+        memo: Dict[int, Any] = {
+            id(param): nn.Parameter(
+                AsyncCheckpointer.to_cpu(param), requires_grad=param.requires_grad
+            )
+            for param in model.parameters()
+        }
+        memo.update(
+            (id(buffer), AsyncCheckpointer.to_cpu(buffer)) for buffer in model.buffers()
+        )
+        snapshot = copy.deepcopy(model, memo)
+        self.submit(lambda: AsyncCheckpointer.atomic_write(path, snapshot, t.save))
+
+    def save_json(self, obj: Any, path: str) -> None:
+        """
+        Writes a JSON serializable object to path in the background
+        :param obj: Object to write
+        :param path: Path to write the object to
+        """
+        snapshot = copy.deepcopy(obj)
+        self.submit(
+            lambda: AsyncCheckpointer.atomic_write(
+                path, snapshot, AsyncCheckpointer.write_json
+            )
+        )
+
+    def submit(self, write: Callable[[], None]) -> None:
+        """
+        Queues a write after the pending writes. Only waits for the oldest
+        pending writes to finish if max_pending snapshots are already queued
+        :param write: Function that writes a snapshot
+        """
+        for future in [future for future in self.pending if future.done()]:
+            self.pending.remove(future)
+            AsyncCheckpointer.report(future)
+        while len(self.pending) >= self.max_pending:
+            AsyncCheckpointer.report(self.pending.pop(0))
+        self.pending.append(self.executor.submit(write))
+
+    def wait(self) -> None:
+        """
+        Waits for all pending writes to finish
+        """
+        while self.pending:
+            AsyncCheckpointer.report(self.pending.pop(0))
+
+    def close(self) -> None:
+        """
+        Waits for the pending writes and stops the background thread
+        """
+        self.wait()
+        self.executor.shutdown()
+
+    @staticmethod
+    def report(future: Future) -> None:
+        """
+        Waits for a write to finish. A failed write is reported but doesn't
+        interrupt training
+        :param future: Future of the write
+        """
+        try:
+            future.result()
+        except (IOError, OSError, RuntimeError) as ex:
+            print(f"[WARNING] Can't write checkpoint: {ex}")
+
+    def write_checkpoint(self, path: str, snapshot: Dict[str, Any]) -> None:
+        AsyncCheckpointer.atomic_write(path, snapshot, t.save)
+        if self.keep_last > 0:
+            for old_path in AsyncCheckpointer.list_checkpoints(self.prefix)[
+                : -self.keep_last
+            ]:
+                os.remove(old_path)
+
+    @staticmethod
+    def atomic_write(path: str, obj: Any, write: Callable[[Any, str], None]) -> None:
+        """
+        Writes obj to a temporary file next to path, then renames it over path
+        :param path: Final path of the file
+        :param obj: Object to write
+        :param write: Function that writes an object to a given path
+        """
+        tmp_path = f"{path}.tmp"
+        write(obj, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def write_json(obj: Any, path: str) -> None:
+        with open(path, "w") as json_file:
+            json.dump(obj, json_file)
+
+    @staticmethod
+    def to_cpu(state: Any) -> Any:
+        """
+        Recursively copies all tensors of a (nested) state to CPU memory
+        :param state: Tensor, dict, list or plain value
+        :returns: A copy of state whose tensors are detached CPU copies
+        """
+        if isinstance(state, t.Tensor):
+            return state.detach().to(t.device("cpu"), copy=True)
+        if isinstance(state, dict):
+            return {
+                key: AsyncCheckpointer.to_cpu(value) for key, value in state.items()
+            }
+        if isinstance(state, (list, tuple)):
+            return type(state)(AsyncCheckpointer.to_cpu(value) for value in state)
+        return copy.deepcopy(state)
+
+    @staticmethod
+    def get_numpy_rng_state() -> Tuple[Any, ...]:
+        """
+        :returns: The state of numpy's global RNG with its key array as a tensor,
+            so checkpoints can be loaded with t.load's default weights_only
+        """
+        name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        keys_tensor = t.from_numpy(keys.astype(np.int64))
+        return (name, keys_tensor, pos, has_gauss, cached_gaussian)
+
+    @staticmethod
+    def set_numpy_rng_state(state: Tuple[Any, ...]) -> None:
+        """
+        :param state: State returned by get_numpy_rng_state to restore numpy's
+            global RNG to
+        """
+        name, keys, pos, has_gauss, cached_gaussian = state
+        np.random.set_state(
+            (name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian)
+        )
+
+    @classmethod
+    def list_checkpoints(cls, prefix: str) -> List[str]:
+        """
+        :param prefix: Path prefix of the training checkpoints
+        :returns: Paths of all training checkpoints with the prefix, oldest first
+        """
+        paths = [
+            path
+            for path in glob.glob(f"{glob.escape(prefix)}-step*.ckpt")
+            if cls.STEP_PATTERN.search(path)
+        ]
+        return sorted(
+            paths, key=lambda path: int(cls.STEP_PATTERN.search(path).group(1))
+        )
+
+    @classmethod
+    def load_latest(cls, prefix: str) -> Optional[Dict[str, Any]]:
+        """
+        Loads the most recent training checkpoint into CPU memory, load_state_dict
+        moves its tensors to the devices of the modules they're loaded into
+        :param prefix: Path prefix of the training checkpoints
+        :returns: The saved state, or None if there is no checkpoint
+        """
+        checkpoints = cls.list_checkpoints(prefix)
+        if not checkpoints:
+            return None
+        print(f"Loading checkpoint {checkpoints[-1]}")
+        return t.load(checkpoints[-1], map_location=t.device("cpu"))
@@ -2,13 +2,33 @@
 Module that deals with preparing QA corpora
 """
 
+import hashlib
 import json
+import os
 import pickle
-from typing import Any, Optional, List, Dict, Set, Tuple, NamedTuple, cast
-from collections import defaultdict
+import random
+from typing import (
+    Any,
+    Optional,
+    Iterable,
+    Iterator,
+    List,
+    Dict,
+    Set,
+    Tuple,
+    NamedTuple,
+    Union,
+    ClassVar,
+    cast,
+)
+from collections import defaultdict, Counter
+from functools import partial
+from multiprocessing import Pool
 
-from torch.utils.data import Dataset
+import numpy as np
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
+from model.json_stream import JsonStreamReader
 from model.text_processor import TextProcessor
 from model.tokenizer import Tokenizer
 from model.qa import (
@@ -18,7 +38,9 @@ from model.qa import (
     EncodedContextQuestionAnswer,
     EncodedSample,
     QuestionId,
+    flatten_arrays,
 )
+from model.scorer import SquadScorer
 
 from model.wv import WordVectors
 
@@ -44,7 +66,13 @@ class Corpus:
     Class that contains a corpus
     """
 
+    CACHE_VERSION: ClassVar[int] = 1
+    HASH_CHUNK_SIZE: ClassVar[int] = 1 << 20
+    READ_CHUNK_DOCS: ClassVar[int] = 8
+    SERIALIZED_EXTENSIONS: ClassVar[Tuple[str, ...]] = (".corpus", ".pkl")
+
     source_file: Optional[str]
+    cache_key: Optional[str]
     context_qas: List[ContextQuestionAnswer]
     quids_to_context_qas: Dict[QuestionId, ContextQuestionAnswer]
     token_mapping: Dict[str, int]
@@ -60,6 +88,7 @@ class Corpus:
         source_file: Optional[str] = None,
     ) -> None:
         self.source_file = source_file
+        self.cache_key = None
         self.context_qas = context_qas
         self.quids_to_context_qas = {
             qa.question_id: cqa for cqa in context_qas for qa in cqa.qas
@@ -87,6 +116,7 @@ class Corpus:
         word_vectors: WordVectors,
         force_single_answer: bool = False,
         char_mapping: Optional[Dict[str, int]] = None,
+        num_workers: int = 0,
     ) -> "Corpus":
         """
         Reads a Corpus of QA questions from a file
@@ -99,26 +129,182 @@ class Corpus:
         :param word_vectors: WordVectors to build encoding indices from
         :param char_mapping: Optional mapping from chars to ints, will be computed
             from scratch if not specified
+        :param num_workers: If nonzero, preprocess the file using this many
+            worker processes (default 0: serial processing)
         """
         context_qas = cls.read_context_qas(
-            data_file, tokenizer, processor, force_single_answer
+            data_file, tokenizer, processor, force_single_answer, num_workers
         )
-
-        def return_one() -> int:
-            return 1
-
-        token_mapping = defaultdict(return_one, word_vectors.word_to_idx)
+        token_mapping = cls.make_token_mapping(word_vectors.word_to_idx)
         if char_mapping is None:
             char_mapping = cls.compute_char_indices(context_qas)
         stats = cls.compute_stats(context_qas, token_mapping, char_mapping)
         return cls(context_qas, token_mapping, char_mapping, stats, data_file)
 
+    @classmethod
+    def from_file(
+        cls,
+        filename: str,
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        word_vectors: WordVectors,
+        force_single_answer: bool = False,
+        char_mapping: Optional[Dict[str, int]] = None,
+        num_workers: int = 0,
+        cache_dir: Optional[str] = None,
+    ) -> "Corpus":
+        """
+        Loads a serialized Corpus from the given file if its extension is one of
+        SERIALIZED_EXTENSIONS, otherwise reads the file as raw QA data.
+        If cache_dir is given, corpora read from raw QA data are saved there under
+        their cache key and loaded from there as long as neither the file nor
+        anything that affects preprocessing it changes
+        Check from_raw for the other parameter docs
+        :param cache_dir: If specified cache preprocessed corpora in this directory
+            (default None: don't cache)
+        :returns: A Corpus object
+        """
+        if Corpus.is_serialized(filename):
+            corpus = Corpus.from_disk(filename)
+            corpus.cache_key = None
+            return corpus
+        if cache_dir is None:
+            return Corpus.from_raw(
+                filename,
+                tokenizer,
+                processor,
+                word_vectors,
+                force_single_answer=force_single_answer,
+                char_mapping=char_mapping,
+                num_workers=num_workers,
+            )
+        cache_key = Corpus.get_cache_key(
+            filename,
+            tokenizer,
+            processor,
+            word_vectors,
+            force_single_answer,
+            char_mapping,
+        )
+        cache_file = os.path.join(cache_dir, f"{cache_key}.corpus")
+        try:
+            corpus = Corpus.from_disk(cache_file)
+            print(f"Loaded preprocessed {filename} from {cache_file}")
+        except (IOError, EOFError, AttributeError, pickle.UnpicklingError):
+            corpus = Corpus.from_raw(
+                filename,
+                tokenizer,
+                processor,
+                word_vectors,
+                force_single_answer=force_single_answer,
+                char_mapping=char_mapping,
+                num_workers=num_workers,
+            )
+            os.makedirs(cache_dir, exist_ok=True)
+            corpus.save(cache_file)
+        corpus.cache_key = cache_key
+        return corpus
+
+    @classmethod
+    def is_serialized(cls, filename: str) -> bool:
+        """
+        :param filename: Name of a corpus file
+        :returns: True if the file's extension marks it as a serialized Corpus
+            rather than a raw QA data file
+        """
+        return os.path.splitext(filename)[1].lower() in cls.SERIALIZED_EXTENSIONS
+
+    @classmethod
+    def get_cache_key(
+        cls,
+        filename: str,
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        word_vectors: WordVectors,
+        force_single_answer: bool = False,
+        char_mapping: Optional[Dict[str, int]] = None,
+    ) -> str:
+        """
+        Hashes everything that determines the Corpus read from a raw QA data file:
+        the file's contents, the tokenizer, the text processor's config, the
+        vocabulary of the word vectors, the answer and char mapping settings and
+        the version of the Corpus format
+        Check from_raw for parameter docs
+        :returns: Hex digest to store the preprocessed corpus under
+        """
+        key = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b""):
+                key.update(chunk)
+        settings = {
+            "version": cls.CACHE_VERSION,
+            "tokenizer": tokenizer.fingerprint(),
+            "processor": processor.config,
+            "vocab": Corpus.hash_vocab(word_vectors.word_to_idx),
+            "force_single_answer": force_single_answer,
+            "char_mapping": char_mapping,
+        }
+        key.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return key.hexdigest()
+
+    @staticmethod
+    def hash_vocab(word_to_idx: Dict[str, int]) -> str:
+        """
+        :param word_to_idx: Mapping from each word of a vocabulary to its index
+        :returns: Hex digest of the words and their indices
+        """
+        vocab = hashlib.sha256()
+        for word, idx in word_to_idx.items():
+            vocab.update(f"{idx} {word}\n".encode("utf-8"))
+        return vocab.hexdigest()
+
+    @staticmethod
+    def make_token_mapping(word_to_idx: Dict[str, int]) -> Dict[str, int]:
+        """
+        Builds a token mapping that maps unknown tokens to the UNK index 1
+        :param word_to_idx: Mapping from each known token to its index
+        :returns: Mapping from tokens to indices
+        """
+
+        def return_one() -> int:
+            return 1
+
+        return defaultdict(return_one, word_to_idx)
+
+    @staticmethod
+    def compute_token_counts(corpora: List["Corpus"]) -> Dict[str, int]:
+        """
+        Counts the occurrences of each token in the contexts and questions of
+        the given corpora
+        :param corpora: List of Corpus objects
+        :returns: Mapping from each token to its count
+        """
+        token_counts: Counter = Counter()
+        for corpus in corpora:
+            for ctx in corpus.context_qas:
+                token_counts.update(ctx.tokens.words)
+                for qa in ctx.qas:
+                    token_counts.update(qa.tokens.words)
+        return token_counts
+
+    def set_token_mapping(self, word_to_idx: Dict[str, int]) -> None:
+        """
+        Replaces the token mapping of this corpus, i.e. after the word vectors it
+        was built with have been pruned, and updates its stats accordingly
+        :param word_to_idx: Mapping from each known token to its index
+        """
+        self.token_mapping = Corpus.make_token_mapping(word_to_idx)
+        self.stats = Corpus.compute_stats(
+            self.context_qas, self.token_mapping, self.char_mapping
+        )
+
     @staticmethod
     def read_context_qas(
         data_file: str,
         tokenizer: Tokenizer,
         processor: TextProcessor,
         force_single_answer: bool,
+        num_workers: int = 0,
     ) -> List[ContextQuestionAnswer]:
         """
         Reads a SQUAD formattted JSON file into ContextQuestionAnswer objects
@@ -126,54 +312,118 @@ class Corpus:
         :param tokenizer: Tokenizer object to use to tokenize the text
         :param processor: TextProcessor object to process text before tokenization
         :param force_single_answer: Bool if True only pick first answer span
+        :param num_workers: If nonzero, process the documents in parallel
+            using this many worker processes (default 0: serial processing)
         :returns: List[ContextQuestionAnswer], list of all the contexts and questions
         """
-        contexts: List[ContextQuestionAnswer] = []
-        with open(data_file, "r") as f:
-            json_dict = json.load(f)
-            for doc in json_dict["data"]:
-                for paragraph in doc["paragraphs"]:
-                    context: str = paragraph["context"]
-                    qas: List[QuestionAnswer] = []
-                    for qa in paragraph["qas"]:
-                        q_text: str = qa["question"]
-                        q_id: QuestionId = cast(QuestionId, qa["id"])
-                        answers: Set[Answer] = set()
-                        for answer in qa["answers"]:
-                            text: str = answer["text"]
-                            span_start: int = answer["answer_start"]
-                            tokenized_answer = Answer(
-                                text, span_start, tokenizer, processor
-                            )
-                            answers.add(tokenized_answer)
-                            if force_single_answer:
-                                break
-                        tokenized_question = QuestionAnswer(
-                            q_id, q_text, answers, tokenizer, processor
-                        )
-                        qas.append(tokenized_question)
-                    tokenized_context = ContextQuestionAnswer(
-                        context, qas, tokenizer, processor
+        # Documents are decoded one at a time so the raw JSON of the whole file
+        # is never held in memory next to the processed corpus
+        docs = JsonStreamReader.iter_file(data_file, ["data"])
+        read_doc = partial(
+            _read_doc,
+            tokenizer=tokenizer,
+            processor=processor,
+            force_single_answer=force_single_answer,
+        )
+        if num_workers > 0:
+            # Pool.imap keeps the documents in their original order
+            with Pool(num_workers) as pool:
+                return [
+                    cqa
+                    for context_qas in pool.imap(
+                        read_doc, docs, chunksize=Corpus.READ_CHUNK_DOCS
                     )
-                    contexts.append(tokenized_context)
-        return contexts
+                    for cqa in context_qas
+                ]
+        return [cqa for doc in docs for cqa in read_doc(doc)]
+
+    @staticmethod
+    def stream_context_qas(
+        data_file: str,
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        force_single_answer: bool,
+    ) -> Iterator[ContextQuestionAnswer]:
+        """
+        Reads a SQuAD formatted JSON file one paragraph at a time, so only the
+        paragraph being processed is held in memory
+        Check read_context_qas for parameter docs
+        :returns: Iterator over the ContextQuestionAnswer of every paragraph, in the
+            order of the file
+        """
+        for paragraph in JsonStreamReader.iter_file(data_file, ["data", "paragraphs"]):
+            yield Corpus.read_paragraph(
+                paragraph, tokenizer, processor, force_single_answer
+            )
+
+    @staticmethod
+    def read_doc(
+        doc: Dict[str, Any],
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        force_single_answer: bool,
+    ) -> List[ContextQuestionAnswer]:
+        """
+        Processes a single document from a SQuAD formatted JSON file
+        :param doc: The JSON dict of the document
+        :param tokenizer: Tokenizer object to use to tokenize the text
+        :param processor: TextProcessor object to process text before tokenization
+        :param force_single_answer: Bool if True only pick first answer span
+        :returns: List[ContextQuestionAnswer], one for each paragraph of the document
+        """
+        return [
+            Corpus.read_paragraph(paragraph, tokenizer, processor, force_single_answer)
+            for paragraph in doc["paragraphs"]
+        ]
+
+    @staticmethod
+    def read_paragraph(
+        paragraph: Dict[str, Any],
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        force_single_answer: bool,
+    ) -> ContextQuestionAnswer:
+        """
+        Processes a single paragraph from a SQuAD formatted JSON file
+        :param paragraph: The JSON dict of the paragraph
+        :param tokenizer: Tokenizer object to use to tokenize the text
+        :param processor: TextProcessor object to process text before tokenization
+        :param force_single_answer: Bool if True only pick first answer span
+        :returns: ContextQuestionAnswer of the paragraph and all its questions
+        """
+        context: str = paragraph["context"]
+        qas: List[QuestionAnswer] = []
+        for qa in paragraph["qas"]:
+            q_text: str = qa["question"]
+            q_id: QuestionId = cast(QuestionId, qa["id"])
+            answers: Set[Answer] = set()
+            for answer in qa["answers"]:
+                text: str = answer["text"]
+                span_start: int = answer["answer_start"]
+                tokenized_answer = Answer(text, span_start, tokenizer, processor)
+                answers.add(tokenized_answer)
+                if force_single_answer:
+                    break
+            tokenized_question = QuestionAnswer(
+                q_id, q_text, answers, tokenizer, processor
+            )
+            qas.append(tokenized_question)
+        return ContextQuestionAnswer(context, qas, tokenizer, processor)
 
     @staticmethod
     def compute_char_indices(
-        context_qas: List[ContextQuestionAnswer]
+        context_qas: Iterable[ContextQuestionAnswer]
     ) -> Dict[str, int]:
         """
         Takes in a list of contexts and qas and returns a mapping from each char seen to an index
-        :param context_qas: List[ContextQuestionAnswer] all the context qa's
+        :param context_qas: Iterable[ContextQuestionAnswer] all the context qa's
         :returns: Dict[str, int] mapping from each character seen to an index
         """
         chars: Set[str] = set()
         for ctx in context_qas:
-            for tok in ctx.tokens:
-                chars.update(set(char for char in tok.word))
+            chars.update(ctx.tokens.word_buffer)
             for qa in ctx.qas:
-                for tok in qa.tokens:
-                    chars.update(set(char for char in tok.word))
+                chars.update(qa.tokens.word_buffer)
         char_mapping: Dict[str, int] = {
             char: idx for idx, char in enumerate(chars, 2)
         }  # idx 1 reserved for UNK
@@ -181,51 +431,46 @@ class Corpus:
 
     @staticmethod
     def compute_stats(
-        context_qas: List[ContextQuestionAnswer],
+        context_qas: Iterable[ContextQuestionAnswer],
         token_mapping: Dict[str, int],
         char_mapping: Dict[str, int],
     ) -> CorpusStats:
         """
-        Method that computes statistics given list of context qas and vocab
-        :param context_qas: List of contextQA objects
+        Method that computes statistics given list of context qas and vocab, in a
+        single pass so the context qas can be streamed
+        :param context_qas: Iterable of contextQA objects
         :param vocab: set of strings that contains all tokens in vocab
         :returns: A CorpusStats object with stats of the corpus
         """
-        n_contexts: int = len(context_qas)
-        n_questions: int = sum(len(ctx.qas) for ctx in context_qas)
-        n_answerable: int = sum(
-            len([qa for qa in ctx.qas if qa.answers]) for ctx in context_qas
-        )
-        n_unanswerable: int = sum(
-            len([qa for qa in ctx.qas if not qa.answers]) for ctx in context_qas
-        )
-        single_answer: bool = all(
-            all(len(qa.answers) <= 1 for qa in ctx.qas) for ctx in context_qas
-        )
-        max_context_len: int = max(len(ctx.tokens) for ctx in context_qas)
-        max_q_len: int = max(len(qa.tokens) for ctx in context_qas for qa in ctx.qas)
-
-        max_num_answer_spans = 0
-        max_word_len = 0
+        n_contexts = n_questions = n_answerable = 0
+        max_context_len = max_q_len = max_word_len = 0
+        single_answer = True
         for ctx in context_qas:
-            max_curr_len = max(len(tok.word) for tok in ctx.tokens)
-            max_word_len = max(max_curr_len, max_word_len)
+            n_contexts += 1
+            max_context_len = max(max_context_len, len(ctx.tokens))
+            max_word_len = max(
+                max_word_len, int(np.diff(ctx.tokens.word_offsets).max())
+            )
             for qa in ctx.qas:
-                max_curr_len = max(len(tok.word) for tok in qa.tokens)
-                max_word_len = max(max_curr_len, max_word_len)
-                max_num_answer_spans = max(max_num_answer_spans, len(qa.answers))
+                n_questions += 1
+                n_answerable += bool(qa.answers)
+                single_answer = single_answer and len(qa.answers) <= 1
+                max_q_len = max(max_q_len, len(qa.tokens))
+                max_word_len = max(
+                    max_word_len, int(np.diff(qa.tokens.word_offsets).max())
+                )
 
         return CorpusStats(
             n_contexts=n_contexts,
             n_questions=n_questions,
             n_answerable=n_answerable,
-            n_unanswerable=n_unanswerable,
+            n_unanswerable=n_questions - n_answerable,
             max_context_len=max_context_len,
             max_q_len=max_q_len,
             max_word_len=max_word_len,
             single_answer=single_answer,
             word_vocab_size=max(token_mapping.values()) + 1,
-            char_vocab_size=max(char_mapping.values()) + 1,
+            char_vocab_size=max(char_mapping.values(), default=1) + 1,
         )
 
     def get_single_answer_text(
@@ -283,12 +528,27 @@ class Corpus:
 
     def save(self, file_name: str) -> None:
         """
-        Serializes this corpus to file with file_name
+        Serializes this corpus to file with file_name. The corpus is written to a
+        temporary file first and renamed over file_name, so readers never see a
+        partially written corpus
         :param file_name: File name to save corpus to
         :returns: None
         """
-        with open(file_name, "wb") as f:
+        tmp_file_name = f"{file_name}.tmp"
+        with open(tmp_file_name, "wb") as f:
             pickle.dump(self, f)
+        os.replace(tmp_file_name, file_name)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The default factory of the token mapping is a local function that can't
+        # be pickled, the mapping is rebuilt around the plain dict on load
+        state = self.__dict__.copy()
+        state["token_mapping"] = dict(self.token_mapping)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state["token_mapping"] = Corpus.make_token_mapping(state["token_mapping"])
+        self.__dict__.update(state)
 
 
 class EncodedCorpus(Corpus):
@@ -327,10 +587,23 @@ class EncodedCorpus(Corpus):
         :param char_mapping: Dictionary from characters to indices
         :returns: List of EncodedContextQuestionAnswer objects
         """
-        return [
+        encoded_context_qas = [
             EncodedContextQuestionAnswer(cqa, token_mapping, char_mapping)
             for cqa in context_qas
         ]
+        misaligned_qids = [
+            qa.question_id
+            for ecqa in encoded_context_qas
+            for qa in ecqa.qas
+            if any(answer.misaligned for answer in qa.answers)
+        ]
+        if misaligned_qids:
+            print(
+                f"[WARNING] Answers of {len(misaligned_qids)} questions start or end "
+                f"between tokens and were aligned to the tokens inside their spans, "
+                f"e.g. {', '.join(misaligned_qids[:5])}"
+            )
+        return encoded_context_qas
 
 
 class SampleCorpus(EncodedCorpus):
@@ -361,34 +634,579 @@ class SampleCorpus(EncodedCorpus):
         :returns: List of EncodedSample objects
         """
         return [
-            EncodedSample(ctx.word_encoding, ctx.char_encoding, qa)
-            for ctx in context_qas
+            EncodedSample(
+                ctx.word_encoding,
+                ctx.flat_char_encoding,
+                qa,
+                ctx.char_offsets,
+                context_id=ctx_idx,
+            )
+            for ctx_idx, ctx in enumerate(context_qas)
             for qa in ctx.qas
         ]
 
 
+class ColumnarCorpus:
+    """
+    Class that stores the encoded samples of a corpus in columnar form: flat word id
+    and char id arrays alongside offset tables into them. Each column is saved as a
+    separate .npy file so it can be memory mapped read-only, which lets DataLoader
+    workers share the same pages instead of each holding a copy of the corpus.
+    The columns also hold the context texts and token spans needed to turn
+    predicted spans back into answer texts, so datasets backed by them don't keep
+    the Corpus they were written from.
+    Columns:
+        - question-ids: QuestionId of each sample
+        - sample-contexts: Index of the context of each sample
+        - (context|question)-words: Word ids of all contexts/questions
+        - (context|question)-word-offsets: Start of each context/question in the
+            word ids, with a final entry for the total number of words
+        - (context|question)-chars: Char ids of all words of all contexts/questions
+        - (context|question)-char-offsets: Start of each word in the char ids,
+            with a final entry for the total number of chars
+        - answer-(starts|ends): Context token indices of all answer spans
+        - answer-offsets: Start of each sample's answers in the answer spans
+        - context-token-spans: (start, end) char span of each context token,
+            aligned with context-words
+        - context-texts: Unicode code points of the original texts of all contexts
+        - context-text-offsets: Start of each context in the code points, with a
+            final entry for the total number of code points
+    The corpus stats, char mapping and source file are saved as JSON metadata
+    after all the columns, so its presence marks a complete set of columns
+    """
+
+    COLUMNS: ClassVar[List[str]] = [
+        "question-ids",
+        "sample-contexts",
+        "context-words",
+        "context-word-offsets",
+        "context-chars",
+        "context-char-offsets",
+        "question-words",
+        "question-word-offsets",
+        "question-chars",
+        "question-char-offsets",
+        "answer-starts",
+        "answer-ends",
+        "answer-offsets",
+        "context-token-spans",
+        "context-texts",
+        "context-text-offsets",
+    ]
+    TEXT_ENCODING: ClassVar[str] = "utf-32-le"
+
+    columns: Dict[str, Any]
+    stats: CorpusStats
+    char_mapping: Dict[str, int]
+    source_file: Optional[str]
+    file_prefix: Optional[str]
+    question_idxs: Optional[Dict[QuestionId, int]]
+
+    def __init__(
+        self,
+        columns: Dict[str, Any],
+        stats: CorpusStats,
+        char_mapping: Dict[str, int],
+        source_file: Optional[str] = None,
+        file_prefix: Optional[str] = None,
+    ) -> None:
+        self.columns = columns
+        self.stats = stats
+        self.char_mapping = char_mapping
+        self.source_file = source_file
+        self.file_prefix = file_prefix
+        self.question_idxs = None
+
+    @classmethod
+    def from_corpus(cls, corpus: Corpus) -> "ColumnarCorpus":
+        """
+        Flattens the contexts of a corpus and their encodings into columns
+        :param corpus: Corpus to flatten, its contexts are encoded unless it's an
+            EncodedCorpus already
+        :returns: A ColumnarCorpus holding all the samples of the contexts in order
+        """
+        if isinstance(corpus, EncodedCorpus):
+            context_qas = corpus.encoded_context_qas
+        else:
+            context_qas = EncodedCorpus.encode(
+                corpus.context_qas, corpus.token_mapping, corpus.char_mapping
+            )
+        qas = [qa for ctx in context_qas for qa in ctx.qas]
+        context_words, context_word_offsets = flatten_arrays(
+            [ctx.word_encoding for ctx in context_qas], np.int32
+        )
+        context_chars, context_char_offsets = flatten_char_encodings(
+            [ctx.flat_char_encoding for ctx in context_qas],
+            [ctx.char_offsets for ctx in context_qas],
+        )
+        question_words, question_word_offsets = flatten_arrays(
+            [qa.word_encoding for qa in qas], np.int32
+        )
+        question_chars, question_char_offsets = flatten_char_encodings(
+            [qa.flat_char_encoding for qa in qas], [qa.char_offsets for qa in qas]
+        )
+        answer_starts, answer_offsets = flatten_arrays(
+            [[ans.span_start for ans in qa.answers] for qa in qas], np.int32
+        )
+        answer_ends, _ = flatten_arrays(
+            [[ans.span_end for ans in qa.answers] for qa in qas], np.int32
+        )
+        context_texts, context_text_offsets = flatten_arrays(
+            [
+                np.frombuffer(
+                    ctx.original_text.encode(ColumnarCorpus.TEXT_ENCODING), np.uint32
+                )
+                for ctx in corpus.context_qas
+            ],
+            np.uint32,
+        )
+        columns = {
+            "question-ids": np.array([qa.question_id for qa in qas], dtype=np.str_),
+            "sample-contexts": np.array(
+                [ctx_idx for ctx_idx, ctx in enumerate(context_qas) for _ in ctx.qas],
+                dtype=np.int64,
+            ),
+            "context-words": context_words,
+            "context-word-offsets": context_word_offsets,
+            "context-chars": context_chars,
+            "context-char-offsets": context_char_offsets,
+            "question-words": question_words,
+            "question-word-offsets": question_word_offsets,
+            "question-chars": question_chars,
+            "question-char-offsets": question_char_offsets,
+            "answer-starts": answer_starts,
+            "answer-ends": answer_ends,
+            "answer-offsets": answer_offsets,
+            "context-token-spans": np.concatenate(
+                [ctx.tokens.spans for ctx in corpus.context_qas]
+            ).reshape(-1, 2),
+            "context-texts": context_texts,
+            "context-text-offsets": context_text_offsets,
+        }
+        return cls(columns, corpus.stats, corpus.char_mapping, corpus.source_file)
+
+    @classmethod
+    def from_disk(cls, file_prefix: str, mmap: bool = True) -> "ColumnarCorpus":
+        """
+        Loads the columns and metadata saved under the given prefix
+        :param file_prefix: Prefix of the column files
+        :param mmap: If True memory map the columns read-only instead of
+            reading them into memory (default True)
+        :returns: A ColumnarCorpus object
+        """
+        columns = {
+            column: np.load(
+                f"{file_prefix}-{column}.npy", mmap_mode="r" if mmap else None
+            )
+            for column in cls.COLUMNS
+        }
+        with open(f"{file_prefix}-metadata.json", "r") as metadata_file:
+            metadata = json.load(metadata_file)
+        return cls(
+            columns,
+            CorpusStats(**metadata["stats"]),
+            metadata["char_mapping"],
+            metadata["source_file"],
+            file_prefix if mmap else None,
+        )
+
+    @classmethod
+    def exists(cls, file_prefix: str) -> bool:
+        """
+        Checks whether a complete set of columns is saved under the given prefix
+        :param file_prefix: Prefix of the column files
+        :returns: True if the metadata, which is written last, and all column
+            files exist
+        """
+        return os.path.isfile(f"{file_prefix}-metadata.json") and all(
+            os.path.isfile(f"{file_prefix}-{column}.npy") for column in cls.COLUMNS
+        )
+
+    def save(self, file_prefix: str) -> None:
+        """
+        Saves each column to <file_prefix>-<column>.npy, then the metadata to
+        <file_prefix>-metadata.json. Each file is written to a temporary file first
+        and renamed over its final name, and any old metadata is removed before
+        the columns are replaced, so a crash never leaves behind a set of columns
+        that exists() accepts
+        :param file_prefix: Prefix of the column files
+        """
+        metadata_file_name = f"{file_prefix}-metadata.json"
+        if os.path.isfile(metadata_file_name):
+            os.remove(metadata_file_name)
+        for column in self.COLUMNS:
+            column_file_name = f"{file_prefix}-{column}.npy"
+            # Saving to a file object keeps np.save from appending another .npy
+            with open(f"{column_file_name}.tmp", "wb") as column_file:
+                np.save(column_file, self.columns[column])
+            os.replace(f"{column_file_name}.tmp", column_file_name)
+        with open(f"{metadata_file_name}.tmp", "w") as metadata_file:
+            json.dump(
+                {
+                    "stats": self.stats._asdict(),
+                    "char_mapping": self.char_mapping,
+                    "source_file": self.source_file,
+                },
+                metadata_file,
+            )
+        os.replace(f"{metadata_file_name}.tmp", metadata_file_name)
+
+    def __len__(self) -> int:
+        return len(self.columns["question-ids"])
+
+    def get_context_lengths(self) -> Any:
+        """
+        :returns: numpy array of the context length of each sample
+        """
+        context_lengths = np.diff(self.columns["context-word-offsets"])
+        return context_lengths[self.columns["sample-contexts"]]
+
+    def get_context_ids(self) -> Any:
+        """
+        :returns: numpy array of the index of the context of each sample
+        """
+        return np.asarray(self.columns["sample-contexts"])
+
+    def __getitem__(self, idx: int) -> EncodedSample:
+        ctx_idx = self.columns["sample-contexts"][idx]
+        context_words, context_chars, context_char_offsets = self._get_encodings(
+            "context", ctx_idx
+        )
+        question_words, question_chars, question_char_offsets = self._get_encodings(
+            "question", idx
+        )
+        ans_start, ans_end = self.columns["answer-offsets"][idx : idx + 2]
+        return EncodedSample.from_arrays(
+            QuestionId(str(self.columns["question-ids"][idx])),
+            context_words,
+            context_chars,
+            context_char_offsets,
+            question_words,
+            question_chars,
+            question_char_offsets,
+            np.array(self.columns["answer-starts"][ans_start:ans_end]),
+            np.array(self.columns["answer-ends"][ans_start:ans_end]),
+            context_id=int(ctx_idx),
+        )
+
+    def _get_encodings(self, text_type: str, idx: int) -> Tuple[Any, Any, Any]:
+        """
+        Reads the word and char encodings of a single context or question
+        :param text_type: Either 'context' or 'question'
+        :param idx: Index of the context or question
+        :returns: Tuple of the word id array, the flat char id array and the
+            char offsets of each word into it
+        """
+        word_start, word_end = self.columns[f"{text_type}-word-offsets"][idx : idx + 2]
+        words = self.columns[f"{text_type}-words"][word_start:word_end].astype(
+            np.int64
+        )
+        char_offsets = self.columns[f"{text_type}-char-offsets"][
+            word_start : word_end + 1
+        ]
+        chars = self.columns[f"{text_type}-chars"][
+            char_offsets[0] : char_offsets[-1]
+        ].astype(np.int64)
+        return words, chars, char_offsets - char_offsets[0]
+
+    def get_single_answer_text(
+        self, qid: QuestionId, span_start: int, span_end: int
+    ) -> str:
+        """
+        Turns a single qid, span_start, span_end triplet into the answer text, the
+        same way Corpus.get_single_answer_text does
+        :param qid: The QuestionId of the question
+        :param span_start: Model output index for answer start
+        :param span_end: Model output index for answer end
+        :returns: The original context text from the start of the first token to
+            the end of the last token
+        """
+        if self.question_idxs is None:
+            self.question_idxs = {
+                QuestionId(str(qid)): idx
+                for idx, qid in enumerate(self.columns["question-ids"])
+            }
+        ctx_idx = self.columns["sample-contexts"][self.question_idxs[qid]]
+        word_start, word_end = self.columns["context-word-offsets"][
+            ctx_idx : ctx_idx + 2
+        ]
+        spans = self.columns["context-token-spans"][word_start:word_end]
+        text_start, text_end = self.columns["context-text-offsets"][
+            ctx_idx : ctx_idx + 2
+        ]
+        text = (
+            self.columns["context-texts"][text_start:text_end]
+            .tobytes()
+            .decode(ColumnarCorpus.TEXT_ENCODING)
+        )
+        if not 0 <= span_start <= span_end < len(spans):
+            print(
+                f"Error while reconstructing answer. num tokens: {len(spans)}, "
+                f"first token: {span_start}, last token: {span_end}"
+            )
+            return ""
+        return text[spans[span_start][0] : min(spans[span_end][1], len(text))]
+
+    def get_answer_texts(
+        self, answer_token_idxs: Dict[QuestionId, Tuple[Any, ...]]
+    ) -> Dict[QuestionId, str]:
+        """
+        Check Corpus.get_answer_texts
+        """
+        return {
+            qid: self.get_single_answer_text(qid, span_start, span_end)
+            for qid, (span_start, span_end) in answer_token_idxs.items()
+        }
+
+    def get_gold_answers(self) -> Dict[QuestionId, str]:
+        """
+        Reads the first gold answer of each question from the source file, like
+        Corpus.get_gold_answers
+        """
+        if self.source_file is None:
+            raise Exception("Gold answers not available without the source file")
+        return {
+            qid: answers[0] if answers else ""
+            for qid, answers in SquadScorer.read_gold_answers(self.source_file).items()
+        }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Memory mapped columns are reopened instead of being copied to workers
+        if self.file_prefix is not None:
+            return {"columns": None, "file_prefix": self.file_prefix}
+        return self.__dict__
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        if state["columns"] is None:
+            state = ColumnarCorpus.from_disk(state["file_prefix"]).__dict__
+        self.__dict__.update(state)
+
+
+def flatten_char_encodings(
+    flat_chars: List[Any], char_offsets: List[Any]
+) -> Tuple[Any, Any]:
+    """
+    Concatenates the flat char encodings of several texts into a single flat array
+    with a global offset table
+    :param flat_chars: List of flat char id arrays, one per text
+    :param char_offsets: List of per-word char offset arrays, one per text
+    :returns: Tuple of:
+        - flat: All the char ids concatenated
+        - offsets: int64 array where word i is flat[offsets[i]:offsets[i + 1]]
+    """
+    flat, text_offsets = flatten_arrays(flat_chars, np.int32)
+    offsets = np.concatenate(
+        [
+            offsets[:-1] + base
+            for offsets, base in zip(char_offsets, text_offsets[:-1])
+        ]
+        + [text_offsets[-1:]]
+    ).astype(np.int64)
+    return flat, offsets
+
+
 class QADataset(Dataset):
     """
     Class that turns a SampleCorpus into a PyTorch Dataset
     Main difference is that __getitem__ returns a dict instead of an EncodedSample
+    If window_size is nonzero, contexts longer than window_size are split into
+    overlapping windows of window_size tokens that start every window_stride
+    tokens and each item of the dataset is a single window of a sample
+    Datasets backed by a ColumnarCorpus only keep the memory mapped columns, not
+    the Corpus they were built from
     """
 
-    corpus: SampleCorpus
+    corpus: Optional[Corpus]
+    samples: Union[List[EncodedSample], ColumnarCorpus]
+    window_size: int
+    windows: Optional[Any]  # numpy array
+    scorer: Optional[SquadScorer]
     _source_file: Optional[str]
 
-    def __init__(self, corpus: Corpus) -> None:
-        self.corpus = SampleCorpus(corpus)
-        self._source_file = self.corpus.source_file
+    def __init__(
+        self,
+        corpus: Optional[Corpus],
+        columnar_prefix: Optional[str] = None,
+        window_size: int = 0,
+        window_stride: int = 0,
+        answer_windows_only: bool = False,
+    ) -> None:
+        """
+        :param corpus: Corpus to build the dataset from, can be None if the
+            ColumnarCorpus files at columnar_prefix exist
+        :param columnar_prefix: If specified, the encoded samples are memory mapped
+            from the ColumnarCorpus files with this prefix (the files are
+            written first if they don't exist yet)
+        :param window_size: If nonzero split contexts into windows of at most this
+            many tokens (default 0: use whole contexts)
+        :param window_stride: Number of tokens between the starts of consecutive
+            windows (default 0: window_size, windows don't overlap)
+        :param answer_windows_only: If True only keep the windows that contain an
+            answer, or the first window of samples without answers (default False)
+        """
+        if columnar_prefix is None:
+            if corpus is None:
+                raise ValueError("Need a corpus to build an in-memory dataset")
+            sample_corpus = SampleCorpus(corpus)
+            self.corpus = sample_corpus
+            self.samples = sample_corpus.samples
+            self._source_file = sample_corpus.source_file
+        else:
+            if not ColumnarCorpus.exists(columnar_prefix):
+                if corpus is None:
+                    raise ValueError(
+                        f"No columnar corpus at {columnar_prefix} to load without "
+                        f"a corpus to write it from"
+                    )
+                ColumnarCorpus.from_corpus(corpus).save(columnar_prefix)
+            self.corpus = None
+            self.samples = ColumnarCorpus.from_disk(columnar_prefix)
+            self._source_file = self.samples.source_file
+        self.scorer = None
+        self.window_size = window_size
+        self.windows = None
+        if window_size > 0:
+            self.windows = self.make_windows(
+                window_stride or window_size, answer_windows_only
+            )
+
+    def make_windows(self, window_stride: int, answer_windows_only: bool) -> Any:
+        """
+        Splits the context of each sample into windows of window_size tokens
+        starting every window_stride tokens, with the last window of each context
+        ending at its last token
+        :param window_stride: Number of tokens between the starts of windows
+        :param answer_windows_only: If True only keep windows that contain an answer
+        :returns: int64 numpy array with a (sample index, window start, window
+            context id) row for each window, windows of different samples with the
+            same context and start share the same window context id
+        """
+        if not 0 < window_stride <= self.window_size:
+            raise ValueError(
+                f"Window stride must be between 1 and the window size "
+                f"{self.window_size}, got {window_stride}"
+            )
+        windows = []
+        for sample_idx, context_len in enumerate(self.get_sample_context_lengths()):
+            starts = QADataset.window_starts(
+                int(context_len), self.window_size, window_stride
+            )
+            if answer_windows_only and len(starts) > 1:
+                sample = self.samples[sample_idx]
+                answer_starts = [
+                    start
+                    for start in starts
+                    if sample.window(start, self.window_size).has_answer
+                ]
+                starts = answer_starts or starts[:1]
+            windows.extend((sample_idx, start) for start in starts)
+        windows_array = np.array(windows, dtype=np.int64).reshape(-1, 2)
+        context_ids = self.get_sample_context_ids()[windows_array[:, 0]]
+        _, window_context_ids = np.unique(
+            np.stack([context_ids, windows_array[:, 1]], axis=1),
+            axis=0,
+            return_inverse=True,
+        )
+        return np.concatenate(
+            [windows_array, window_context_ids.reshape(-1, 1).astype(np.int64)], axis=1
+        )
+
+    @staticmethod
+    def window_starts(
+        context_len: int, window_size: int, window_stride: int
+    ) -> List[int]:
+        """
+        :param context_len: Number of tokens in the context
+        :param window_size: Maximum number of tokens in a window
+        :param window_stride: Number of tokens between the starts of windows
+        :returns: Start index of each window of the context, the last window ends
+            at the last token of the context
+        """
+        starts = list(range(0, max(context_len - window_size, 0) + 1, window_stride))
+        if starts[-1] + window_size < context_len:
+            starts.append(context_len - window_size)
+        return starts
 
     def __len__(self) -> int:
-        return self.corpus.n_samples
+        if self.windows is not None:
+            return len(self.windows)
+        return len(self.samples)
 
     def __getitem__(self, idx: int) -> EncodedSample:
-        return self.corpus.samples[idx]
+        if self.windows is not None:
+            sample_idx, start, context_id = self.windows[idx]
+            return self.samples[int(sample_idx)].window(
+                int(start), self.window_size, int(context_id)
+            )
+        return self.samples[idx]
+
+    def get_context_lengths(self) -> Any:
+        """
+        :returns: numpy array of the context length of each item
+        """
+        context_lengths = self.get_sample_context_lengths()
+        if self.windows is not None:
+            return np.minimum(
+                context_lengths[self.windows[:, 0]] - self.windows[:, 1],
+                self.window_size,
+            )
+        return context_lengths
+
+    def get_context_ids(self) -> Any:
+        """
+        :returns: numpy array of the id of the context of each item
+        """
+        if self.windows is not None:
+            return self.windows[:, 2]
+        return self.get_sample_context_ids()
+
+    def get_sample_context_lengths(self) -> Any:
+        """
+        :returns: numpy array of the full context length of each sample
+        """
+        if isinstance(self.samples, ColumnarCorpus):
+            return self.samples.get_context_lengths()
+        return np.array([len(sample.context_words) for sample in self.samples])
+
+    def get_sample_context_ids(self) -> Any:
+        """
+        :returns: numpy array of the id of the context of each sample
+        """
+        if isinstance(self.samples, ColumnarCorpus):
+            return self.samples.get_context_ids()
+        return np.array([sample.context_id for sample in self.samples])
 
     def get_gold_answers(self) -> Dict[QuestionId, str]:
+        if self.corpus is None:
+            return cast(ColumnarCorpus, self.samples).get_gold_answers()
         return self.corpus.get_gold_answers()
 
+    def get_scorer(self, num_workers: int = 0) -> SquadScorer:
+        """
+        Returns the SquadScorer of the dataset's gold answers, building it the
+        first time it's needed
+        :param num_workers: Number of worker processes the scorer scores with
+        :returns: A SquadScorer for answers to the dataset's questions
+        """
+        if self.scorer is None:
+            # The source file has every annotated answer, even if the corpus
+            # was read with a single answer per question
+            if self._source_file is not None or self.corpus is None:
+                self.scorer = SquadScorer.from_file(self.source_file, num_workers)
+            else:
+                self.scorer = SquadScorer.from_context_qas(
+                    self.corpus.context_qas, num_workers
+                )
+        return self.scorer
+
+    def close_scorer(self) -> None:
+        """
+        Stops the worker processes of the dataset's scorer if it has any, they're
+        restarted if the scorer is used again
+        """
+        if self.scorer is not None:
+            self.scorer.close()
+
     def get_answer_texts(
         self, answer_token_idxs: Dict[QuestionId, Tuple[Any, ...]]
     ) -> Dict[QuestionId, str]:
@@ -401,10 +1219,16 @@ class QADataset(Dataset):
             end prediction of the model
         :returns: A Mapping from QuestionId's to strings
         """
+        if self.corpus is None:
+            return cast(ColumnarCorpus, self.samples).get_answer_texts(
+                answer_token_idxs
+            )
         return self.corpus.get_answer_texts(answer_token_idxs)
 
     @property
     def stats(self) -> CorpusStats:
+        if self.corpus is None:
+            return cast(ColumnarCorpus, self.samples).stats
         return self.corpus.stats
 
     @property
@@ -419,15 +1243,33 @@ class TrainDataset(QADataset):
     """
     Class that holds a dataset used for training a model
     (and therefore is the ground truth for character -> id mappinggs)
+    The token mapping is None for datasets backed by a ColumnarCorpus
     """
 
-    token_mapping: Dict[str, int]
+    token_mapping: Optional[Dict[str, int]]
     char_mapping: Dict[str, int]
 
-    def __init__(self, corpus: Corpus) -> None:
-        super().__init__(corpus)
-        self.token_mapping = corpus.token_mapping
-        self.char_mapping = corpus.char_mapping
+    def __init__(
+        self,
+        corpus: Optional[Corpus],
+        columnar_prefix: Optional[str] = None,
+        window_size: int = 0,
+        window_stride: int = 0,
+    ) -> None:
+        # Windows without an answer have no training signal
+        super().__init__(
+            corpus,
+            columnar_prefix,
+            window_size,
+            window_stride,
+            answer_windows_only=True,
+        )
+        if self.corpus is None:
+            self.token_mapping = None
+            self.char_mapping = cast(ColumnarCorpus, self.samples).char_mapping
+        else:
+            self.token_mapping = self.corpus.token_mapping
+            self.char_mapping = self.corpus.char_mapping
 
     @classmethod
     def load_dataset(
@@ -437,6 +1279,11 @@ class TrainDataset(QADataset):
         tokenizer: Tokenizer,
         processor: TextProcessor,
         force_single_answer: bool = True,
+        num_workers: int = 0,
+        columnar_prefix: Optional[str] = None,
+        window_size: int = 0,
+        window_stride: int = 0,
+        cache_dir: Optional[str] = None,
     ) -> QADataset:
         """
         Reads the given qa data file and processes it into a TrainDataset using
@@ -447,20 +1294,28 @@ class TrainDataset(QADataset):
         :param processor: TextProcessor object to apply to the text before tokenization
         :param force_single_answer: if True only include the first answer span
             (default True)
+        :param num_workers: Number of worker processes to preprocess the file with
+            (default 0: serial processing)
+        :param columnar_prefix: If specified memory map the encoded samples from
+            ColumnarCorpus files with this prefix, writing them if they don't exist
+        :param window_size: If nonzero split contexts into windows of at most this
+            many tokens, keeping only windows that contain an answer (default 0)
+        :param window_stride: Number of tokens between the starts of consecutive
+            windows (default 0: window_size)
+        :param cache_dir: If specified cache the preprocessed corpus in this
+            directory (default None)
         :returns: A TrainDataset object
         """
-        corpus: Corpus
-        try:
-            corpus = Corpus.from_disk(filename)
-        except (IOError, pickle.UnpicklingError) as e:
-            corpus = Corpus.from_raw(
-                filename,
-                tokenizer,
-                processor,
-                vectors,
-                force_single_answer=force_single_answer,
-            )
-        return cls(corpus)
+        corpus = Corpus.from_file(
+            filename,
+            tokenizer,
+            processor,
+            vectors,
+            force_single_answer=force_single_answer,
+            num_workers=num_workers,
+            cache_dir=cache_dir,
+        )
+        return cls(corpus, columnar_prefix, window_size, window_stride)
 
 
 class EvalDataset(QADataset):
@@ -469,8 +1324,14 @@ class EvalDataset(QADataset):
     (and therefore needs the training dataset's character -> id mappings to be instantiated)
     """
 
-    def __init__(self, corpus: Corpus) -> None:
-        super().__init__(corpus)
+    def __init__(
+        self,
+        corpus: Optional[Corpus],
+        columnar_prefix: Optional[str] = None,
+        window_size: int = 0,
+        window_stride: int = 0,
+    ) -> None:
+        super().__init__(corpus, columnar_prefix, window_size, window_stride)
 
     @classmethod
     def load_dataset(
@@ -481,6 +1342,11 @@ class EvalDataset(QADataset):
         tokenizer: Tokenizer,
         processor: TextProcessor,
         force_single_answer: bool = True,
+        num_workers: int = 0,
+        columnar_prefix: Optional[str] = None,
+        window_size: int = 0,
+        window_stride: int = 0,
+        cache_dir: Optional[str] = None,
     ) -> QADataset:
         """
         Reads the given qa data file and processes it into a TrainDataset using
@@ -492,18 +1358,242 @@ class EvalDataset(QADataset):
         :param processor: TextProcessor object to apply to the text before tokenization
         :param force_single_answer: if True only include first answer span as true
             (default True)
+        :param num_workers: Number of worker processes to preprocess the file with
+            (default 0: serial processing)
+        :param columnar_prefix: If specified memory map the encoded samples from
+            ColumnarCorpus files with this prefix, writing them if they don't exist
+        :param window_size: If nonzero split contexts into windows of at most this
+            many tokens (default 0)
+        :param window_stride: Number of tokens between the starts of consecutive
+            windows (default 0: window_size)
+        :param cache_dir: If specified cache the preprocessed corpus in this
+            directory (default None)
         :returns: An EvalDataset object
         """
-        corpus: Corpus
-        try:
-            corpus = Corpus.from_disk(filename)
-        except (IOError, pickle.UnpicklingError) as e:
-            corpus = Corpus.from_raw(
-                filename,
-                tokenizer,
-                processor,
-                vectors,
-                force_single_answer=force_single_answer,
-                char_mapping=char_mapping,
+        corpus = Corpus.from_file(
+            filename,
+            tokenizer,
+            processor,
+            vectors,
+            force_single_answer=force_single_answer,
+            char_mapping=char_mapping,
+            num_workers=num_workers,
+            cache_dir=cache_dir,
+        )
+        return cls(corpus, columnar_prefix, window_size, window_stride)
+
+
+class StreamingQADataset(IterableDataset):
+    """
+    Training dataset that streams the samples of a SQuAD formatted JSON file
+    instead of holding the whole corpus in memory. Every paragraph is parsed,
+    tokenized and encoded only when it's reached, so training can run on files
+    that don't fit in memory.
+    With several DataLoader workers each worker encodes every num_workers-th
+    paragraph of the file. Every worker still parses the whole file, which is cheap
+    next to tokenizing it.
+    Samples are shuffled within a buffer of shuffle_buffer_size samples instead of
+    across the whole dataset. The dataset has no length and can't be bucketed.
+    If window_size is nonzero, longer contexts are split into windows as in
+    TrainDataset and only the windows that contain an answer are kept
+    """
+
+    data_file: str
+    tokenizer: Tokenizer
+    processor: TextProcessor
+    token_mapping: Dict[str, int]
+    char_mapping: Dict[str, int]
+    stats: CorpusStats
+    force_single_answer: bool
+    window_size: int
+    window_stride: int
+    shuffle_buffer_size: int
+
+    def __init__(
+        self,
+        data_file: str,
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        token_mapping: Dict[str, int],
+        char_mapping: Dict[str, int],
+        stats: CorpusStats,
+        force_single_answer: bool = True,
+        window_size: int = 0,
+        window_stride: int = 0,
+        shuffle_buffer_size: int = 0,
+    ) -> None:
+        """
+        :param data_file: SQuAD formatted JSON file to stream
+        :param tokenizer: Tokenizer object used to tokenize the text
+        :param processor: TextProcessor object to apply to the text before
+            tokenization
+        :param token_mapping: Mapping from tokens to word ids
+        :param char_mapping: Mapping from chars to char ids
+        :param stats: CorpusStats of the file
+        :param force_single_answer: if True only include the first answer span
+            (default True)
+        :param window_size: If nonzero split contexts into windows of at most this
+            many tokens, keeping only windows that contain an answer (default 0)
+        :param window_stride: Number of tokens between the starts of consecutive
+            windows (default 0: window_size)
+        :param shuffle_buffer_size: Number of samples to shuffle among, 0 or 1
+            to keep the order of the file (default 0)
+        """
+        window_stride = window_stride or window_size
+        if window_size > 0 and not 0 < window_stride <= window_size:
+            raise ValueError(
+                f"Window stride must be between 1 and the window size "
+                f"{window_size}, got {window_stride}"
             )
-        return cls(corpus)
+        self.data_file = data_file
+        self.tokenizer = tokenizer
+        self.processor = processor
+        self.token_mapping = token_mapping
+        self.char_mapping = char_mapping
+        self.stats = stats
+        self.force_single_answer = force_single_answer
+        self.window_size = window_size
+        self.window_stride = window_stride
+        self.shuffle_buffer_size = shuffle_buffer_size
+
+    @classmethod
+    def from_file(
+        cls,
+        data_file: str,
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        word_vectors: WordVectors,
+        force_single_answer: bool = True,
+        char_mapping: Optional[Dict[str, int]] = None,
+        window_size: int = 0,
+        window_stride: int = 0,
+        shuffle_buffer_size: int = 0,
+    ) -> "StreamingQADataset":
+        """
+        Builds a streaming dataset, computing the stats of the file and its char
+        mapping (if not given) in a single streaming pass over it
+        :param word_vectors: WordVectors to build the token mapping from
+        :param char_mapping: Optional mapping from chars to ints, computed from
+            the file if not specified
+        Check __init__ for the other parameter docs
+        :returns: A StreamingQADataset object
+        """
+        token_mapping = Corpus.make_token_mapping(word_vectors.word_to_idx)
+        chars: Set[str] = set()
+
+        def collect_chars(
+            context_qas: Iterable[ContextQuestionAnswer]
+        ) -> Iterator[ContextQuestionAnswer]:
+            for cqa in context_qas:
+                chars.update(cqa.tokens.word_buffer)
+                for qa in cqa.qas:
+                    chars.update(qa.tokens.word_buffer)
+                yield cqa
+
+        context_qas = Corpus.stream_context_qas(
+            data_file, tokenizer, processor, force_single_answer
+        )
+        if char_mapping is not None:
+            stats = Corpus.compute_stats(context_qas, token_mapping, char_mapping)
+        else:
+            stats = Corpus.compute_stats(
+                collect_chars(context_qas), token_mapping, {}
+            )
+            char_mapping = {char: idx for idx, char in enumerate(chars, 2)}
+            stats = stats._replace(char_vocab_size=len(char_mapping) + 2)
+        return cls(
+            data_file,
+            tokenizer,
+            processor,
+            token_mapping,
+            char_mapping,
+            stats,
+            force_single_answer,
+            window_size,
+            window_stride,
+            shuffle_buffer_size,
+        )
+
+    def __iter__(self) -> Iterator[EncodedSample]:
+        worker_info = get_worker_info()
+        if worker_info is None:
+            samples = self.iter_samples(0, 1)
+        else:
+            samples = self.iter_samples(worker_info.id, worker_info.num_workers)
+        if self.shuffle_buffer_size > 1:
+            return StreamingQADataset.shuffle(samples, self.shuffle_buffer_size)
+        return samples
+
+    def iter_samples(self, worker_id: int, num_workers: int) -> Iterator[EncodedSample]:
+        """
+        :param worker_id: Index of the worker to read the samples of
+        :param num_workers: Number of workers the paragraphs are split between
+        :returns: Iterator over the samples (or windows) of every num_workers-th
+            paragraph of the file starting with the worker_id-th one, in order
+        """
+        paragraphs = JsonStreamReader.iter_file(self.data_file, ["data", "paragraphs"])
+        for ctx_idx, paragraph in enumerate(paragraphs):
+            if ctx_idx % num_workers != worker_id:
+                continue
+            ctx = EncodedContextQuestionAnswer(
+                Corpus.read_paragraph(
+                    paragraph, self.tokenizer, self.processor, self.force_single_answer
+                ),
+                self.token_mapping,
+                self.char_mapping,
+            )
+            for qa in ctx.qas:
+                sample = EncodedSample(
+                    ctx.word_encoding,
+                    ctx.flat_char_encoding,
+                    qa,
+                    ctx.char_offsets,
+                    context_id=ctx_idx,
+                )
+                if self.window_size > 0:
+                    windows = [
+                        sample.window(start, self.window_size)
+                        for start in QADataset.window_starts(
+                            len(sample.context_words),
+                            self.window_size,
+                            self.window_stride,
+                        )
+                    ]
+                    # Windows without an answer have no training signal
+                    answer_windows = [window for window in windows if window.has_answer]
+                    yield from answer_windows or windows[:1]
+                else:
+                    yield sample
+
+    @staticmethod
+    def shuffle(samples: Iterator[Any], buffer_size: int) -> Iterator[Any]:
+        """
+        Shuffles a stream with a buffer: each incoming item replaces a random
+        item of the full buffer, which is yielded
+        :param samples: Iterator to shuffle
+        :param buffer_size: Number of items to keep in the buffer
+        :returns: Iterator over the shuffled items
+        """
+        buffer: List[Any] = []
+        for sample in samples:
+            if len(buffer) < buffer_size:
+                buffer.append(sample)
+                continue
+            idx = random.randrange(buffer_size)
+            yield buffer[idx]
+            buffer[idx] = sample
+        random.shuffle(buffer)
+        yield from buffer
+
+
+def _read_doc(
+    doc: Dict[str, Any],
+    tokenizer: Tokenizer,
+    processor: TextProcessor,
+    force_single_answer: bool,
+) -> List[ContextQuestionAnswer]:
+    """
+    Module level wrapper around Corpus.read_doc so it can be pickled
+    and sent to worker processes
+    """
+    return Corpus.read_doc(doc, tokenizer, processor, force_single_answer)
@@ -33,6 +33,7 @@ class DocQAConfig:
     attention_linear_hidden_size: int
     use_self_attention: bool
     batch_size: int
+    attention_block_size: int
 
     def __init__(
         self,
@@ -41,12 +42,14 @@ class DocQAConfig:
         attention_linear_hidden_size: int,
         use_self_attention: bool,
         batch_size: int,
+        attention_block_size: int = 0,
     ) -> None:
         self.contextual_encoder_config = contextual_encoder_config
         self.dropout_prob = dropout_prob
         self.attention_linear_hidden_size = attention_linear_hidden_size
         self.batch_size = batch_size
         self.use_self_attention = use_self_attention
+        self.attention_block_size = attention_block_size
 
 
 class DocQAOutput(nn.Module):
@@ -97,14 +100,12 @@ class DocQAOutput(nn.Module):
             orig_idxs,
         )
 
-        start_predictions = self.start_predictor(
+        start_scores = self.start_predictor(
             start_modeled_ctx, mask=context_mask
         ).squeeze(2)
-        start_predictions = self.softmax(start_predictions, mask=context_mask)
-        end_predictions = self.end_predictor(
-            end_modeled_ctx, mask=context_mask
-        ).squeeze(2)
-        end_predictions = self.softmax(end_predictions, mask=context_mask)
+        start_predictions = self.softmax(start_scores, mask=context_mask)
+        end_scores = self.end_predictor(end_modeled_ctx, mask=context_mask).squeeze(2)
+        end_predictions = self.softmax(end_scores, mask=context_mask)
 
         context_length_sorted = context_encoding[length_idxs]
         context_packed: PackedSequence = pack_padded_sequence(
@@ -122,6 +123,8 @@ class DocQAOutput(nn.Module):
             start_logits=start_predictions,
             end_logits=end_predictions,
             no_ans_logits=no_answer_predictions,
+            start_scores=start_scores,
+            end_scores=end_scores,
         )
 
 
@@ -146,7 +149,9 @@ class DocQAPredictor(PredictorModel):
             self.embed.embedding_dim, self.config.contextual_encoder_config
         )
         self.bi_attention = DocQABidirectionalAttention(
-            self.embedding_encoder.output_size, self.config.attention_linear_hidden_size
+            self.embedding_encoder.output_size,
+            self.config.attention_linear_hidden_size,
+            self.config.attention_block_size,
         )
         self.attended_ctx_encoder: ContextualEncoder = ContextualEncoder(
             self.bi_attention.final_encoding_size,
@@ -164,6 +169,7 @@ class DocQAPredictor(PredictorModel):
         self.self_attention: SelfAttention = SelfAttention(
             self.attended_ctx_encoder.output_size,
             self.config.attention_linear_hidden_size,
+            self.config.attention_block_size,
         )
         self.output_layer = DocQAOutput(
             self.config.contextual_encoder_config, self.bi_attention.final_encoding_size
@@ -174,18 +180,8 @@ class DocQAPredictor(PredictorModel):
         Check base class method for docs
         """
 
-        question = self.embed(batch.question_words, batch.question_chars)
-        question = self.embedding_encoder(
-            question,
-            batch.question_lens,
-            batch.question_len_idxs,
-            batch.question_orig_idxs,
-        )
-
-        context = self.embed(batch.context_words, batch.context_chars)
-        context = self.embedding_encoder(
-            context, batch.context_lens, batch.context_len_idxs, batch.context_orig_idxs
-        )
+        question = self.encode_question(batch)
+        context = self.encode_context(batch)
 
         context = self.bi_attention(context, question, context_mask=batch.context_mask)
 
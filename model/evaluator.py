@@ -3,16 +3,15 @@ Module that describes evaluator classes. In general these take
 ModelPredictions logits from Predictor classes and output final predictions
 as well as losses for training.
 """
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Iterable, NamedTuple, Tuple
 
-import numpy as np
 import torch as t
 import torch.nn as nn
 
 from model.batcher import QABatch
 from model.predictor import ModelPredictions
 from model.qa import QuestionId
-from model.modules.masked import MaskedOp, MaskTime, MaskMode
+from model.modules.masked import MaskedOp, MaskTime, MaskMode, mask_fill_value
 
 
 class Evaluator(nn.Module):
@@ -31,7 +30,8 @@ class SingleClassLossEvaluator(Evaluator):
     """
     Simple Evaluator for data where there is
     a single correct answer.
-    Uses NLLoss after masking the input logits, expects LogSoftmax'ed logits
+    Uses NLLoss after masking the input logits, expects LogSoftmax'ed logits.
+    The loss is always computed in float32
     """
 
     loss_op: MaskedOp
@@ -39,7 +39,11 @@ class SingleClassLossEvaluator(Evaluator):
     def __init__(self) -> None:
         super().__init__()
         self.loss_op = MaskedOp(
-            nn.NLLLoss(), MaskMode.subtract, MaskTime.pre, mask_value=1e30
+            nn.NLLLoss(),
+            MaskMode.subtract,
+            MaskTime.pre,
+            mask_value=1e30,
+            compute_dtype=t.float32,
         )
 
     def forward(self, batch: QABatch, model_predictions: ModelPredictions) -> t.Tensor:
@@ -59,7 +63,7 @@ class MultiClassLossEvaluator(Evaluator):
     """
     Simple Evaluator that computes multi-class loss on all
     starting and ending points for multi-answer training
-    Uses BCEWithLogitsLoss after masking the logits
+    Uses BCEWithLogitsLoss after masking the logits, computed in float32
     """
 
     loss_op: MaskedOp
@@ -67,7 +71,11 @@ class MultiClassLossEvaluator(Evaluator):
     def __init__(self) -> None:
         super().__init__()
         self.loss_op = MaskedOp(
-            nn.BCEWithLogitsLoss(), MaskMode.subtract, MaskTime.pre, mask_value=1e30
+            nn.BCEWithLogitsLoss(),
+            MaskMode.subtract,
+            MaskTime.pre,
+            mask_value=1e30,
+            compute_dtype=t.float32,
         )
 
     def forward(self, batch: QABatch, model_predictions: ModelPredictions) -> t.Tensor:
@@ -84,28 +92,106 @@ class MultiClassLossEvaluator(Evaluator):
         return start_loss + end_loss
 
 
+BestSpans = NamedTuple(
+    "BestSpans",
+    [("span_starts", t.LongTensor), ("span_ends", t.LongTensor), ("scores", t.Tensor)],
+)
+
+
+def get_best_spans(
+    start_logits: t.Tensor,
+    end_logits: t.Tensor,
+    context_mask: t.Tensor,
+    max_answer_len: int = 0,
+) -> BestSpans:
+    """
+    Finds the highest scoring (start, end) span for every sample in a batch at once.
+    A span's score is start_logits[start] + end_logits[end] (the joint log probability
+    for LogSoftmax'ed logits), only spans with start <= end that lie entirely within
+    the context are considered.
+    :param start_logits: Span start logits (batch_len, max_context_len)
+    :param end_logits: Span end logits (batch_len, max_context_len)
+    :param context_mask: Context mask in the same ordering as the logits
+        (batch_len, max_context_len)
+    :param max_answer_len: If nonzero only consider spans of at most this many tokens
+        (default 0: unlimited)
+    :returns: A BestSpans object with the span starts, span ends and span scores
+        of the best span of each sample, all on the same device as the logits
+    """
+    batch_len, max_context_len = start_logits.size()
+    # scores[b, s, e] = start_logits[b, s] + end_logits[b, e]
+    scores = start_logits.unsqueeze(2) + end_logits.unsqueeze(1)
+    positions = t.arange(max_context_len, device=scores.device)
+    span_lengths = positions.unsqueeze(0) - positions.unsqueeze(1)
+    span_mask = span_lengths >= 0
+    if max_answer_len > 0:
+        span_mask = span_mask & (span_lengths < max_answer_len)
+    context_mask = context_mask != 0
+    span_mask = (
+        span_mask.unsqueeze(0) & context_mask.unsqueeze(2) & context_mask.unsqueeze(1)
+    )
+    scores = scores.masked_fill(~span_mask, mask_fill_value(scores.dtype))
+    best_scores, best_idxs = scores.view(batch_len, -1).max(1)
+    return BestSpans(
+        span_starts=best_idxs // max_context_len,
+        span_ends=best_idxs % max_context_len,
+        scores=best_scores,
+    )
+
+
 def get_answer_token_idxs(
-    batch: QABatch, model_predictions: ModelPredictions
+    batch: QABatch, model_predictions: ModelPredictions, max_answer_len: int = 0
 ) -> Dict[QuestionId, Tuple[Any, ...]]:
     """
     Given a ModelPredictions object and text QABatch object for the batch that the predictions
-    are from, return a QuestionId -> (answer span start token idx, answe span end token idx) mapping.
+    are from, return a QuestionId -> (answer span start token idx, answe span end token idx, score) mapping.
+    Token indices are relative to the full paragraph, so spans predicted on windows
+    of the same paragraph can be compared by their scores
+    :param batch: QABatch the predictions were made on
+    :param model_predictions: ModelPredictions for the batch
+    :param max_answer_len: If nonzero only consider spans of at most this many tokens
+        (default 0: unlimited)
+    :returns: Mapping from each QuestionId in the batch to its best span and its score
+        (the best over all windows of the question in the batch)
+    """
+    best_spans = get_best_spans(
+        model_predictions.start_logits,
+        model_predictions.end_logits,
+        batch.context_mask,
+        max_answer_len,
+    )
+    context_offsets = (
+        batch.context_offsets.tolist()
+        if batch.context_offsets is not None
+        else [0] * len(batch)
+    )
+    qid_to_answer: Dict[QuestionId, Tuple[Any, ...]] = {}
+    merge_best_answers(
+        qid_to_answer,
+        (
+            (qid, (span_start + offset, span_end + offset, score))
+            for qid, span_start, span_end, score, offset in zip(
+                batch.question_ids,
+                best_spans.span_starts.tolist(),
+                best_spans.span_ends.tolist(),
+                best_spans.scores.tolist(),
+                context_offsets,
+            )
+        ),
+    )
+    return qid_to_answer
+
+
+def merge_best_answers(
+    qid_to_answer: Dict[QuestionId, Tuple[Any, ...]],
+    answers: Iterable[Tuple[QuestionId, Tuple[Any, ...]]],
+) -> None:
+    """
+    Merges (span start, span end, score) answers into qid_to_answer in place,
+    keeping the highest scoring answer of each question
+    :param qid_to_answer: Mapping from QuestionId's to their best answer so far
+    :param answers: (QuestionId, answer) pairs to merge
     """
-    qid_to_ans: Dict[QuestionId, Tuple[Any, ...]] = {}
-    all_start_logits = model_predictions.start_logits.to(t.device("cpu")).numpy()
-    all_end_logits = model_predictions.end_logits.to(t.device("cpu")).numpy()
-    for qid, context_len, start_logits, end_logits in zip(
-        batch.question_ids, batch.context_lens, all_start_logits, all_end_logits
-    ):
-        best_score = None
-        best_ans = (0, 0)
-        for start_idx in range(context_len):
-            start_logit = start_logits[start_idx]
-            for end_idx in range(start_idx, context_len):
-                end_logit = end_logits[end_idx]
-                score = start_logit * end_logit
-                if best_score is None or score <= best_score:
-                    best_ans = (start_idx, end_idx)
-                    best_score = score
-        qid_to_ans[qid] = best_ans
-    return qid_to_ans
+    for qid, answer in answers:
+        if qid not in qid_to_answer or answer[2] > qid_to_answer[qid][2]:
+            qid_to_answer[qid] = answer
@@ -0,0 +1,328 @@
+"""
+Module that holds an in-process inference engine to answer raw
+(context, question) pairs with a trained PredictorModel
+"""
+
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import torch as t
+
+from model.batcher import QABatch, collate_batch
+from model.corpus import Corpus, SampleCorpus
+from model.evaluator import get_best_spans
+from model.modules.masked import mask_fill_value
+from model.predictor import PredictorModel, ModelPredictions
+from model.qa import (
+    ContextQuestionAnswer,
+    EncodedContextQuestionAnswer,
+    EncodedSample,
+    QuestionAnswer,
+    QuestionId,
+)
+from model.text_processor import TextProcessor
+from model.tokenizer import Tokenizer, CachingTokenizer, RegexTokenizer
+from model.wv import WordVectors
+
+InferenceConfig = NamedTuple(
+    "InferenceConfig",
+    [
+        ("batch_size", int),
+        ("max_question_size", int),
+        ("max_context_size", int),
+        ("max_answer_size", int),
+        ("context_cache_mb", int),
+        ("device", t.device),
+    ],
+)
+
+AnswerPrediction = NamedTuple(
+    "AnswerPrediction",
+    [
+        ("text", str),
+        ("char_span", Tuple[int, int]),
+        ("score", float),
+        ("no_answer_score", Optional[float]),
+    ],
+)
+
+
+class InferenceEngine:
+    """
+    Answers raw (context, question) pairs with a trained model. The model and the
+    token and char mappings it was trained with are loaded once, pairs are then
+    tokenized, encoded and run through the model in micro-batches.
+    Answers are returned as text spans of the original contexts alongside their
+    character offsets and scores (the joint log probability of the span).
+    If context_cache_mb is nonzero, the encodings of recently seen contexts are
+    cached so further questions about them only run the question-dependent layers
+    """
+
+    model: PredictorModel
+    token_mapping: Dict[str, int]
+    char_mapping: Dict[str, int]
+    tokenizer: Tokenizer
+    processor: TextProcessor
+    config: InferenceConfig
+
+    def __init__(
+        self,
+        model: PredictorModel,
+        token_mapping: Dict[str, int],
+        char_mapping: Dict[str, int],
+        config: InferenceConfig,
+        tokenizer: Optional[Tokenizer] = None,
+        processor: Optional[TextProcessor] = None,
+    ) -> None:
+        """
+        :param model: Trained PredictorModel
+        :param token_mapping: Token to id mapping the model was trained with
+        :param char_mapping: Char to id mapping the model was trained with
+        :param config: InferenceConfig to pull parameters from
+        :param tokenizer: Tokenizer the model was trained with
+            (default cached RegexTokenizer, as in train.py)
+        :param processor: TextProcessor the model was trained with
+            (default lowercasing, as in train.py)
+        """
+        self.model = model.to(config.device)
+        self.model.eval()
+        if config.context_cache_mb > 0:
+            self.model.enable_context_cache(config.context_cache_mb * 2 ** 20)
+        self.token_mapping = token_mapping
+        self.char_mapping = char_mapping
+        self.config = config
+        self.tokenizer = (
+            tokenizer if tokenizer is not None else CachingTokenizer(RegexTokenizer())
+        )
+        self.processor = (
+            processor if processor is not None else TextProcessor({"lowercase": True})
+        )
+
+    @classmethod
+    def from_files(
+        cls,
+        model_file: str,
+        vector_file: str,
+        char_mapping_file: str,
+        config: InferenceConfig,
+        tokenizer: Optional[Tokenizer] = None,
+        processor: Optional[TextProcessor] = None,
+    ) -> "InferenceEngine":
+        """
+        Loads a saved model alongside the mappings it was trained with
+        :param model_file: File the model was saved to by train.py
+        :param vector_file: Word vectors the model was trained with, either the
+            original vector file or the pruned <run name>-vocab vectors
+        :param char_mapping_file: JSON file of the char mapping saved by train.py
+        :param config: InferenceConfig to pull parameters from
+        :param tokenizer: Tokenizer the model was trained with (default None)
+        :param processor: TextProcessor the model was trained with (default None)
+        :returns: An InferenceEngine object
+        """
+        # Whole model pickles need weights_only=False, only load trusted files
+        model = t.load(model_file, map_location=config.device, weights_only=False)
+        vectors = WordVectors.load_vectors(vector_file)
+        with open(char_mapping_file, "r") as f:
+            char_mapping: Dict[str, int] = json.load(f)
+        return cls(
+            model,
+            Corpus.make_token_mapping(vectors.word_to_idx),
+            char_mapping,
+            config,
+            tokenizer,
+            processor,
+        )
+
+    def answer(self, context: str, question: str) -> AnswerPrediction:
+        """
+        Answers a single question about a context
+        :param context: Context paragraph text
+        :param question: Question text
+        :returns: An AnswerPrediction object
+        """
+        return self.answer_batch([(context, question)])[0]
+
+    def answer_batch(self, pairs: List[Tuple[str, str]]) -> List[AnswerPrediction]:
+        """
+        Answers a list of questions about contexts. Each distinct context is
+        tokenized, encoded and run through the context encoder only once per
+        micro-batch
+        :param pairs: List of (context, question) text pairs
+        :returns: An AnswerPrediction object for each pair, in order
+        """
+        samples, contexts = self.make_samples(pairs)
+        predictions: List[AnswerPrediction] = []
+        for batch_start in range(0, len(samples), self.config.batch_size):
+            batch_end = batch_start + self.config.batch_size
+            predictions.extend(
+                self.answer_samples(
+                    samples[batch_start:batch_end], contexts[batch_start:batch_end]
+                )
+            )
+        return predictions
+
+    def answer_paragraphs(
+        self, question: str, paragraphs: List[str]
+    ) -> Tuple[int, AnswerPrediction]:
+        """
+        Answers a single question against several paragraphs with shared
+        normalization: span scores are normalized over the spans of all the
+        paragraphs together rather than within each paragraph, so the best span
+        of each paragraph can be compared directly
+        :param question: Question text
+        :param paragraphs: Non-empty list of paragraph texts
+        :returns: Tuple of the index of the paragraph the answer is in and the
+            AnswerPrediction, whose score is the shared-normalized log probability
+        """
+        samples, contexts = self.make_samples(
+            [(paragraph, question) for paragraph in paragraphs]
+        )
+        span_starts: List[int] = []
+        span_ends: List[int] = []
+        span_scores: List[t.Tensor] = []
+        start_norms: List[t.Tensor] = []
+        end_norms: List[t.Tensor] = []
+        no_answer_scores: List[Optional[float]] = []
+        for batch_start in range(0, len(samples), self.config.batch_size):
+            batch: QABatch = collate_batch(
+                samples[batch_start : batch_start + self.config.batch_size],
+                self.config.max_question_size,
+                self.config.max_context_size,
+                group_contexts=True,
+            )
+            with t.no_grad():
+                batch.to(self.config.device)
+                predictions: ModelPredictions = self.model(batch)
+                best_spans = get_best_spans(
+                    predictions.start_scores,
+                    predictions.end_scores,
+                    batch.context_mask,
+                    self.config.max_answer_size,
+                )
+                padding = batch.context_mask == 0
+                fill_value = mask_fill_value(predictions.start_scores.dtype)
+                start_scores = predictions.start_scores.masked_fill(padding, fill_value)
+                end_scores = predictions.end_scores.masked_fill(padding, fill_value)
+                start_norms.append(t.logsumexp(start_scores, 1))
+                end_norms.append(t.logsumexp(end_scores, 1))
+            span_starts.extend(best_spans.span_starts.tolist())
+            span_ends.extend(best_spans.span_ends.tolist())
+            span_scores.append(best_spans.scores)
+            if predictions.no_ans_logits is not None:
+                no_answer_scores.extend(predictions.no_ans_logits.view(-1).tolist())
+            else:
+                no_answer_scores.extend([None] * len(batch))
+        scores = t.cat(span_scores) - (
+            t.logsumexp(t.cat(start_norms), 0) + t.logsumexp(t.cat(end_norms), 0)
+        )
+        best_idx = int(scores.argmax().item())
+        return (
+            best_idx,
+            InferenceEngine.get_prediction(
+                contexts[best_idx],
+                span_starts[best_idx],
+                span_ends[best_idx],
+                scores[best_idx].item(),
+                no_answer_scores[best_idx],
+            ),
+        )
+
+    def make_samples(
+        self, pairs: List[Tuple[str, str]]
+    ) -> Tuple[List[EncodedSample], List[ContextQuestionAnswer]]:
+        """
+        Tokenizes and encodes (context, question) pairs into samples
+        :param pairs: List of (context, question) text pairs
+        :returns: Tuple of the EncodedSample of each pair and the tokenized context
+            of each pair, in the order of the pairs
+        """
+        context_idxs: Dict[str, int] = {}
+        context_questions: List[List[QuestionAnswer]] = []
+        for pair_idx, (context, question) in enumerate(pairs):
+            if context not in context_idxs:
+                context_idxs[context] = len(context_questions)
+                context_questions.append([])
+            context_questions[context_idxs[context]].append(
+                QuestionAnswer(
+                    str(pair_idx), question, set(), self.tokenizer, self.processor
+                )
+            )
+        context_qas = [
+            ContextQuestionAnswer(context, qas, self.tokenizer, self.processor)
+            for context, qas in zip(context_idxs, context_questions)
+        ]
+        encoded_context_qas = [
+            EncodedContextQuestionAnswer(cqa, self.token_mapping, self.char_mapping)
+            for cqa in context_qas
+        ]
+        qid_to_sample: Dict[QuestionId, EncodedSample] = {
+            sample.question_id: sample
+            for sample in SampleCorpus.make_samples(encoded_context_qas)
+        }
+        samples = [qid_to_sample[QuestionId(str(idx))] for idx in range(len(pairs))]
+        contexts = [context_qas[context_idxs[context]] for context, _ in pairs]
+        return samples, contexts
+
+    def answer_samples(
+        self, samples: List[EncodedSample], contexts: List[ContextQuestionAnswer]
+    ) -> List[AnswerPrediction]:
+        """
+        Runs the model on a single micro-batch of samples
+        :param samples: EncodedSample objects to answer
+        :param contexts: Tokenized context of each sample
+        :returns: An AnswerPrediction object for each sample, in order
+        """
+        batch: QABatch = collate_batch(
+            samples,
+            self.config.max_question_size,
+            self.config.max_context_size,
+            group_contexts=True,
+        )
+        with t.no_grad():
+            batch.to(self.config.device)
+            predictions: ModelPredictions = self.model(batch)
+            best_spans = get_best_spans(
+                predictions.start_logits,
+                predictions.end_logits,
+                batch.context_mask,
+                self.config.max_answer_size,
+            )
+        no_answer_scores: List[Optional[float]] = [None] * len(samples)
+        if predictions.no_ans_logits is not None:
+            no_answer_scores = predictions.no_ans_logits.view(-1).tolist()
+        return [
+            InferenceEngine.get_prediction(context, start, end, score, no_ans_score)
+            for context, start, end, score, no_ans_score in zip(
+                contexts,
+                best_spans.span_starts.tolist(),
+                best_spans.span_ends.tolist(),
+                best_spans.scores.tolist(),
+                no_answer_scores,
+            )
+        ]
+
+    @staticmethod
+    def get_prediction(
+        context: ContextQuestionAnswer,
+        span_start: int,
+        span_end: int,
+        score: float,
+        no_answer_score: Optional[float],
+    ) -> AnswerPrediction:
+        """
+        Maps a predicted token span back to the original context text
+        :param context: Tokenized context the span was predicted on
+        :param span_start: Token index of the answer start
+        :param span_end: Token index of the answer end (inclusive)
+        :param score: Score of the span
+        :param no_answer_score: No-answer logit of the model if it predicts one
+        :returns: An AnswerPrediction object
+        """
+        char_start = context.tokens[span_start].span[0]
+        char_end = min(context.tokens[span_end].span[1], len(context.original_text))
+        return AnswerPrediction(
+            text=context.original_text[char_start:char_end],
+            char_span=(char_start, char_end),
+            score=score,
+            no_answer_score=no_answer_score,
+        )
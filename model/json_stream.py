@@ -0,0 +1,160 @@
+"""
+Module that holds an incremental JSON reader that decodes the items of large
+JSON files one at a time instead of loading the whole file into memory
+"""
+
+import json
+import re
+from typing import Any, ClassVar, Iterator, Pattern, Sequence, TextIO
+
+
+class JsonStreamReader:
+    """
+    Reads the items of arrays nested in the objects of a JSON file, i.e. every
+    paragraph of a SQuAD file along the path ["data", "paragraphs"], while only
+    keeping a buffer of the file in memory.
+    The objects and arrays along the path are walked one structural character at
+    a time. Every other value, including each item that is yielded, is decoded
+    whole with json.JSONDecoder.raw_decode, reading more of the file into the
+    buffer until the value is complete. Keys of the objects along the path that
+    aren't on the path are decoded and skipped
+    """
+
+    READ_SIZE: ClassVar[int] = 1 << 20
+    WHITESPACE: ClassVar[Pattern] = re.compile(r"[ \t\n\r]*")
+
+    source: TextIO
+    read_size: int
+    decoder: json.JSONDecoder
+    buffer: str
+    pos: int
+    eof: bool
+
+    def __init__(self, source: TextIO, read_size: int = READ_SIZE) -> None:
+        """
+        :param source: Text file object to read JSON from
+        :param read_size: Minimum number of characters to read from the file at
+            once (default 1M)
+        """
+        self.source = source
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    @classmethod
+    def iter_file(
+        cls, file_name: str, path: Sequence[str], read_size: int = READ_SIZE
+    ) -> Iterator[Any]:
+        """
+        Decodes the items of the arrays at path in a JSON file one at a time
+        :param file_name: Name of the JSON file
+        :param path: Check iter_items
+        :param read_size: Minimum number of characters to read at once
+        :returns: An iterator over the decoded items
+        """
+        with open(file_name, "r", encoding="utf-8") as json_file:
+            yield from cls(json_file, read_size).iter_items(path)
+
+    def iter_items(self, path: Sequence[str]) -> Iterator[Any]:
+        """
+        :param path: Keys that lead from the top level object to the arrays whose
+            items to decode. Each key but the last leads to an array of objects
+            that the rest of the path is followed in
+        :returns: An iterator over the decoded items, in the order of the file
+        """
+        if not path:
+            raise ValueError("Path to the arrays to read can't be empty")
+        yield from self.walk_object(path)
+        if self.peek():
+            raise self.error("Extra data")
+
+    def walk_object(self, path: Sequence[str]) -> Iterator[Any]:
+        self.expect("{")
+        if self.next_is("}"):
+            return
+        while True:
+            key = self.decode_value()
+            if not isinstance(key, str):
+                raise self.error("Expecting property name")
+            self.expect(":")
+            if key == path[0]:
+                yield from self.walk_array(path[1:])
+            else:
+                self.decode_value()
+            if self.next_is("}"):
+                return
+            self.expect(",")
+
+    def walk_array(self, path: Sequence[str]) -> Iterator[Any]:
+        self.expect("[")
+        if self.next_is("]"):
+            return
+        while True:
+            if path:
+                yield from self.walk_object(path)
+            else:
+                yield self.decode_value()
+            if self.next_is("]"):
+                return
+            self.expect(",")
+
+    def decode_value(self) -> Any:
+        """
+        Decodes the next value of the file, reading until it's complete
+        :returns: The decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the file
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def peek(self) -> str:
+        """
+        Skips whitespace
+        :returns: The next character of the file, or "" at the end of the file
+        """
+        while True:
+            self.pos = JsonStreamReader.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos : self.pos + 1]
+            self.fill()
+
+    def next_is(self, char: str) -> bool:
+        """
+        :param char: Structural character
+        :returns: True and consumes the next character if it's char
+        """
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char: str) -> None:
+        if not self.next_is(char):
+            raise self.error(f"Expecting '{char}'")
+
+    def fill(self) -> None:
+        """
+        Drops the consumed part of the buffer and reads more of the file, at least
+        as much as is left in the buffer so values that span many reads are
+        decoded in a linear number of attempts
+        """
+        chunk = self.source.read(max(self.read_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+
+    def error(self, msg: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(msg, self.buffer, self.pos)
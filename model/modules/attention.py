@@ -3,11 +3,13 @@ Attention mechanism module
 Hold modules for various Attention mechanisms
 """
 
-from typing import ClassVar, Optional
+from functools import partial
+from typing import Optional, Tuple, cast
 import torch as t
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
-from model.modules.masked import MaskedLinear
+from model.modules.masked import MaskedLinear, mask_fill_value
 
 
 class BaseBidirectionalAttention(nn.Module):
@@ -15,12 +17,14 @@ class BaseBidirectionalAttention(nn.Module):
     Base Bidirectional Attention computations as described in Bidirectional
     Attention Flow, with added ability to compute self-attention as described
     in DocumentQA
+    If block_size is nonzero the attention is computed over blocks of block_size
+    context rows and block_size keys at a time with a streaming softmax, so the
+    full (batch, ctx, q) similarity matrix is never materialized
     """
 
-    NEGATIVE_COEFF: ClassVar[float] = -1e30
-
     self_attention: bool
     use_linear_layer: bool
+    block_size: int
     final_encoding_size: int
     w_question: nn.Parameter
     w_context: nn.Parameter
@@ -37,10 +41,12 @@ class BaseBidirectionalAttention(nn.Module):
         linear_layer: bool = False,
         linear_hidden_size: int = 0,
         self_attention: bool = False,
+        block_size: int = 0,
     ) -> None:
         super().__init__()
         self.self_attention = self_attention
         self.use_linear_layer = linear_layer
+        self.block_size = block_size
 
         self.w_question = nn.Parameter(t.empty(input_size))
         self.w_context = nn.Parameter(t.empty(input_size))
@@ -74,6 +80,29 @@ class BaseBidirectionalAttention(nn.Module):
         :param context_mask: Context mask (batch_len, max_context_len)
         :returns: Attended context (batch_len, max_context_len, embedding_size)
         """
+        if self.block_size > 0:
+            attended_ctx = self.blocked_attention(context, question)
+        else:
+            attended_ctx = self.dense_attention(context, question)
+
+        if (
+            self.use_linear_layer
+            and self.final_linear_layer_1
+            and self.final_linear_layer_2
+            and self.final_linear_activation
+        ):
+            final_linear = self.final_linear_layer_1(attended_ctx, mask=context_mask)
+            final_linear = self.final_linear_layer_2(final_linear, mask=context_mask)
+            attended_ctx = self.final_linear_activation(final_linear)
+        return attended_ctx
+
+    def dense_attention(self, context: t.Tensor, question: t.Tensor) -> t.Tensor:
+        """
+        Computes attention over the full similarity matrix at once
+        :param context: Context embeddings (batch_len, max_context_len, embedding_size)
+        :param question: Query embeddings (batch_len, max_question_len, embedding_size)
+        :returns: Attended context before the final linear layers
+        """
         batch_len, max_context_len, embedding_size = context.size()
         _, max_question_len, _ = question.size()
 
@@ -106,10 +135,11 @@ class BaseBidirectionalAttention(nn.Module):
 
         if self.self_attention:
             # Mask out the diagonal from the similarity matrix
-            similarity = (
-                similarity
-                + t.eye(similarity.size(1), device=similarity.device).unsqueeze(0)
-                * BaseBidirectionalAttention.NEGATIVE_COEFF
+            diagonal = self.diagonal_mask(
+                0, max_context_len, 0, max_question_len, similarity
+            )
+            similarity = similarity.masked_fill(
+                diagonal, mask_fill_value(similarity.dtype)
             )
 
         c2q_att = t.bmm(self.ctx_softmax(similarity), question)
@@ -121,18 +151,111 @@ class BaseBidirectionalAttention(nn.Module):
                 [context, c2q_att, context * c2q_att, context * q2c_att], dim=2
             )
         del similarity
-
-        if (
-            self.use_linear_layer
-            and self.final_linear_layer_1
-            and self.final_linear_layer_2
-            and self.final_linear_activation
-        ):
-            final_linear = self.final_linear_layer_1(attended_ctx, mask=context_mask)
-            final_linear = self.final_linear_layer_2(final_linear, mask=context_mask)
-            attended_ctx = self.final_linear_activation(final_linear)
         return attended_ctx
 
+    def blocked_attention(self, context: t.Tensor, question: t.Tensor) -> t.Tensor:
+        """
+        Computes the same attention as dense_attention one block of context rows
+        at a time. Blocks are checkpointed during training so only their outputs
+        are kept for the backward pass
+        :param context: Context embeddings (batch_len, max_context_len, embedding_size)
+        :param question: Query embeddings (batch_len, max_question_len, embedding_size)
+        :returns: Attended context before the final linear layers
+        """
+        q_weighted = question @ self.w_question  # (batch_len, max_question_len)
+        c2q_blocks = []
+        row_max_blocks = []
+        for block_start in range(0, context.size(1), self.block_size):
+            ctx_block = context[:, block_start : block_start + self.block_size]
+            attend_block = partial(self.attend_block, block_start=block_start)
+            if self.training and t.is_grad_enabled():
+                # Non-reentrant checkpointing also supports t.autograd.grad
+                c2q_block, row_max_block = checkpoint(
+                    attend_block, ctx_block, question, q_weighted, use_reentrant=False
+                )
+            else:
+                c2q_block, row_max_block = attend_block(
+                    ctx_block, question, q_weighted
+                )
+            c2q_blocks.append(c2q_block)
+            row_max_blocks.append(row_max_block)
+        c2q_att = t.cat(c2q_blocks, dim=1)
+        if self.self_attention:
+            return c2q_att
+        # The q2c attention only needs the row maxima of the similarity matrix
+        row_max = t.cat(row_max_blocks, dim=1)
+        q2c_att = t.bmm(self.q_softmax(row_max).unsqueeze(1), context)
+        return t.cat([context, c2q_att, context * c2q_att, context * q2c_att], dim=2)
+
+    def attend_block(
+        self,
+        ctx_block: t.Tensor,
+        question: t.Tensor,
+        q_weighted: t.Tensor,
+        block_start: int,
+    ) -> Tuple[t.Tensor, t.Tensor]:
+        """
+        Computes context to query attention for a block of context rows, streaming
+        the softmax over blocks of keys
+        :param ctx_block: Block of context rows (batch_len, block_len, embedding_size)
+        :param question: Query embeddings (batch_len, max_question_len, embedding_size)
+        :param q_weighted: Query embeddings times w_question
+            (batch_len, max_question_len)
+        :param block_start: Index of the first row of the block in the context
+        :returns: Tuple of:
+            - c2q attention of the block (batch_len, block_len, embedding_size)
+            - Maximum similarity of each row of the block (batch_len, block_len)
+        """
+        ctx_weighted = (ctx_block @ self.w_context).unsqueeze(2)
+        ctx_multiple = ctx_block * self.w_multiple
+        running_max: Optional[t.Tensor] = None
+        for key_start in range(0, question.size(1), self.block_size):
+            keys = question[:, key_start : key_start + self.block_size]
+            similarity = (
+                t.bmm(ctx_multiple, keys.transpose(1, 2))
+                + q_weighted[:, key_start : key_start + self.block_size].unsqueeze(1)
+                + ctx_weighted
+            )
+            if self.self_attention:
+                diagonal = self.diagonal_mask(
+                    block_start, ctx_block.size(1), key_start, keys.size(1), similarity
+                )
+                similarity = similarity.masked_fill(
+                    diagonal, mask_fill_value(similarity.dtype)
+                )
+            block_max = similarity.max(2)[0]
+            if running_max is None:
+                running_max = block_max
+                weights = t.exp(similarity - running_max.unsqueeze(2))
+                running_sum = weights.sum(2)
+                attended = t.bmm(weights, keys)
+            else:
+                new_max = t.max(running_max, block_max)
+                rescale = t.exp(running_max - new_max)
+                weights = t.exp(similarity - new_max.unsqueeze(2))
+                running_sum = running_sum * rescale + weights.sum(2)
+                attended = attended * rescale.unsqueeze(2) + t.bmm(weights, keys)
+                running_max = new_max
+        return attended / running_sum.unsqueeze(2), cast(t.Tensor, running_max)
+
+    @staticmethod
+    def diagonal_mask(
+        row_start: int, num_rows: int, col_start: int, num_cols: int, like: t.Tensor
+    ) -> t.Tensor:
+        """
+        Returns the self-attention mask for one block of the similarity matrix:
+        True where the row and key are the same token, False elsewhere
+        :param row_start: Index of the first row of the block
+        :param num_rows: Number of rows in the block
+        :param col_start: Index of the first key of the block
+        :param num_cols: Number of keys in the block
+        :param like: Tensor whose device the mask should be on
+        :returns: Bool mask of shape (1, num_rows, num_cols)
+        """
+        rows = t.arange(row_start, row_start + num_rows, device=like.device)
+        cols = t.arange(col_start, col_start + num_cols, device=like.device)
+        return (rows.unsqueeze(1) == cols.unsqueeze(0)).unsqueeze(0)
+
 
 class BidafBidirectionalAttention(BaseBidirectionalAttention):
     """
@@ -140,8 +263,8 @@ class BidafBidirectionalAttention(BaseBidirectionalAttention):
     original paper
     """
 
-    def __init__(self, input_size: int) -> None:
-        super().__init__(input_size)
+    def __init__(self, input_size: int, block_size: int = 0) -> None:
+        super().__init__(input_size, block_size=block_size)
 
 
 class DocQABidirectionalAttention(BaseBidirectionalAttention):
@@ -150,9 +273,14 @@ class DocQABidirectionalAttention(BaseBidirectionalAttention):
     (with linear layer at the end)
     """
 
-    def __init__(self, input_size: int, linear_hidden_size: int) -> None:
+    def __init__(
+        self, input_size: int, linear_hidden_size: int, block_size: int = 0
+    ) -> None:
         super().__init__(
-            input_size, linear_layer=True, linear_hidden_size=linear_hidden_size
+            input_size,
+            linear_layer=True,
+            linear_hidden_size=linear_hidden_size,
+            block_size=block_size,
         )
 
 
@@ -161,10 +289,13 @@ class SelfAttention(BaseBidirectionalAttention):
     Self Attention computations as described in DocumentQA
     """
 
-    def __init__(self, input_size: int, linear_hidden_size: int) -> None:
+    def __init__(
+        self, input_size: int, linear_hidden_size: int, block_size: int = 0
+    ) -> None:
         super().__init__(
             input_size,
             linear_layer=True,
             linear_hidden_size=linear_hidden_size,
             self_attention=True,
+            block_size=block_size,
         )
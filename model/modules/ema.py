@@ -1,23 +1,120 @@
-from typing import Dict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
 import torch as t
 import torch.nn as nn
 
 
 class EMA(nn.Module):
+    """
+    Exponential moving average of a model's parameters, updated in place after
+    every optimizer step as shadow = mu * param + (1 - mu) * shadow
+    All shadows are views into a single flat buffer so an update is a couple of
+    fused ops (multi-tensor foreach ops if available) instead of allocating new
+    tensors for every parameter.
+    If replace_params is True the parameters are overwritten with their moving
+    averages after every update, otherwise the averages are kept as separate
+    evaluation weights that can be swapped in with average_parameters()
+    """
 
     mu: float
-    shadow: Dict[str, t.Tensor]
+    replace_params: bool
+    names: List[str]
+    params: List[nn.Parameter]
+    shadows: List[t.Tensor]
 
-    def __init__(self, mu: float):
-        super(EMA, self).__init__()
+    def __init__(
+        self,
+        mu: float,
+        named_parameters: Iterable[Tuple[str, nn.Parameter]],
+        replace_params: bool = True,
+    ) -> None:
+        """
+        :param mu: Weight of the new parameter values in the average
+        :param named_parameters: (name, parameter) pairs to average, parameters
+            that don't require grad are skipped
+        :param replace_params: If True overwrite the parameters with their averages
+            after every update (default True)
+        """
+        super().__init__()
         self.mu = mu
-        self.shadow: Dict[str, t.Tensor] = {}
+        self.replace_params = replace_params
+        named_params = [
+            (name, param) for name, param in named_parameters if param.requires_grad
+        ]
+        self.names = [name for name, _ in named_params]
+        self.params = [param for _, param in named_params]
+        self.register_buffer(
+            "flat_shadow",
+            t.cat([param.data.detach().reshape(-1) for param in self.params])
+            if self.params
+            else t.zeros(0),
+        )
+        self.shadows = EMA.split_flat(self.flat_shadow, self.params)
 
-    def register(self, name: str, val: t.Tensor) -> None:
-        self.shadow[name] = val.clone()
+    @staticmethod
+    def split_flat(flat: t.Tensor, params: List[nn.Parameter]) -> List[t.Tensor]:
+        """
+        :param flat: Flat tensor holding a value for every element of params
+        :param params: Parameters the flat tensor was built from
+        :returns: A view into flat shaped like each parameter
+        """
+        return [
+            chunk.view_as(param)
+            for chunk, param in zip(
+                flat.split([param.numel() for param in params]), params
+            )
+        ]
 
-    def forward(self, name: str, x: t.Tensor) -> t.Tensor:
-        assert name in self.shadow
-        new_average: t.Tensor = self.mu * x + (1.0 - self.mu) * self.shadow[name]
-        self.shadow[name] = new_average.clone()
-        return new_average
+    @t.no_grad()
+    def update(self) -> None:
+        """
+        Folds the current parameter values into the moving averages
+        """
+        if not self.params:
+            return
+        param_data = [param.data for param in self.params]
+        if hasattr(t, "_foreach_mul_"):
+            t._foreach_mul_(self.shadows, 1.0 - self.mu)
+            t._foreach_add_(self.shadows, param_data, alpha=self.mu)
+        else:
+            self.flat_shadow.mul_(1.0 - self.mu).add_(
+                t.cat([data.reshape(-1) for data in param_data]), alpha=self.mu
+            )
+        if self.replace_params:
+            self.copy_to_parameters()
+
+    @t.no_grad()
+    def copy_to_parameters(self) -> None:
+        """
+        Overwrites the parameters with their moving averages
+        """
+        for param, shadow in zip(self.params, self.shadows):
+            param.data.copy_(shadow)
+
+    @contextmanager
+    def average_parameters(self) -> Iterator[None]:
+        """
+        Context manager that swaps the moving averages into the parameters, e.g.
+        for validation or saving, and restores the training values on exit.
+        A no-op if the parameters are already replaced after every update
+        """
+        if self.replace_params or not self.params:
+            yield
+            return
+        with t.no_grad():
+            backup = t.cat([param.data.reshape(-1) for param in self.params])
+            self.copy_to_parameters()
+        try:
+            yield
+        finally:
+            with t.no_grad():
+                for param, value in zip(
+                    self.params, EMA.split_flat(backup, self.params)
+                ):
+                    param.data.copy_(value)
+
+    def _apply(self, fn):  # type: ignore
+        # Keep the shadow views pointing into the flat buffer when it's moved
+        super()._apply(fn)
+        self.shadows = EMA.split_flat(self.flat_shadow, self.params)
+        return self
@@ -3,6 +3,7 @@ Module that holds classes built for embedding text
 """
 from typing import Any, Dict, List, NamedTuple, Optional
 
+import numpy as np
 import torch as t
 import torch.nn as nn
 
@@ -64,7 +65,11 @@ class WordEmbeddor(Embeddor):
         self, word_vectors: WordVectors, train_vecs: bool, device: Any = t.device("cpu")
     ) -> None:
         super().__init__(word_vectors.dim)
-        embedding_matrix = t.Tensor(word_vectors.vectors).to(device)
+        # Copy the vectors, cached vectors are a read-only memory map that the
+        # embedding weight would otherwise point into
+        embedding_matrix = t.from_numpy(
+            np.array(word_vectors.vectors, dtype=np.float32)
+        ).to(device)
         self.embed = nn.Embedding.from_pretrained(
             embedding_matrix, freeze=(not train_vecs)
         )
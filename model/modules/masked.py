@@ -11,14 +11,26 @@ MaskMode = Enum("MaskMode", "subtract multiply")
 MaskTime = Enum("MaskTime", "pre post")
 
 
-def mask_sequence(input_batch: t.Tensor, mask_index: float = 0) -> t.LongTensor:
+def mask_sequence(input_batch: t.Tensor, mask_index: float = 0) -> t.Tensor:
     """
-    Returns a LongTensor where masked indices are 0 and rest 1
+    Returns a float32 tensor where masked indices are 0 and rest 1
     :param input_batch: Batch first tensor of padded sequences
     :param mask_index: Value that signifies an index that should be masked
-    :returns: A LongTensor, same shape as input_batch
+    :returns: A FloatTensor, same shape as input_batch
     """
-    return (input_batch != mask_index).double()
+    return (input_batch != mask_index).float()
+
+
+def mask_fill_value(dtype: t.dtype, mask_value: float = 1e30) -> float:
+    """
+    Returns the value to fill masked out positions with before a softmax or max:
+    -mask_value, clamped to the lowest finite value of dtype so it doesn't
+    overflow to -inf (and turn into NaN) at reduced precision
+    :param dtype: Floating point dtype of the tensor to fill
+    :param mask_value: Magnitude of the fill value (default 1e30)
+    :returns: A large negative float representable in dtype
+    """
+    return max(-mask_value, t.finfo(dtype).min)
 
 
 class MaskedOp(nn.Module):
@@ -29,6 +41,7 @@ class MaskedOp(nn.Module):
     mask_value: float
     mask_mode: MaskMode
     mask_time: MaskTime
+    compute_dtype: Optional[t.dtype]
     op: nn.Module
 
     def __init__(
@@ -37,16 +50,29 @@ class MaskedOp(nn.Module):
         mask_mode: MaskMode,
         mask_time: MaskTime,
         mask_value: float = 0,
+        compute_dtype: Optional[t.dtype] = None,
     ) -> None:
+        """
+        :param op: Module to apply
+        :param mask_mode: subtract to fill masked positions with -mask_value,
+            multiply to zero them
+        :param mask_time: Whether to mask the input (pre) or the output (post)
+        :param mask_value: Magnitude to mask with in subtract mode (default 0)
+        :param compute_dtype: If given cast the input to this dtype first, e.g. to
+            compute losses and normalizations in float32 under autocast
+            (default None: keep the input's dtype)
+        """
         super().__init__()
         self.op = op
         self.mask_mode = mask_mode
         self.mask_time = mask_time
         self.mask_value = mask_value
+        self.compute_dtype = compute_dtype
 
-    def _apply_mask(self, inpt: t.Tensor, mask: t.ByteTensor) -> Tensor:
+    def _apply_mask(self, inpt: t.Tensor, mask: t.Tensor) -> Tensor:
         """
-        Applies the mask to inpt according to MaskMode
+        Applies the mask to inpt according to MaskMode. Masked positions are
+        filled rather than offset so the result is safe at reduced precision
         :param inpt: Input tensor to apply mask to
         :param mask: Mask to apply
         :returns: Result of applying mask to inpt given the Mode
@@ -59,11 +85,12 @@ class MaskedOp(nn.Module):
                 mask = mask.expand_as(inpt)
             else:
                 mask = mask.view(inpt.size())
-        mask = mask.float()
         if self.mask_mode == MaskMode.subtract:
-            return inpt + (mask - 1) * self.mask_value
+            return inpt.masked_fill(
+                mask == 0, mask_fill_value(inpt.dtype, self.mask_value)
+            )
         elif self.mask_mode == MaskMode.multiply:
-            return inpt * mask
+            return inpt * mask.to(inpt.dtype)
         else:
             raise Exception("Malformed mask_mode for MaskedOp: %s" % self.mask_mode)
 
@@ -84,6 +111,8 @@ class MaskedOp(nn.Module):
         """
         if mask is None:
             raise Exception("No Mask passed to the masked op")
+        if self.compute_dtype is not None:
+            input_batch = input_batch.to(self.compute_dtype)
         if self.mask_time == MaskTime.pre:
             return self.op(self._apply_mask(input_batch, mask), *args, **kwargs)
         elif self.mask_time == MaskTime.post:
@@ -106,12 +135,17 @@ class MaskedSoftmax(MaskedOp):
 class MaskedLogSoftmax(MaskedOp):
     """
     Module that runs LogSoftmax on a batch of variable-length sequences
-    Wrapper around MaskedOp.
+    Wrapper around MaskedOp. Always computed in float32 since its outputs are
+    the log probabilities the losses and span scores are computed from
     """
 
     def __init__(self, dim: int = 1) -> None:
         super().__init__(
-            nn.LogSoftmax(dim=dim), MaskMode.subtract, MaskTime.pre, mask_value=1e10
+            nn.LogSoftmax(dim=dim),
+            MaskMode.subtract,
+            MaskTime.pre,
+            mask_value=1e10,
+            compute_dtype=t.float32,
         )
 
 
@@ -1,7 +1,8 @@
 """
 Module that holds classes that can be used for answer prediction
 """
-from typing import Set, NamedTuple, Optional, cast
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Set, NamedTuple, Optional, cast
 import torch as t
 import torch.nn as nn
 from torch.nn.utils.rnn import PackedSequence, pack_padded_sequence, pad_packed_sequence
@@ -16,19 +17,114 @@ from model.modules.attention import (
 from model.modules.masked import MaskedLinear, MaskedLogSoftmax
 from model.modules.embeddor import Embeddor
 
+"""
+Predictions of a model for a batch:
+    :start_logits: LogSoftmax'ed span start logits (batch_len, max_context_len)
+    :end_logits: LogSoftmax'ed span end logits (batch_len, max_context_len)
+    :no_ans_logits: No-answer logits if the model predicts them (batch_len, 1)
+    :start_scores: Unnormalized span start scores, 0 at padding, so spans of
+        several contexts can be normalized together (batch_len, max_context_len)
+    :end_scores: Unnormalized span end scores (batch_len, max_context_len)
+"""
 ModelPredictions = NamedTuple(
     "ModelPredictions",
-    [("start_logits", t.Tensor), ("end_logits", t.Tensor), ("no_ans_logits", t.Tensor)],
+    [
+        ("start_logits", t.Tensor),
+        ("end_logits", t.Tensor),
+        ("no_ans_logits", t.Tensor),
+        ("start_scores", t.Tensor),
+        ("end_scores", t.Tensor),
+    ],
 )
 
 
+class ContextEncodingCache:
+    """
+    LRU cache of the question-independent encodings of contexts, keyed by the
+    word and char ids of the context so the same paragraph is only embedded and
+    encoded once across batches. Holds at most max_bytes worth of encodings
+    """
+
+    max_bytes: int
+    num_bytes: int
+    encodings: "OrderedDict[Hashable, t.Tensor]"
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        :param max_bytes: Maximum total size of the cached encodings in bytes
+        """
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.encodings = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[t.Tensor]:
+        """
+        :param key: Key of the context
+        :returns: The cached encoding of the context or None if it isn't cached
+        """
+        encoding = self.encodings.get(key)
+        if encoding is not None:
+            self.encodings.move_to_end(key)
+        return encoding
+
+    def put(self, key: Hashable, encoding: t.Tensor) -> None:
+        """
+        Caches the encoding of a context, evicting the least recently used
+        encodings to stay within max_bytes
+        :param key: Key of the context
+        :param encoding: Encoding of the context, (context_len, encoding_size)
+        """
+        encoding_bytes = encoding.numel() * encoding.element_size()
+        if encoding_bytes > self.max_bytes:
+            return
+        if key in self.encodings:
+            self.num_bytes -= self.size_of(self.encodings.pop(key))
+        while self.num_bytes + encoding_bytes > self.max_bytes:
+            _, evicted = self.encodings.popitem(last=False)
+            self.num_bytes -= self.size_of(evicted)
+        self.encodings[key] = encoding
+        self.num_bytes += encoding_bytes
+
+    def clear(self) -> None:
+        self.encodings.clear()
+        self.num_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.encodings)
+
+    @staticmethod
+    def size_of(encoding: t.Tensor) -> int:
+        return encoding.numel() * encoding.element_size()
+
+    @staticmethod
+    def get_key(words: t.Tensor, chars: Optional[t.Tensor]) -> Hashable:
+        """
+        :param words: Unpadded word ids of a context
+        :param chars: Char ids of a context (None if not used), trailing padding
+            columns are ignored since their number depends on the batch
+        :returns: Hashable key of the context
+        """
+        words_key = words.cpu().numpy().tobytes()
+        if chars is None:
+            return words_key
+        chars = chars.cpu()
+        used_columns = chars.ne(0).any(0).nonzero()
+        width = used_columns[-1].item() + 1 if len(used_columns) else 0
+        return (words_key, chars[:, :width].numpy().tobytes())
+
+
 class PredictorModel(nn.Module):
     """
     Base class for any Predictor Model
     """
 
+    embed: Embeddor
+    embedding_encoder: "ContextualEncoder"
+    context_cache: Optional[ContextEncodingCache]
+
     def __init__(self) -> None:
         super().__init__()
+        self.context_cache = None
 
     def forward(self, batch: QABatch) -> ModelPredictions:
         """
@@ -38,6 +134,125 @@ class PredictorModel(nn.Module):
         """
         raise NotImplementedError
 
+    def enable_context_cache(self, max_bytes: int) -> None:
+        """
+        Caches context encodings across batches while the model is in eval mode
+        :param max_bytes: Maximum total size of the cached encodings in bytes
+        """
+        self.context_cache = ContextEncodingCache(max_bytes)
+
+    def disable_context_cache(self) -> None:
+        self.context_cache = None
+
+    def encode_question(self, batch: QABatch) -> t.Tensor:
+        """
+        Embeds and contextually encodes the questions of the batch
+        :param batch: QABatch: a batch of samples returned from a batcher
+        :returns: Encoded questions in original order (batch_len, question_len, output_size)
+        """
+        question = self.embed(batch.question_words, batch.question_chars)
+        return cast(
+            t.Tensor,
+            self.embedding_encoder(
+                question,
+                batch.question_lens,
+                batch.question_len_idxs,
+                batch.question_orig_idxs,
+            ),
+        )
+
+    def encode_context(self, batch: QABatch) -> t.Tensor:
+        """
+        Embeds and contextually encodes the contexts of the batch. For context-grouped
+        batches each unique context is encoded once and shared by its samples.
+        In eval mode with the context cache enabled, encodings of previously seen
+        contexts are reused and only new contexts are encoded
+        :param batch: QABatch: a batch of samples returned from a batcher
+        :returns: Encoded contexts in original order (batch_len, context_len, output_size)
+        """
+        if not self.training and getattr(self, "context_cache", None) is not None:
+            return self.encode_context_cached(batch)
+        if not batch.is_context_grouped:
+            context = self.embed(batch.context_words, batch.context_chars)
+            return cast(
+                t.Tensor,
+                self.embedding_encoder(
+                    context,
+                    batch.context_lens,
+                    batch.context_len_idxs,
+                    batch.context_orig_idxs,
+                ),
+            )
+        context = self.embed(batch.unique_context_words, batch.unique_context_chars)
+        context = self.embedding_encoder(
+            context,
+            batch.unique_context_lens,
+            batch.unique_context_len_idxs,
+            batch.unique_context_orig_idxs,
+        )
+        return cast(t.Tensor, context[batch.context_idxs])
+
+    def encode_context_cached(self, batch: QABatch) -> t.Tensor:
+        """
+        Encodes the contexts of the batch through the context cache
+        :param batch: QABatch: a batch of samples returned from a batcher
+        :returns: Encoded contexts in original order (batch_len, context_len, output_size)
+        """
+        cache = cast(ContextEncodingCache, self.context_cache)
+        if batch.is_context_grouped:
+            words, chars = batch.unique_context_words, batch.unique_context_chars
+            lens = batch.unique_context_lens[batch.unique_context_orig_idxs]
+        else:
+            words, chars = batch.context_words, batch.context_chars
+            lens = batch.context_lens[batch.context_orig_idxs]
+        lens_list: List[int] = lens.tolist()
+        keys = [
+            ContextEncodingCache.get_key(
+                words[idx, :length], chars[idx, :length] if chars is not None else None
+            )
+            for idx, length in enumerate(lens_list)
+        ]
+        encodings: Dict[int, t.Tensor] = {}
+        missing_idxs: List[int] = []
+        for idx, key in enumerate(keys):
+            encoding = cache.get(key)
+            if encoding is None:
+                missing_idxs.append(idx)
+            else:
+                encodings[idx] = encoding
+        if missing_idxs:
+            missing = t.tensor(missing_idxs, dtype=t.long, device=words.device)
+            missing_lens, missing_len_idxs = lens[missing].sort(0, descending=True)
+            _, missing_orig_idxs = missing_len_idxs.sort()
+            max_len = missing_lens[0].item()
+            context = self.embed(
+                words[missing, :max_len],
+                chars[missing, :max_len] if chars is not None else None,
+            )
+            context = self.embedding_encoder(
+                context, missing_lens, missing_len_idxs, missing_orig_idxs
+            )
+            for row, idx in enumerate(missing_idxs):
+                # Clone so the cache doesn't hold on to the whole batch encoding
+                encoding = context[row, : lens_list[idx]].clone()
+                cache.put(keys[idx], encoding)
+                encodings[idx] = encoding
+        first_encoding = next(iter(encodings.values()))
+        context = first_encoding.new_zeros(
+            (len(lens_list), words.size(1), first_encoding.size(-1))
+        )
+        for idx, length in enumerate(lens_list):
+            context[idx, :length] = encodings[idx]
+        if batch.is_context_grouped:
+            return cast(t.Tensor, context[batch.context_idxs])
+        return context
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Cached encodings aren't part of the model
+        state = self.__dict__.copy()
+        state["context_cache"] = None
+        return state
+
 
 class ContextualEncoderConfig:
     hidden_size: int
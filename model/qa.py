@@ -3,11 +3,10 @@ Module that encapsulates the objects to represent contexts, questions and
 answers at various points of existence.
 """
 import numpy as np
-import bisect
-from typing import cast, List, Any, Set, NewType, Dict
+from typing import cast, List, Any, Set, NewType, Dict, Optional, Sequence, Tuple
 
 from model.text_processor import TextProcessor
-from model.tokenizer import Token, Tokenizer
+from model.tokenizer import Token, TokenList, Tokenizer
 
 
 QuestionId = NewType("QuestionId", str)
@@ -16,21 +15,35 @@ QuestionId = NewType("QuestionId", str)
 class Processed:
     """
     Base Class for any object that stores processed and tokenized text
+    Corpora hold millions of these, so they're slotted and keep their tokens
+    in a compact TokenList. Only the original text is stored, the processed
+    text is recomputed with the (shared) processor when it's needed, as the
+    processed words are already kept by the tokens
     """
 
-    tokens: List[Token]
+    __slots__ = ("tokens", "original_text", "processor")
+
+    tokens: TokenList
     original_text: str
-    text: str
+    processor: TextProcessor
 
     def __init__(
         self, text: str, tokenizer: Tokenizer, processor: TextProcessor
     ) -> None:
         self.original_text = text
-        self.text = processor.process(text)
-        self.tokens = tokenizer.tokenize(self.text)
-        assert len(self.text) > 0, "Textual object with empty text"
+        self.processor = processor
+        processed_text = processor.process(text)
+        self.tokens = TokenList.from_tokens(tokenizer.tokenize(processed_text))
+        assert len(processed_text) > 0, "Textual object with empty text"
         assert len(self.tokens) > 0, "Tokenized object with no tokensj"
 
+    @property
+    def text(self) -> str:
+        """
+        :returns: The processed text the tokens were computed from
+        """
+        return self.processor.process(self.original_text)
+
     def __eq__(self, other: Any) -> bool:
         return cast(
             bool,
@@ -45,7 +58,8 @@ class Answer(Processed):
     Base class for an Answer, stores the text and span boundaries
     """
 
-    text: str
+    __slots__ = ("span_start", "span_end")
+
     span_start: int
     span_end: int
 
@@ -54,7 +68,7 @@ class Answer(Processed):
     ) -> None:
         super().__init__(text, tokenizer, processor)
         self.span_start = span_start
-        self.span_end = self.span_start + len(self.text)
+        self.span_end = self.span_start + len(processor.process(text))
 
     def __eq__(self, other: Any) -> bool:
         """
@@ -70,7 +84,7 @@ class Answer(Processed):
         """
         Use the answer components to hash the answer
         """
-        return hash("%d_%d_%s" % (self.span_start, self.span_end, self.text))
+        return hash("%d_%d_%s" % (self.span_start, self.span_end, self.original_text))
 
 
 class QuestionAnswer(Processed):
@@ -79,6 +93,8 @@ class QuestionAnswer(Processed):
     Stores the question text and a list of answers
     """
 
+    __slots__ = ("question_id", "answers")
+
     question_id: QuestionId
     answers: Set[Answer]
 
@@ -108,6 +124,8 @@ class ContextQuestionAnswer(Processed):
     Stores the context text and a list of question answer pair objects
     """
 
+    __slots__ = ("qas",)
+
     qas: List[QuestionAnswer]
 
     def __init__(
@@ -129,20 +147,47 @@ class EncodedAnswer:
     Class to store an Answer's encoding
         - span_start: int mapping to the first context token that's part of the answer
         - span_end: int mapping to the last context token that's part of the answer
+        - misaligned: True if the answer's char span starts or ends between tokens
+            (e.g. on whitespace), in which case it's aligned to the tokens inside it
     """
 
     span_start: int
     span_end: int
+    misaligned: bool
 
-    def __init__(self, answer: Answer, context_tokens: List[Token]) -> None:
+    def __init__(self, answer: Answer, context_tokens: Sequence[Token]) -> None:
         """
         We have List[Token]:
             (word=word, span=(start, end))
         """
-        spans = [tok.span for tok in context_tokens]
-        token_starts, token_ends = zip(*spans)
-        self.span_start = bisect.bisect_right(token_starts, answer.span_start) - 1
-        self.span_end = bisect.bisect_left(token_ends, answer.span_end)
+        span_starts, span_ends, misaligned = align_answers([answer], context_tokens)
+        self.span_start = int(span_starts[0])
+        self.span_end = int(span_ends[0])
+        self.misaligned = bool(misaligned[0])
+
+    @classmethod
+    def align(
+        cls, answers: Sequence[Answer], context_tokens: Sequence[Token]
+    ) -> List["EncodedAnswer"]:
+        """
+        Encodes all the answers of a context at once
+        :param answers: Answers to encode
+        :param context_tokens: Tokens of the context the answers are in
+        :returns: An EncodedAnswer for each answer, in order
+        """
+        encoded_answers: List[EncodedAnswer] = []
+        if not answers:
+            return encoded_answers
+        span_starts, span_ends, misaligned = align_answers(answers, context_tokens)
+        for span_start, span_end, is_misaligned in zip(
+            span_starts.tolist(), span_ends.tolist(), misaligned.tolist()
+        ):
+            encoded_answer = cls.__new__(cls)
+            encoded_answer.span_start = span_start
+            encoded_answer.span_end = span_end
+            encoded_answer.misaligned = is_misaligned
+            encoded_answers.append(encoded_answer)
+        return encoded_answers
 
     def __eq__(self, other: Any) -> bool:
         """
@@ -162,7 +207,8 @@ class EncodedQuestionAnswer:
 
     question_id: QuestionId
     word_encoding: Any  # numpy array
-    char_encoding: List[Any]  # numpy array
+    flat_char_encoding: Any  # numpy array
+    char_offsets: Any  # numpy array
     answers: List[EncodedAnswer]
 
     def __init__(
@@ -170,17 +216,36 @@ class EncodedQuestionAnswer:
         qa: QuestionAnswer,
         token_mapping: Dict[str, int],
         char_mapping: Dict[str, int],
-        context_tokens: List[Token],
+        context_tokens: Sequence[Token],
+        answers: Optional[List[EncodedAnswer]] = None,
     ) -> None:
+        """
+        :param qa: QuestionAnswer to encode
+        :param token_mapping: Mapping from tokens to ids
+        :param char_mapping: Mapping from chars to ids
+        :param context_tokens: Tokens of the question's context
+        :param answers: The question's answers if they're already encoded
+            (default None: align them to context_tokens)
+        """
         self.question_id = qa.question_id
         self.word_encoding = np.array(
             [token_mapping.get(tk.word, 1) for tk in qa.tokens]
         )
-        self.char_encoding = [
-            np.array([char_mapping.get(char, 1) for char in tk.word])
-            for tk in qa.tokens
-        ]
-        self.answers = [EncodedAnswer(ans, context_tokens) for ans in qa.answers]
+        self.flat_char_encoding, self.char_offsets = encode_chars(
+            qa.tokens, char_mapping
+        )
+        self.answers = (
+            answers
+            if answers is not None
+            else EncodedAnswer.align(list(qa.answers), context_tokens)
+        )
+
+    @property
+    def char_encoding(self) -> List[Any]:
+        """
+        :returns: List of numpy arrays of the char ids of each word
+        """
+        return split_chars(self.flat_char_encoding, self.char_offsets)
 
     def __eq__(self, other: Any) -> bool:
         return cast(
@@ -188,7 +253,8 @@ class EncodedQuestionAnswer:
             (
                 self.question_id == other.question_id
                 and np.all(self.word_encoding == other.word_encoding)
-                and np.all(self.char_encoding == other.char_encoding)
+                and np.array_equal(self.flat_char_encoding, other.flat_char_encoding)
+                and np.array_equal(self.char_offsets, other.char_offsets)
                 and self.answers == other.answers
             ),
         )
@@ -201,7 +267,8 @@ class EncodedContextQuestionAnswer:
     """
 
     word_encoding: Any  # numpy array
-    char_encoding: List[Any]  # numpy array
+    flat_char_encoding: Any  # numpy array
+    char_offsets: Any  # numpy array
     qas: List[EncodedQuestionAnswer]
 
     def __init__(
@@ -213,21 +280,42 @@ class EncodedContextQuestionAnswer:
         self.word_encoding = np.array(
             [token_mapping.get(tk.word, 1) for tk in ctx.tokens]
         )
-        self.char_encoding = [
-            np.array([char_mapping.get(char, 1) for char in tk.word])
-            for tk in ctx.tokens
-        ]
-        self.qas = [
-            EncodedQuestionAnswer(qa, token_mapping, char_mapping, ctx.tokens)
-            for qa in ctx.qas
-        ]
+        self.flat_char_encoding, self.char_offsets = encode_chars(
+            ctx.tokens, char_mapping
+        )
+        # Align the answers of all questions in one pass over the context
+        answers = [list(qa.answers) for qa in ctx.qas]
+        encoded_answers = EncodedAnswer.align(
+            [answer for qa_answers in answers for answer in qa_answers], ctx.tokens
+        )
+        self.qas = []
+        answer_offset = 0
+        for qa, qa_answers in zip(ctx.qas, answers):
+            self.qas.append(
+                EncodedQuestionAnswer(
+                    qa,
+                    token_mapping,
+                    char_mapping,
+                    ctx.tokens,
+                    encoded_answers[answer_offset : answer_offset + len(qa_answers)],
+                )
+            )
+            answer_offset += len(qa_answers)
+
+    @property
+    def char_encoding(self) -> List[Any]:
+        """
+        :returns: List of numpy arrays of the char ids of each word
+        """
+        return split_chars(self.flat_char_encoding, self.char_offsets)
 
     def __eq__(self, other: Any) -> bool:
         return cast(
             bool,
             (
                 self.qas == other.qas
-                and np.all(self.char_encoding == other.char_encoding)
+                and np.array_equal(self.flat_char_encoding, other.flat_char_encoding)
+                and np.array_equal(self.char_offsets, other.char_offsets)
                 and np.all(self.word_encoding == other.word_encoding)
             ),
         )
@@ -238,33 +326,182 @@ class EncodedSample:
     Stores a single model sample (context, question, answers)
         - span_starts and span_ends are the same shape as
             context and are 1 at each valid start/end index
+        - chars are stored flat alongside offsets where the chars of word i
+            are flat_chars[char_offsets[i]:char_offsets[i + 1]]
+        - context_id identifies the paragraph of the sample so samples of the same
+            paragraph can share a single context encoding in a batch
+        - context_offset is the index of the first context token of the sample in
+            its paragraph, nonzero for windows of longer paragraphs
     """
 
     question_id: QuestionId
+    context_id: Optional[int]
+    context_offset: int
     question_words: Any  # numpy array
-    question_chars: List[Any]  # numpy array
+    question_flat_chars: Any  # numpy array
+    question_char_offsets: Any  # numpy array
     context_words: Any  # numpy array
-    context_chars: List[Any]  # numpy array
+    context_flat_chars: Any  # numpy array
+    context_char_offsets: Any  # numpy array
     has_answer: bool
     span_starts: Any  # numpy array
     span_ends: Any  # numpy array
 
     def __init__(
-        self, ctx_word_encoding: Any, ctx_char_encoding: Any, qa: EncodedQuestionAnswer
+        self,
+        ctx_word_encoding: Any,
+        ctx_char_encoding: Any,
+        qa: EncodedQuestionAnswer,
+        ctx_char_offsets: Optional[Any] = None,
+        context_id: Optional[int] = None,
     ) -> None:
-        self.question_id = qa.question_id
-        self.context_words = ctx_word_encoding
-        self.context_chars = ctx_char_encoding
-        self.question_words = qa.word_encoding
-        self.question_chars = qa.char_encoding
-        self.has_answer = bool(qa.answers)
+        """
+        :param ctx_word_encoding: numpy array of context word ids
+        :param ctx_char_encoding: List of numpy arrays of char ids for each context
+            word, or the flat char ids of the context if ctx_char_offsets is given
+        :param qa: EncodedQuestionAnswer of the question
+        :param ctx_char_offsets: Char offsets of each context word into
+            ctx_char_encoding if it is flat (default None)
+        :param context_id: Id of the paragraph of the sample (default None: unknown)
+        """
+        self.context_id = context_id
+        self.context_offset = 0
+        if ctx_char_offsets is None:
+            ctx_char_encoding, ctx_char_offsets = flatten_arrays(
+                ctx_char_encoding, np.int64
+            )
+        self._set_encodings(
+            qa.question_id,
+            ctx_word_encoding,
+            ctx_char_encoding,
+            ctx_char_offsets,
+            qa.word_encoding,
+            qa.flat_char_encoding,
+            qa.char_offsets,
+            [ans.span_start for ans in qa.answers],
+            [ans.span_end for ans in qa.answers],
+        )
+
+    @classmethod
+    def from_arrays(
+        cls,
+        question_id: QuestionId,
+        context_words: Any,
+        context_flat_chars: Any,
+        context_char_offsets: Any,
+        question_words: Any,
+        question_flat_chars: Any,
+        question_char_offsets: Any,
+        answer_starts: Any,
+        answer_ends: Any,
+        context_id: Optional[int] = None,
+    ) -> "EncodedSample":
+        """
+        Builds an EncodedSample directly from its encoded arrays
+        :param question_id: QuestionId of the sample
+        :param context_words: numpy array of context word ids
+        :param context_flat_chars: numpy array of the char ids of all context words
+        :param context_char_offsets: Offsets of each context word into the char ids
+        :param question_words: numpy array of question word ids
+        :param question_flat_chars: numpy array of the char ids of all question words
+        :param question_char_offsets: Offsets of each question word into the char ids
+        :param answer_starts: Context token indices of all answer starts
+        :param answer_ends: Context token indices of all answer ends
+        :param context_id: Id of the paragraph of the sample (default None: unknown)
+        :returns: An EncodedSample object
+        """
+        sample = cls.__new__(cls)
+        sample.context_id = context_id
+        sample.context_offset = 0
+        sample._set_encodings(
+            question_id,
+            context_words,
+            context_flat_chars,
+            context_char_offsets,
+            question_words,
+            question_flat_chars,
+            question_char_offsets,
+            answer_starts,
+            answer_ends,
+        )
+        return sample
+
+    def _set_encodings(
+        self,
+        question_id: QuestionId,
+        context_words: Any,
+        context_flat_chars: Any,
+        context_char_offsets: Any,
+        question_words: Any,
+        question_flat_chars: Any,
+        question_char_offsets: Any,
+        answer_starts: Any,
+        answer_ends: Any,
+    ) -> None:
+        self.question_id = question_id
+        self.context_words = context_words
+        self.context_flat_chars = context_flat_chars
+        self.context_char_offsets = context_char_offsets
+        self.question_words = question_words
+        self.question_flat_chars = question_flat_chars
+        self.question_char_offsets = question_char_offsets
+        self.has_answer = len(answer_starts) > 0
         self.span_starts = np.zeros_like(self.context_words)
         self.span_ends = np.zeros_like(self.context_words)
         if self.has_answer:
-            starts = np.array([ans.span_start for ans in qa.answers])
-            ends = np.array([ans.span_end for ans in qa.answers])
-            self.span_starts[starts] = 1
-            self.span_ends[ends] = 1
+            self.span_starts[np.asarray(answer_starts)] = 1
+            self.span_ends[np.asarray(answer_ends)] = 1
+
+    def window(
+        self, start: int, size: int, context_id: Optional[int] = None
+    ) -> "EncodedSample":
+        """
+        Returns the sample restricted to a window of its context. Only the answers
+        that lie entirely within the window are kept
+        :param start: Index of the first context token of the window
+        :param size: Maximum number of context tokens in the window
+        :param context_id: Id of the window's context (default None: keep this
+            sample's context_id)
+        :returns: A new EncodedSample whose context_offset is shifted by start
+        """
+        end = min(start + size, len(self.context_words))
+        char_offsets = self.context_char_offsets[start : end + 1]
+        span_starts = self.span_starts[start:end].copy()
+        span_ends = self.span_ends[start:end].copy()
+        # Drop the halves of answers cut by the window boundaries: starts with no
+        # end after them and ends with no start before them
+        span_starts[np.cumsum(span_ends[::-1])[::-1] == 0] = 0
+        span_ends[np.cumsum(span_starts) == 0] = 0
+        sample = EncodedSample.__new__(EncodedSample)
+        sample.question_id = self.question_id
+        sample.context_id = self.context_id if context_id is None else context_id
+        sample.context_offset = self.context_offset + start
+        sample.question_words = self.question_words
+        sample.question_flat_chars = self.question_flat_chars
+        sample.question_char_offsets = self.question_char_offsets
+        sample.context_words = self.context_words[start:end]
+        sample.context_flat_chars = self.context_flat_chars[
+            char_offsets[0] : char_offsets[-1]
+        ]
+        sample.context_char_offsets = char_offsets - char_offsets[0]
+        sample.has_answer = bool(span_starts.any())
+        sample.span_starts = span_starts
+        sample.span_ends = span_ends
+        return sample
+
+    @property
+    def context_chars(self) -> List[Any]:
+        """
+        :returns: List of numpy arrays of the char ids of each context word
+        """
+        return split_chars(self.context_flat_chars, self.context_char_offsets)
+
+    @property
+    def question_chars(self) -> List[Any]:
+        """
+        :returns: List of numpy arrays of the char ids of each question word
+        """
+        return split_chars(self.question_flat_chars, self.question_char_offsets)
 
     def __eq__(self, other: Any) -> bool:
         return cast(
@@ -273,10 +510,112 @@ class EncodedSample:
                 self.question_id == other.question_id
                 and np.all(self.context_words == other.context_words)
                 and np.all(self.question_words == other.question_words)
-                and np.all(self.context_chars == other.context_chars)
-                and np.all(self.question_chars == other.question_chars)
+                and np.array_equal(self.context_flat_chars, other.context_flat_chars)
+                and np.array_equal(
+                    self.context_char_offsets, other.context_char_offsets
+                )
+                and np.array_equal(self.question_flat_chars, other.question_flat_chars)
+                and np.array_equal(
+                    self.question_char_offsets, other.question_char_offsets
+                )
                 and self.has_answer == other.has_answer
                 and np.all(self.span_starts == other.span_starts)
                 and np.all(self.span_ends == other.span_ends)
             ),
         )
+
+
+def encode_chars(
+    tokens: Sequence[Token], char_mapping: Dict[str, int]
+) -> Tuple[Any, Any]:
+    """
+    Encodes the characters of all the given tokens into a flat array
+    :param tokens: Tokens to encode
+    :param char_mapping: Mapping from chars to ids, unknown chars are mapped to 1
+    :returns: Tuple of:
+        - flat_chars: int64 numpy array of the char ids of all tokens
+        - char_offsets: int64 numpy array where the chars of token i are
+            flat_chars[char_offsets[i]:char_offsets[i + 1]]
+    """
+    if isinstance(tokens, TokenList):
+        # The words are already concatenated with their offsets
+        return (
+            np.array(
+                [char_mapping.get(char, 1) for char in tokens.word_buffer],
+                dtype=np.int64,
+            ),
+            tokens.word_offsets.astype(np.int64),
+        )
+    flat_chars = np.array(
+        [char_mapping.get(char, 1) for tk in tokens for char in tk.word],
+        dtype=np.int64,
+    )
+    char_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(tk.word) for tk in tokens], out=char_offsets[1:])
+    return flat_chars, char_offsets
+
+
+def align_answers(
+    answers: Sequence[Answer], context_tokens: Sequence[Token]
+) -> Tuple[Any, Any, Any]:
+    """
+    Maps the char spans of answers to the context tokens they start and end in,
+    with one binary search over all answers at once. An answer starts in the last
+    token that starts at or before its first char and ends in the first token
+    that ends at or after its last char. Answers whose span starts or ends
+    between tokens are aligned to the first and last tokens inside the span
+    instead, and are flagged
+    :param answers: Non-empty sequence of answers in the context
+    :param context_tokens: Non-empty sequence of the context's tokens
+    :returns: Tuple of:
+        - span_starts: int64 numpy array of the start token of each answer
+        - span_ends: int64 numpy array of the end token of each answer
+        - misaligned: bool numpy array, True for answers that start or end
+            between tokens
+    """
+    if isinstance(context_tokens, TokenList):
+        token_starts, token_ends = context_tokens.starts, context_tokens.ends
+    else:
+        spans = np.array([token.span for token in context_tokens]).reshape(-1, 2)
+        token_starts, token_ends = spans[:, 0], spans[:, 1]
+    last_token = len(token_starts) - 1
+    answer_starts = np.array([answer.span_start for answer in answers])
+    answer_ends = np.array([answer.span_end for answer in answers])
+    span_starts = np.searchsorted(token_starts, answer_starts, side="right") - 1
+    span_ends = np.searchsorted(token_ends, answer_ends, side="left")
+    starts_between = (span_starts < 0) | (
+        answer_starts >= token_ends[np.maximum(span_starts, 0)]
+    )
+    ends_between = (span_ends > last_token) | (
+        answer_ends <= token_starts[np.minimum(span_ends, last_token)]
+    )
+    span_starts = np.clip(span_starts + starts_between, 0, last_token)
+    span_ends = np.clip(span_ends - ends_between, span_starts, last_token)
+    return span_starts, span_ends, starts_between | ends_between
+
+
+def split_chars(flat_chars: Any, char_offsets: Any) -> List[Any]:
+    """
+    Splits flat char ids back into one numpy array per word
+    :param flat_chars: numpy array of the char ids of all words
+    :param char_offsets: Offsets of each word into flat_chars
+    :returns: List of numpy arrays of the char ids of each word
+    """
+    return np.split(flat_chars[: char_offsets[-1]], char_offsets[1:-1])
+
+
+def flatten_arrays(arrays: List[Any], dtype: Any) -> Tuple[Any, Any]:
+    """
+    Concatenates a list of 1D sequences into a flat array and an offset table
+    :param arrays: List of 1D sequences
+    :param dtype: numpy dtype of the flat array
+    :returns: Tuple of:
+        - flat: All the sequences concatenated
+        - offsets: int64 array where sequence i is flat[offsets[i]:offsets[i + 1]]
+    """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(arr) for arr in arrays], out=offsets[1:])
+    flat = np.zeros(offsets[-1], dtype=dtype)
+    if offsets[-1]:
+        flat[:] = np.concatenate([np.asarray(arr, dtype=dtype) for arr in arrays])
+    return flat, offsets
@@ -0,0 +1,224 @@
+"""
+Module that holds a BM25 paragraph index to retrieve the paragraphs most relevant
+to a question, and a document-level answerer that answers questions against the
+top retrieved paragraphs with shared-normalization scoring
+"""
+
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from model.corpus import Corpus
+from model.inference import AnswerPrediction, InferenceEngine
+from model.text_processor import TextProcessor
+from model.tokenizer import Tokenizer
+
+RetrievedParagraph = NamedTuple(
+    "RetrievedParagraph", [("paragraph_idx", int), ("score", float)]
+)
+
+DocumentAnswer = NamedTuple(
+    "DocumentAnswer",
+    [
+        ("prediction", AnswerPrediction),
+        ("paragraph_idx", int),
+        ("retrieved", List[RetrievedParagraph]),
+    ],
+)
+
+
+class ParagraphIndex:
+    """
+    Okapi BM25 index over a list of tokenized paragraphs, stored as an inverted
+    index: for each term, the array of paragraphs it occurs in and the array of
+    its frequency in each of them
+    """
+
+    k1: float
+    b: float
+    term_idxs: Dict[str, int]
+    postings: List[Tuple[Any, Any]]  # numpy arrays
+    idfs: Any  # numpy array
+    length_norms: Any  # numpy array
+
+    def __init__(
+        self, paragraph_tokens: List[List[str]], k1: float = 1.2, b: float = 0.75
+    ) -> None:
+        """
+        :param paragraph_tokens: List of the tokens of each paragraph
+        :param k1: BM25 term frequency saturation (default 1.2)
+        :param b: BM25 length normalization strength (default 0.75)
+        """
+        self.k1 = k1
+        self.b = b
+        self.term_idxs = {}
+        posting_lists: List[Tuple[List[int], List[int]]] = []
+        for paragraph_idx, tokens in enumerate(paragraph_tokens):
+            for term, count in Counter(tokens).items():
+                if term not in self.term_idxs:
+                    self.term_idxs[term] = len(posting_lists)
+                    posting_lists.append(([], []))
+                paragraph_idxs, counts = posting_lists[self.term_idxs[term]]
+                paragraph_idxs.append(paragraph_idx)
+                counts.append(count)
+        self.postings = [
+            (np.array(paragraph_idxs, dtype=np.int64), np.array(counts, np.float32))
+            for paragraph_idxs, counts in posting_lists
+        ]
+        num_paragraphs = len(paragraph_tokens)
+        document_frequencies = np.array(
+            [len(paragraph_idxs) for paragraph_idxs, _ in self.postings],
+            dtype=np.float32,
+        )
+        self.idfs = np.log1p(
+            (num_paragraphs - document_frequencies + 0.5) / (document_frequencies + 0.5)
+        )
+        lengths = np.array([len(tokens) for tokens in paragraph_tokens], np.float32)
+        self.length_norms = self.k1 * (
+            1 - self.b + self.b * lengths / max(lengths.mean(), 1.0)
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        tokenizer: Tokenizer,
+        processor: TextProcessor,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> "ParagraphIndex":
+        """
+        Builds an index over raw paragraph texts
+        :param texts: List of paragraph texts, e.g. all paragraphs of an article
+        :param tokenizer: Tokenizer to tokenize the paragraphs with
+        :param processor: TextProcessor to apply to the paragraphs before tokenizing
+        :param k1: BM25 term frequency saturation (default 1.2)
+        :param b: BM25 length normalization strength (default 0.75)
+        :returns: A ParagraphIndex where paragraph i is texts[i]
+        """
+        paragraph_tokens = tokenizer.tokenize_batch(
+            [processor.process(text) for text in texts]
+        )
+        return cls(
+            [[token.word for token in tokens] for tokens in paragraph_tokens], k1, b
+        )
+
+    @classmethod
+    def from_corpus(
+        cls, corpus: Corpus, k1: float = 1.2, b: float = 0.75
+    ) -> "ParagraphIndex":
+        """
+        Builds an index over all the paragraphs of a corpus, reusing their tokens
+        :param corpus: Corpus to index
+        :param k1: BM25 term frequency saturation (default 1.2)
+        :param b: BM25 length normalization strength (default 0.75)
+        :returns: A ParagraphIndex where paragraph i is corpus.context_qas[i]
+        """
+        return cls(
+            [[token.word for token in cqa.tokens] for cqa in corpus.context_qas], k1, b
+        )
+
+    def __len__(self) -> int:
+        return len(self.length_norms)
+
+    def score(self, query_tokens: List[str]) -> Any:
+        """
+        Computes the BM25 score of every paragraph for a query
+        :param query_tokens: Tokens of the query
+        :returns: float32 numpy array of the score of each paragraph
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(query_tokens):
+            term_idx = self.term_idxs.get(term)
+            if term_idx is None:
+                continue
+            paragraph_idxs, counts = self.postings[term_idx]
+            # Each paragraph occurs at most once in a posting list
+            scores[paragraph_idxs] += (
+                self.idfs[term_idx]
+                * counts
+                * (self.k1 + 1)
+                / (counts + self.length_norms[paragraph_idxs])
+            )
+        return scores
+
+    def retrieve(self, query_tokens: List[str], top_k: int) -> List[RetrievedParagraph]:
+        """
+        Finds the top_k highest scoring paragraphs for a query
+        :param query_tokens: Tokens of the query
+        :param top_k: Number of paragraphs to retrieve
+        :returns: List of up to top_k RetrievedParagraph objects, best first.
+            Paragraphs that share no term with the query are never retrieved
+        """
+        scores = self.score(query_tokens)
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k <= 0:
+            return []
+        top_idxs = np.argpartition(-scores, top_k - 1)[:top_k]
+        top_idxs = top_idxs[np.argsort(-scores[top_idxs], kind="stable")]
+        return [RetrievedParagraph(int(idx), float(scores[idx])) for idx in top_idxs]
+
+
+class DocumentAnswerer:
+    """
+    Answers questions against a whole document or corpus: the top_k paragraphs
+    retrieved for each question are run through the model together and the best
+    span over all of them is picked with shared-normalization scoring
+    """
+
+    engine: InferenceEngine
+    index: ParagraphIndex
+    paragraphs: List[str]
+    top_k: int
+
+    def __init__(
+        self,
+        engine: InferenceEngine,
+        paragraphs: List[str],
+        top_k: int,
+        index: Optional[ParagraphIndex] = None,
+    ) -> None:
+        """
+        :param engine: InferenceEngine to answer with
+        :param paragraphs: Texts of all the paragraphs to answer against
+        :param top_k: Number of paragraphs to retrieve for each question
+        :param index: ParagraphIndex over the paragraphs (default None: built
+            with the engine's tokenizer and processor)
+        """
+        self.engine = engine
+        self.paragraphs = paragraphs
+        self.top_k = top_k
+        if index is None:
+            index = ParagraphIndex.from_texts(
+                paragraphs, engine.tokenizer, engine.processor
+            )
+        self.index = index
+
+    def retrieve(self, question: str) -> List[RetrievedParagraph]:
+        """
+        :param question: Question text
+        :returns: The top_k paragraphs retrieved for the question, best first
+        """
+        query_tokens = self.engine.tokenizer.tokenize(
+            self.engine.processor.process(question)
+        )
+        return self.index.retrieve([token.word for token in query_tokens], self.top_k)
+
+    def answer(self, question: str) -> DocumentAnswer:
+        """
+        Answers a question against the retrieved paragraphs
+        :param question: Question text
+        :returns: A DocumentAnswer object with the best answer, the index of the
+            paragraph it's in and the retrieved paragraphs. If no paragraph is
+            retrieved the first paragraph is answered against
+        """
+        retrieved = self.retrieve(question) or [RetrievedParagraph(0, 0.0)]
+        best_idx, prediction = self.engine.answer_paragraphs(
+            question, [self.paragraphs[par.paragraph_idx] for par in retrieved]
+        )
+        return DocumentAnswer(
+            prediction=prediction,
+            paragraph_idx=retrieved[best_idx].paragraph_idx,
+            retrieved=retrieved,
+        )
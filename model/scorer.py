@@ -0,0 +1,270 @@
+"""
+Module that holds an in-memory SQuAD scorer that computes the official EM and
+F1 metrics against gold answers normalized once up front
+"""
+
+import re
+import string
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple, cast
+
+from model.json_stream import JsonStreamReader
+from model.qa import ContextQuestionAnswer, QuestionId
+
+"""
+A normalized gold answer:
+    :text: The normalized answer text
+    :token_counts: Bag of the normalized answer's tokens
+    :num_tokens: Number of tokens in the normalized answer
+"""
+GoldAnswer = Tuple[str, Counter, int]
+
+ARTICLES: Pattern = re.compile(r"\b(a|an|the)\b", re.UNICODE)
+PUNCTUATION_TABLE: Dict[int, Any] = str.maketrans("", "", string.punctuation)
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Same normalization as the official evaluation scripts: lowercases, removes
+    punctuation, articles and extra whitespace
+    :param text: Answer text
+    :returns: The normalized text
+    """
+    without_punctuation = text.lower().translate(PUNCTUATION_TABLE)
+    return " ".join(ARTICLES.sub(" ", without_punctuation).split())
+
+
+class SquadScorer:
+    """
+    Scores predicted answer texts with the official SQuAD exact match and F1
+    metrics. Gold answers are normalized and tokenized once when the scorer is
+    built, so scoring only normalizes the predictions.
+    Questions without gold answers are scored as in the v2.0 script: the only
+    correct prediction is the empty string. Gold answers that normalize to the
+    empty string are ignored if the question has other answers, also as in v2.0.
+    Predictions can be added incrementally with update, the metrics over all
+    questions (missing predictions score 0) are returned by metrics. If
+    num_workers is nonzero, large updates are scored in parallel by a pool of
+    worker processes that each get a copy of the gold answers once
+    """
+
+    PARALLEL_CHUNK_SIZE = 2048
+
+    golds: Dict[QuestionId, List[GoldAnswer]]
+    num_workers: int
+    exact_scores: Dict[QuestionId, float]
+    f1_scores: Dict[QuestionId, float]
+    executor: Optional[ProcessPoolExecutor]
+
+    def __init__(
+        self, gold_answers: Dict[QuestionId, Iterable[str]], num_workers: int = 0
+    ) -> None:
+        """
+        :param gold_answers: Mapping from each QuestionId to the texts of all its
+            gold answers, empty for unanswerable questions
+        :param num_workers: Number of worker processes to score with
+            (default 0: score in the calling process)
+        """
+        self.golds = {
+            qid: SquadScorer.normalize_golds(texts)
+            for qid, texts in gold_answers.items()
+        }
+        self.num_workers = num_workers
+        self.executor = None
+        self.reset()
+
+    @classmethod
+    def from_context_qas(
+        cls, context_qas: List[ContextQuestionAnswer], num_workers: int = 0
+    ) -> "SquadScorer":
+        """
+        Builds a scorer with the gold answers of every question of a corpus.
+        The corpus should be read with force_single_answer=False so questions
+        with several annotated answers are scored against all of them
+        :param context_qas: ContextQuestionAnswer objects of the corpus
+        :param num_workers: Number of worker processes to score with (default 0)
+        :returns: A SquadScorer object
+        """
+        return cls(
+            {
+                qa.question_id: [answer.original_text for answer in qa.answers]
+                for cqa in context_qas
+                for qa in cqa.qas
+            },
+            num_workers,
+        )
+
+    @classmethod
+    def from_file(cls, data_file: str, num_workers: int = 0) -> "SquadScorer":
+        """
+        Builds a scorer with every annotated answer of every question of a SQuAD
+        formatted JSON file, independent of how the file's corpus was read
+        :param data_file: SQuAD formatted JSON file
+        :param num_workers: Number of worker processes to score with (default 0)
+        :returns: A SquadScorer object
+        """
+        return cls(SquadScorer.read_gold_answers(data_file), num_workers)
+
+    @staticmethod
+    def read_gold_answers(data_file: str) -> Dict[QuestionId, List[str]]:
+        """
+        Reads the gold answer texts of a SQuAD formatted JSON file without
+        tokenizing it, one paragraph at a time
+        :param data_file: SQuAD formatted JSON file
+        :returns: Mapping from each QuestionId to the texts of all its answers
+        """
+        return {
+            cast(QuestionId, qa["id"]): [answer["text"] for answer in qa["answers"]]
+            for paragraph in JsonStreamReader.iter_file(
+                data_file, ["data", "paragraphs"]
+            )
+            for qa in paragraph["qas"]
+        }
+
+    @staticmethod
+    def normalize_golds(texts: Iterable[str]) -> List[GoldAnswer]:
+        """
+        :param texts: Texts of the gold answers of a question
+        :returns: The GoldAnswer of every answer that doesn't normalize to the
+            empty string, or a single empty GoldAnswer if there are none
+        """
+        golds: List[GoldAnswer] = []
+        for text in texts:
+            normalized = normalize_answer(text)
+            if normalized:
+                tokens = normalized.split()
+                golds.append((normalized, Counter(tokens), len(tokens)))
+        return golds or [("", Counter(), 0)]
+
+    def __len__(self) -> int:
+        return len(self.golds)
+
+    def reset(self) -> None:
+        """
+        Forgets all predictions scored so far
+        """
+        self.exact_scores = {}
+        self.f1_scores = {}
+
+    def score_prediction(self, qid: QuestionId, prediction: str) -> Tuple[float, float]:
+        """
+        :param qid: QuestionId of a question of the scorer
+        :param prediction: Predicted answer text
+        :returns: Tuple of the exact match and F1 score of the prediction against
+            its best matching gold answer
+        """
+        normalized = normalize_answer(prediction)
+        pred_tokens = normalized.split()
+        pred_counts = Counter(pred_tokens)
+        f1 = 0.0
+        for gold_text, gold_counts, num_gold_tokens in self.golds[qid]:
+            if normalized == gold_text:
+                return 1.0, 1.0
+            if not pred_tokens or not num_gold_tokens:
+                continue
+            num_same = sum((pred_counts & gold_counts).values())
+            if num_same:
+                precision = num_same / len(pred_tokens)
+                recall = num_same / num_gold_tokens
+                f1 = max(f1, 2 * precision * recall / (precision + recall))
+        return 0.0, f1
+
+    def score_predictions(
+        self, predictions: List[Tuple[QuestionId, str]]
+    ) -> List[Tuple[float, float]]:
+        """
+        :param predictions: List of (QuestionId, predicted answer text) pairs
+        :returns: The (exact match, F1) scores of each prediction, in order
+        """
+        return [self.score_prediction(qid, text) for qid, text in predictions]
+
+    def update(self, predictions: Dict[QuestionId, str]) -> None:
+        """
+        Scores predictions and records their scores, replacing the scores of
+        questions that were predicted before. Predictions for questions the
+        scorer has no gold answers for are ignored
+        :param predictions: Mapping from QuestionId's to predicted answer texts
+        """
+        items = [(qid, text) for qid, text in predictions.items() if qid in self.golds]
+        chunks = [
+            items[start : start + SquadScorer.PARALLEL_CHUNK_SIZE]
+            for start in range(0, len(items), SquadScorer.PARALLEL_CHUNK_SIZE)
+        ]
+        if self.num_workers > 0 and len(chunks) > 1:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    self.num_workers, initializer=_init_worker, initargs=(self,)
+                )
+            chunk_scores = list(self.executor.map(_score_predictions, chunks))
+        else:
+            chunk_scores = [self.score_predictions(chunk) for chunk in chunks]
+        for chunk, scores in zip(chunks, chunk_scores):
+            for (qid, _), (exact, f1) in zip(chunk, scores):
+                self.exact_scores[qid] = exact
+                self.f1_scores[qid] = f1
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :returns: Exact match and F1 (as percentages) averaged over all questions
+            of the scorer, and the total number of questions
+        """
+        total = max(len(self.golds), 1)
+        return {
+            "exact_match": 100.0 * sum(self.exact_scores.values()) / total,
+            "f1": 100.0 * sum(self.f1_scores.values()) / total,
+            "total": len(self.golds),
+        }
+
+    def score(self, predictions: Dict[QuestionId, str]) -> Dict[str, float]:
+        """
+        Scores a full set of predictions from scratch
+        :param predictions: Mapping from QuestionId's to predicted answer texts
+        :returns: The metrics of the predictions
+        """
+        self.reset()
+        self.update(predictions)
+        return self.metrics()
+
+    def close(self) -> None:
+        """
+        Stops the worker processes if there are any
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self) -> "SquadScorer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Worker pools can't be pickled, copies start their own if needed
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+
+_worker_scorer: Optional[SquadScorer] = None
+
+
+def _init_worker(scorer: SquadScorer) -> None:
+    """
+    Keeps a copy of the scorer in each worker process so its gold answers are
+    only sent once
+    """
+    global _worker_scorer
+    _worker_scorer = scorer
+
+
+def _score_predictions(
+    predictions: List[Tuple[QuestionId, str]]
+) -> List[Tuple[float, float]]:
+    """
+    Module level wrapper around SquadScorer.score_predictions so it can be run
+    in worker processes
+    """
+    assert _worker_scorer is not None, "Scoring worker not initialized"
+    return _worker_scorer.score_predictions(predictions)
@@ -0,0 +1,238 @@
+"""
+Module that holds the asyncio serving components used by serve.py: a dynamic
+batcher that groups concurrent requests into model batches and a minimal
+HTTP/JSON front end
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import Executor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from model.inference import AnswerPrediction, InferenceEngine
+
+TimedPrediction = NamedTuple(
+    "TimedPrediction",
+    [("prediction", AnswerPrediction), ("queue_ms", float), ("compute_ms", float)],
+)
+
+PendingRequest = NamedTuple(
+    "PendingRequest",
+    [("pair", Tuple[str, str]), ("future", asyncio.Future), ("enqueue_time", float)],
+)
+
+
+class DynamicBatcher:
+    """
+    Gathers concurrently submitted (context, question) pairs into batches of at
+    most max_batch_size pairs, waiting at most max_wait_ms after the first pair of
+    a batch arrives, and answers each batch with a single model call run in an
+    executor so the event loop keeps accepting requests
+    """
+
+    engine: InferenceEngine
+    max_batch_size: int
+    max_wait_ms: float
+    executor: Optional[Executor]
+    queue: "Optional[asyncio.Queue[PendingRequest]]"
+
+    def __init__(
+        self,
+        engine: InferenceEngine,
+        max_batch_size: int,
+        max_wait_ms: float,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        """
+        :param engine: InferenceEngine to answer batches with
+        :param max_batch_size: Maximum number of pairs to answer in one batch
+        :param max_wait_ms: Maximum time to wait for a batch to fill up
+        :param executor: Executor to run the model in (default None: the event
+            loop's default executor)
+        """
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.queue = None
+
+    def get_queue(self) -> "asyncio.Queue[PendingRequest]":
+        """
+        Creates the queue on first use, from inside the coroutines that run in the
+        serving event loop, since before Python 3.10 a queue is bound to the loop
+        that's current when it's created
+        :returns: The queue of pending pairs
+        """
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        return self.queue
+
+    async def submit(self, context: str, question: str) -> TimedPrediction:
+        """
+        Queues a pair to be answered in the next batch
+        :param context: Context paragraph text
+        :param question: Question text
+        :returns: A TimedPrediction with the answer and the time the pair spent
+            queued and being computed
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self.get_queue().put(
+            PendingRequest((context, question), future, time.perf_counter())
+        )
+        return await future
+
+    async def run(self) -> None:
+        """
+        Answers queued pairs batch by batch until cancelled
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            requests = await self.next_batch()
+            compute_start = time.perf_counter()
+            try:
+                predictions = await loop.run_in_executor(
+                    self.executor,
+                    self.engine.answer_batch,
+                    [request.pair for request in requests],
+                )
+            except Exception as ex:
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(ex)
+                continue
+            compute_end = time.perf_counter()
+            for request, prediction in zip(requests, predictions):
+                if not request.future.done():
+                    request.future.set_result(
+                        TimedPrediction(
+                            prediction=prediction,
+                            queue_ms=1000 * (compute_start - request.enqueue_time),
+                            compute_ms=1000 * (compute_end - compute_start),
+                        )
+                    )
+
+    async def next_batch(self) -> List[PendingRequest]:
+        """
+        Waits for the first pending pair, then gathers more pairs until the batch
+        is full or max_wait_ms have passed
+        :returns: List of PendingRequest objects to answer together
+        """
+        queue = self.get_queue()
+        requests = [await queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return requests
+
+
+class AnswerServer:
+    """
+    Minimal HTTP/1.1 JSON server in front of a DynamicBatcher
+    Endpoints:
+        - POST /answer with a {"context": ..., "question": ...} object or a list of
+          them, answered with the answer of each pair and its latencies
+        - GET /health
+    """
+
+    batcher: DynamicBatcher
+
+    def __init__(self, batcher: DynamicBatcher) -> None:
+        self.batcher = batcher
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Runs the server and the batcher until cancelled
+        :param host: Host to listen on
+        :param port: Port to listen on
+        """
+        batcher_task = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers: Dict[str, str] = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                status, response = 400, {"error": "Malformed request"}
+            else:
+                status, response = await self.handle_request(
+                    request_line[0], request_line[1], body
+                )
+            payload = json.dumps(response).encode("utf-8")
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as ex:
+            print(f"[WARNING] Dropping malformed connection: {ex}")
+        finally:
+            writer.close()
+
+    async def handle_request(
+        self, method: str, path: str, body: bytes
+    ) -> Tuple[int, Any]:
+        """
+        Routes a single request
+        :param method: HTTP method of the request
+        :param path: Path of the request
+        :param body: Body of the request
+        :returns: Tuple of the HTTP status code and the JSON response
+        """
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method != "POST" or path != "/answer":
+            return 404, {"error": f"No endpoint {method} {path}"}
+        try:
+            request = json.loads(body.decode("utf-8"))
+            pairs = [
+                (str(pair["context"]), str(pair["question"]))
+                for pair in (request if isinstance(request, list) else [request])
+            ]
+        except (ValueError, KeyError, TypeError) as ex:
+            return 400, {"error": f"Malformed request body: {ex}"}
+        try:
+            timed_predictions = await asyncio.gather(
+                *[self.batcher.submit(context, question) for context, question in pairs]
+            )
+        except Exception as ex:
+            return 500, {"error": f"Can't answer request: {ex}"}
+        answers = [
+            {
+                "text": timed.prediction.text,
+                "char_span": list(timed.prediction.char_span),
+                "score": timed.prediction.score,
+                "no_answer_score": timed.prediction.no_answer_score,
+                "queue_ms": timed.queue_ms,
+                "compute_ms": timed.compute_ms,
+            }
+            for timed in timed_predictions
+        ]
+        return 200, answers if isinstance(request, list) else answers[0]
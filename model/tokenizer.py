@@ -2,13 +2,125 @@
 Module to hold tokenizer logic
 """
 
-from typing import List, Tuple, NamedTuple
+import re
+from collections import OrderedDict
+from typing import (
+    List,
+    Tuple,
+    NamedTuple,
+    Dict,
+    Any,
+    ClassVar,
+    Iterator,
+    Pattern,
+    Sequence,
+    Union,
+)
+
+import numpy as np
 from nltk.tokenize import WordPunctTokenizer
 
 
 Token = NamedTuple("Token", [("word", str), ("span", Tuple[int, int])])
 
 
+class TokenList(Sequence[Token]):
+    """
+    Compact, read-only list of Tokens. Instead of a Token object and a span tuple
+    per token, the words are kept concatenated in a single string and the word
+    boundaries and char spans in int32 numpy arrays. Tokens are only built when
+    they're indexed, so existing code that reads tokens[i].word or
+    tokens[i].span keeps working
+    """
+
+    __slots__ = ("word_buffer", "word_offsets", "spans")
+
+    word_buffer: str
+    word_offsets: Any  # numpy array
+    spans: Any  # numpy array
+
+    def __init__(self, words: List[str], spans: Any) -> None:
+        """
+        :param words: Word of each token
+        :param spans: (start, end) char span of each token, as a sequence of pairs
+            or an array of shape (num_tokens, 2)
+        """
+        self.word_buffer = "".join(words)
+        self.word_offsets = np.zeros(len(words) + 1, dtype=np.int32)
+        np.cumsum([len(word) for word in words], out=self.word_offsets[1:])
+        self.spans = np.array(spans, dtype=np.int32).reshape(len(words), 2)
+
+    @classmethod
+    def from_tokens(cls, tokens: Sequence[Token]) -> "TokenList":
+        """
+        :param tokens: Tokens, e.g. as returned by a Tokenizer
+        :returns: A TokenList of the same tokens
+        """
+        if isinstance(tokens, TokenList):
+            return tokens
+        return cls([token.word for token in tokens], [token.span for token in tokens])
+
+    @property
+    def words(self) -> List[str]:
+        """
+        :returns: The word of every token
+        """
+        offsets = self.word_offsets.tolist()
+        return [
+            self.word_buffer[start:end] for start, end in zip(offsets, offsets[1:])
+        ]
+
+    @property
+    def starts(self) -> Any:
+        """
+        :returns: int32 numpy array of the first char index of every token
+        """
+        return self.spans[:, 0]
+
+    @property
+    def ends(self) -> Any:
+        """
+        :returns: int32 numpy array of the char index after every token
+        """
+        return self.spans[:, 1]
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __getitem__(self, idx: Union[int, slice]) -> Any:
+        if isinstance(idx, slice):
+            return [self[token_idx] for token_idx in range(len(self))[idx]]
+        idx = range(len(self))[idx]
+        start, end = self.spans[idx].tolist()
+        return Token(
+            word=self.word_buffer[self.word_offsets[idx] : self.word_offsets[idx + 1]],
+            span=(start, end),
+        )
+
+    def __iter__(self) -> Iterator[Token]:
+        for word, (start, end) in zip(self.words, self.spans.tolist()):
+            yield Token(word=word, span=(start, end))
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, TokenList):
+            return self.word_buffer == other.word_buffer and (
+                np.array_equal(self.word_offsets, other.word_offsets)
+                and np.array_equal(self.spans, other.spans)
+            )
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"TokenList({list(self)})"
+
+    def __getstate__(self) -> Tuple[str, Any, Any]:
+        return self.word_buffer, self.word_offsets, self.spans
+
+    def __setstate__(self, state: Tuple[str, Any, Any]) -> None:
+        self.word_buffer, self.word_offsets, self.spans = state
+
+
 class Tokenizer:
     """
     Base class for tokenizer wrappers
@@ -23,6 +135,21 @@ class Tokenizer:
         """
         raise NotImplementedError
 
+    def tokenize_batch(self, texts: List[str]) -> List[List[Token]]:
+        """
+        Tokenizes a list of texts
+        :param texts: List of strings to tokenize
+        :returns: A list of Tokens for each text, in the order of the texts
+        """
+        return [self.tokenize(text) for text in texts]
+
+    def fingerprint(self) -> str:
+        """
+        :returns: A string that identifies how this tokenizer splits text, two
+            tokenizers with the same fingerprint produce the same tokens
+        """
+        return type(self).__name__
+
 
 class NltkTokenizer(Tokenizer):
 
@@ -39,3 +166,90 @@ class NltkTokenizer(Tokenizer):
         spans = list(self.tokenizer.span_tokenize(text))
         words = [text[span_start:span_end] for span_start, span_end in spans]
         return [Token(word=word, span=span) for word, span in zip(words, spans)]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # NLTK's compiled pattern doesn't survive pickling, i.e. for preprocessing
+        # worker processes, so the tokenizer is rebuilt instead of copied
+        state = self.__dict__.copy()
+        del state["tokenizer"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.tokenizer = WordPunctTokenizer()
+
+
+class RegexTokenizer(Tokenizer):
+    """
+    Tokenizer that matches the tokens of NLTK's WordPunctTokenizer directly
+    with its regular expression, without going through NLTK
+    """
+
+    WORD_PUNCT_PATTERN: ClassVar[Pattern] = re.compile(r"\w+|[^\w\s]+")
+
+    def tokenize(self, text: str) -> List[Token]:
+        return [
+            Token(word=match.group(), span=match.span())
+            for match in RegexTokenizer.WORD_PUNCT_PATTERN.finditer(text)
+        ]
+
+
+class CachingTokenizer(Tokenizer):
+    """
+    Tokenizer that wraps another tokenizer and keeps the tokens of the most
+    recently tokenized texts in an LRU cache, so repeated texts (i.e. answers
+    given by several annotators) are only tokenized once
+    """
+
+    tokenizer: Tokenizer
+    max_size: int
+    cache: "OrderedDict[str, List[Token]]"
+
+    def __init__(self, tokenizer: Tokenizer, max_size: int = 100000) -> None:
+        """
+        :param tokenizer: Tokenizer to tokenize texts that aren't cached with
+        :param max_size: Maximum number of texts to keep tokens of (default 100000)
+        """
+        self.tokenizer = tokenizer
+        self.max_size = max_size
+        self.cache = OrderedDict()
+
+    def tokenize(self, text: str) -> List[Token]:
+        tokens = self.cache.get(text)
+        if tokens is None:
+            tokens = self.tokenizer.tokenize(text)
+            self.add_to_cache(text, tokens)
+        else:
+            self.cache.move_to_end(text)
+        return list(tokens)
+
+    def tokenize_batch(self, texts: List[str]) -> List[List[Token]]:
+        uncached_texts = list(
+            OrderedDict.fromkeys(text for text in texts if text not in self.cache)
+        )
+        for text, tokens in zip(
+            uncached_texts, self.tokenizer.tokenize_batch(uncached_texts)
+        ):
+            self.add_to_cache(text, tokens)
+        return [self.tokenize(text) for text in texts]
+
+    def fingerprint(self) -> str:
+        # Caching doesn't change the tokens
+        return self.tokenizer.fingerprint()
+
+    def add_to_cache(self, text: str, tokens: List[Token]) -> None:
+        """
+        Adds the tokens of a text to the cache, evicting the least recently
+        used text if the cache is full
+        :param text: The tokenized text
+        :param tokens: The tokens of the text
+        """
+        self.cache[text] = tokens
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Don't ship the cache to worker processes
+        state = self.__dict__.copy()
+        state["cache"] = OrderedDict()
+        return state
@@ -9,55 +9,99 @@ class TrainArgs:
     dev_file: str
     word_vector_file: str
     batch_size: int
+    eval_batch_size: int
+    eval_num_workers: int
     num_epochs: int
     lr: float
     weight_decay: float
     max_grad_norm: float
     ema_weight: float
+    ema_eval_weights: bool
     char_embedding_size: int
     attention_linear_hidden_size: int
+    attention_block_size: int
     highway_layers: int
     rnn_hidden_size: int
     rnn_num_layers: int
     max_context_size: int
     max_question_size: int
+    max_answer_size: int
+    context_window_size: int
+    context_window_stride: int
     loader_num_workers: int
+    preprocess_num_workers: int
+    preprocess_cache_dir: str
+    stream_train_file: bool
+    shuffle_buffer_size: int
+    bucket_batches: bool
+    max_batch_tokens: int
+    group_contexts: bool
     dropout: float
     run_name: str
+    checkpoint_every_steps: int
+    keep_checkpoints: int
+    max_pending_checkpoints: int
+    resume: bool
     rnn_unidirectional: bool
     simple_bidaf: bool
     debug: bool
     multi_answer: bool
+    columnar_corpus: bool
+    prune_vectors: bool
+    vocab_top_k: int
     no_self_attention: bool
     disable_cuda: bool
+    precision: str
 
     DEFAULT_ARGS = {
         "train_file": "data/original/train.json",
         "dev_file": "data/original/dev.json",
         "word_vector_file": "data/word-vectors/glove/glove.6B.100d.txt",
         "batch_size": 45,
+        "eval_batch_size": 90,
+        "eval_num_workers": 0,
         "num_epochs": 50,
         "lr": 0.5,
         "weight_decay": 0,
         "max_grad_norm": 100,
         "ema_weight": 0.99,
+        "ema_eval_weights": False,
         "char_embedding_size": 20,
         "attention_linear_hidden_size": 200,
+        "attention_block_size": 0,
         "highway_layers": 2,
         "rnn_hidden_size": 100,
         "rnn_num_layers": 1,
         "max_context_size": 400,
         "max_question_size": 100,
+        "max_answer_size": 0,
+        "context_window_size": 0,
+        "context_window_stride": 128,
         "loader_num_workers": 2,
+        "preprocess_num_workers": 0,
+        "preprocess_cache_dir": "preprocess-cache",
+        "stream_train_file": False,
+        "shuffle_buffer_size": 10000,
+        "bucket_batches": False,
+        "max_batch_tokens": 0,
+        "group_contexts": False,
         "dropout": 0.1,
         "config_file": "train-config.json",
         "run_name": "train-run",
+        "checkpoint_every_steps": 0,
+        "keep_checkpoints": 3,
+        "max_pending_checkpoints": 2,
+        "resume": False,
         "rnn_unidirectional": False,
         "simple_bidaf": False,
         "debug": False,
         "multi_answer": False,
+        "columnar_corpus": False,
+        "prune_vectors": False,
+        "vocab_top_k": 0,
         "no_self_attention": False,
         "disable_cuda": False,
+        "precision": "float32",
     }
 
     def __init__(self, arg_dict: Dict[str, Any]) -> None:
@@ -67,27 +111,49 @@ class TrainArgs:
         self.dev_file = arg_dict["dev_file"]
         self.word_vector_file = arg_dict["word_vector_file"]
         self.batch_size = arg_dict["batch_size"]
+        self.eval_batch_size = arg_dict["eval_batch_size"]
+        self.eval_num_workers = arg_dict["eval_num_workers"]
         self.num_epochs = arg_dict["num_epochs"]
         self.lr = arg_dict["lr"]
         self.weight_decay = arg_dict["weight_decay"]
         self.max_grad_norm = arg_dict["max_grad_norm"]
         self.ema_weight = arg_dict["ema_weight"]
+        self.ema_eval_weights = arg_dict["ema_eval_weights"]
         self.char_embedding_size = arg_dict["char_embedding_size"]
         self.attention_linear_hidden_size = arg_dict["attention_linear_hidden_size"]
+        self.attention_block_size = arg_dict["attention_block_size"]
         self.highway_layers = arg_dict["highway_layers"]
         self.rnn_hidden_size = arg_dict["rnn_hidden_size"]
         self.rnn_num_layers = arg_dict["rnn_num_layers"]
         self.max_context_size = arg_dict["max_context_size"]
         self.max_question_size = arg_dict["max_question_size"]
+        self.max_answer_size = arg_dict["max_answer_size"]
+        self.context_window_size = arg_dict["context_window_size"]
+        self.context_window_stride = arg_dict["context_window_stride"]
         self.loader_num_workers = arg_dict["loader_num_workers"]
+        self.preprocess_num_workers = arg_dict["preprocess_num_workers"]
+        self.preprocess_cache_dir = arg_dict["preprocess_cache_dir"]
+        self.stream_train_file = arg_dict["stream_train_file"]
+        self.shuffle_buffer_size = arg_dict["shuffle_buffer_size"]
+        self.bucket_batches = arg_dict["bucket_batches"]
+        self.max_batch_tokens = arg_dict["max_batch_tokens"]
+        self.group_contexts = arg_dict["group_contexts"]
         self.dropout = arg_dict["dropout"]
         self.run_name = arg_dict["run_name"]
+        self.checkpoint_every_steps = arg_dict["checkpoint_every_steps"]
+        self.keep_checkpoints = arg_dict["keep_checkpoints"]
+        self.max_pending_checkpoints = arg_dict["max_pending_checkpoints"]
+        self.resume = arg_dict["resume"]
         self.rnn_unidirectional = arg_dict["rnn_unidirectional"]
         self.simple_bidaf = arg_dict["simple_bidaf"]
         self.debug = arg_dict["debug"]
         self.multi_answer = arg_dict["multi_answer"]
+        self.columnar_corpus = arg_dict["columnar_corpus"]
+        self.prune_vectors = arg_dict["prune_vectors"]
+        self.vocab_top_k = arg_dict["vocab_top_k"]
         self.no_self_attention = arg_dict["no_self_attention"]
         self.disable_cuda = arg_dict["disable_cuda"]
+        self.precision = arg_dict["precision"]
         # fmt: on
 
     @staticmethod
@@ -96,30 +162,52 @@ class TrainArgs:
         # fmt: off
         parser = argparse.ArgumentParser()
         parser.add_argument("--run-name", type=str, help="name of run (also used for model saving and initialization)",)
+        parser.add_argument("--checkpoint-every-steps", type=int, help="Also write a training checkpoint every this many steps (0 to only checkpoint at the end of every epoch)")
+        parser.add_argument("--keep-checkpoints", type=int, help="Number of most recent training checkpoints to keep (0 to keep all)")
+        parser.add_argument("--max-pending-checkpoints", type=int, help="Number of checkpoints that can wait in memory to be written before training waits for the writes")
+        parser.add_argument("--resume", action="store_true", help="if specified resume training from the latest training checkpoint of the run, including the optimizer and EMA states")
         parser.add_argument("--config-file", type=str, help="load config from this json file other command line args override this config")
         parser.add_argument("--train-file", type=str)
         parser.add_argument("--dev-file", type=str)
         parser.add_argument("--word-vector-file", type=str)
         parser.add_argument("--batch-size", type=int)
+        parser.add_argument("--eval-batch-size", type=int, help="Batch size to use for validation")
+        parser.add_argument("--eval-num-workers", type=int, help="Number of DataLoader workers to use for validation")
         parser.add_argument("--num-epochs", type=int)
         parser.add_argument("--lr", type=float)
         parser.add_argument("--weight-decay", type=float, help="weight decay (L2 penalty) to use during training")
         parser.add_argument("--max-grad-norm", type=float, help="Maximum norm to use for gradient clipping (default None-> no gradient clipping)")
         parser.add_argument("--ema-weight", type=float, help="Weight to use for exponential moving averages during training (default 0.99)")
+        parser.add_argument("--ema-eval-weights", action="store_true", help="if specified keep the moving averages as separate weights used for validation and saving instead of overwriting the training weights every step")
         parser.add_argument("--char-embedding-size", help="Set to 0 to disable char-level embeddings")
         parser.add_argument("--max-context-size", help="Trim all context values to this length during training (0 for unlimited)")
         parser.add_argument("--max-question-size", type=int, help="Trim all context values to this length during training (0 for unlimited)")
+        parser.add_argument("--max-answer-size", type=int, help="Only predict answer spans of at most this many tokens (0 for unlimited)")
+        parser.add_argument("--context-window-size", type=int, help="Split longer contexts into overlapping windows of this many tokens instead of trimming them, should be at most --max-context-size (0 to disable)")
+        parser.add_argument("--context-window-stride", type=int, help="Number of tokens between the starts of consecutive context windows")
         parser.add_argument("--attention-linear-hidden-size", type=int)
+        parser.add_argument("--attention-block-size", type=int, help="Compute attention in blocks of this many tokens to bound memory on long contexts (0 to compute it all at once)")
         parser.add_argument("--rnn-hidden-size", type=int)
         parser.add_argument("--rnn-num-layers", type=int)
         parser.add_argument("--dropout", type=float)
         parser.add_argument("--loader-num-workers", type=int, help="number of worker processes to use for DataLoader")
+        parser.add_argument("--preprocess-num-workers", type=int, help="number of worker processes to use for tokenizing raw datasets (0 for serial processing)")
+        parser.add_argument("--preprocess-cache-dir", type=str, help="Directory to cache preprocessed datasets in, keyed by a hash of the data file, tokenizer, text processor and word vector vocab so stale caches are never used (empty to disable caching)")
+        parser.add_argument("--stream-train-file", action="store_true", help="if specified stream the training file one paragraph at a time instead of loading it into memory, for datasets that don't fit in memory (can't be used with --prune-vectors, --bucket-batches or --group-contexts)")
+        parser.add_argument("--shuffle-buffer-size", type=int, help="with --stream-train-file, number of samples to shuffle among (0 to keep the order of the file)")
+        parser.add_argument("--bucket-batches", action="store_true", help="if specified batch together samples with similar context lengths")
+        parser.add_argument("--max-batch-tokens", type=int, help="with --bucket-batches, size batches to hold at most this many context tokens instead of batch-size samples (0 to disable)")
+        parser.add_argument("--group-contexts", action="store_true", help="if specified batch questions of the same paragraph together and encode each paragraph once per batch")
         parser.add_argument("--rnn_unidirectional ", action="store_true", help="if specified make all RNNs unidirectional instead of bidirectional")
         parser.add_argument("--simple-bidaf", action="store_true", help="if specified use bidaf instead of docqa")
         parser.add_argument("--debug", action="store_true", help="if specified debug by fitting a single batch and profiling")
         parser.add_argument("--multi-answer", action="store_true", help="if specified don't truncate answer spans down to one")
+        parser.add_argument("--columnar-corpus", action="store_true", help="if specified memory map encoded samples from columnar files next to the preprocessed dataset cache (or <data file>-columnar-* files keyed by the data and preprocessing settings if caching is disabled), written on first use")
+        parser.add_argument("--prune-vectors", action="store_true", help="if specified restrict the word vectors to words in the train and dev sets and save them to <run name>-vocab-*")
+        parser.add_argument("--vocab-top-k", type=int, help="with --prune-vectors, only keep this many of the most frequent words (0 for all)")
         parser.add_argument("--no-self-attention", action="store_true", help="if specified don't use self attention")
         parser.add_argument("--disable-cuda", action="store_true", help="if specified don't use CUDA even if available")
+        parser.add_argument("--precision", type=str, choices=["float32", "bfloat16", "float16"], help="Precision to train in, bfloat16 and float16 use autocast mixed precision (float16 needs CUDA)")
         # fmt: on
         return parser.parse_known_args()[0]
 
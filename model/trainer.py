@@ -2,10 +2,10 @@
 Module that holds the training harness
 """
 
-import json
+from contextlib import contextmanager
 from typing import (
     Any,
-    Callable,
+    Iterator,
     List,
     Dict,
     Tuple,
@@ -13,6 +13,7 @@ from typing import (
     NamedTuple,
     cast,
     Optional,
+    Union,
 )
 
 from tqdm import tqdm, trange
@@ -20,9 +21,10 @@ import torch as t
 from torch.utils.data import DataLoader
 import torch.optim as optim
 
-from model.corpus import QADataset, TrainDataset, EvalDataset
+from model.corpus import QADataset, TrainDataset, EvalDataset, StreamingQADataset
 from model.qa import QuestionId
-from model.batcher import QABatch, get_collator
+from model.batcher import QABatch, BucketBatchSampler, get_collator
+from model.checkpoint import AsyncCheckpointer
 from model.predictor import PredictorModel, ModelPredictions
 from model.profiler import memory_profiled, autograd_profiled
 from model.modules.ema import EMA
@@ -32,10 +34,25 @@ from model.evaluator import (
     MultiClassLossEvaluator,
     SingleClassLossEvaluator,
     get_answer_token_idxs,
+    merge_best_answers,
 )
 
-import scripts.evaluate_v1_1 as evaluate_v1_1  # type: ignore
-import scripts.evaluate_v2_0 as evaluate_v2_0  # type: ignore
+"""
+Predictions of a model over a whole dataset:
+    :loss: Average loss over the dataset
+    :answer_token_idxs: Mapping from each QuestionId to its best (span start,
+        span end, score) answer
+    :no_answer_scores: Mapping from each QuestionId to its no-answer logit if the
+        model predicts them
+"""
+DatasetPredictions = NamedTuple(
+    "DatasetPredictions",
+    [
+        ("loss", float),
+        ("answer_token_idxs", Dict[QuestionId, Tuple[Any, ...]]),
+        ("no_answer_scores", Dict[QuestionId, float]),
+    ],
+)
 
 
 class Trainer:
@@ -48,13 +65,35 @@ class Trainer:
         :learning_rate: lr for adam optimizer
         :weight_decay: weight decay to use in the optimizer
         :max_grad_norm: Maximum gradient norm for gradient clipping
+        :ema_weight: Weight of the new parameter values in their moving averages
+        :ema_eval_weights: If True keep the moving averages as separate weights
+            used for validation and saving instead of overwriting the training
+            weights with them after every step
         :num_epochs: Number of epochs to train for
         :batch_size: Size of each training batch
         :max_question_size: Trims longer questions to this length
         :max_context_size: Trims longer contexts to this length
+        :max_answer_size: Only predicts answer spans up to this length (0 for unlimited)
         :device: Torch device to use for training
+        :precision: float32, or bfloat16/float16 to train with autocast mixed
+            precision (float16 also scales the loss and needs a CUDA device)
         :loader_num_workers: Number of workers to use for DataLoader
+        :bucket_batches: If True batch together samples with similar context lengths
+        :max_batch_tokens: If nonzero (and bucket_batches is True) size batches to
+            hold at most this many context tokens instead of batch_size samples
+        :group_contexts: If True batch questions of the same paragraph together and
+            encode each paragraph once per batch
+        :eval_batch_size: Size of each validation batch
+        :eval_num_workers: Number of DataLoader and scoring workers to use for
+            validation
         :model_checkpoint_path: Path to save serialized model parameters to
+        :checkpoint_every_steps: If nonzero also write a training checkpoint every
+            this many steps, not only at the end of every epoch
+        :keep_checkpoints: Number of most recent training checkpoints to keep
+            (0 to keep all)
+        :max_pending_checkpoints: Number of checkpoints that can wait in memory to
+            be written before training waits for the writes
+        :resume_from_checkpoint: If True resume from the latest training checkpoint
     """
     TrainingConfig = NamedTuple(
         "TrainingConfig",
@@ -63,16 +102,34 @@ class Trainer:
             ("weight_decay", float),
             ("max_grad_norm", float),
             ("ema_weight", float),
+            ("ema_eval_weights", bool),
             ("num_epochs", int),
             ("batch_size", int),
             ("max_question_size", int),
             ("max_context_size", int),
+            ("max_answer_size", int),
             ("device", t.device),
+            ("precision", str),
             ("loader_num_workers", int),
+            ("bucket_batches", bool),
+            ("max_batch_tokens", int),
+            ("group_contexts", bool),
+            ("eval_batch_size", int),
+            ("eval_num_workers", int),
             ("model_checkpoint_path", str),
+            ("checkpoint_every_steps", int),
+            ("keep_checkpoints", int),
+            ("max_pending_checkpoints", int),
+            ("resume_from_checkpoint", bool),
         ],
     )
 
+    AUTOCAST_DTYPES: Dict[str, Optional[t.dtype]] = {
+        "float32": None,
+        "bfloat16": t.bfloat16,
+        "float16": t.float16,
+    }
+
     @classmethod
     def one_train_iteration(
         cls,
@@ -83,6 +140,8 @@ class Trainer:
         optimizer: t.optim.Optimizer,
         ema: EMA,
         max_grad_norm: Optional[float] = None,
+        autocast_dtype: Optional[t.dtype] = None,
+        grad_scaler: Optional[Any] = None,
     ) -> float:
         """
         Runs one train iteration of the given model on the given batch,
@@ -95,22 +154,75 @@ class Trainer:
         :param optimizer: Optimizer to step over model
         :param ema: EMA module
         :param max_grad_norm: If specified clip gradients at this norm
+        :param autocast_dtype: If specified run the forward pass with autocast in
+            this dtype, the loss is still computed in float32
+        :param grad_scaler: If specified a GradScaler to scale the loss with
         :returns: Total loss for batch
         """
-        predictions: ModelPredictions = model(batch)
-        loss = evaluator(batch, predictions)
+        with cls.autocast(batch.context_words.device, autocast_dtype):
+            predictions: ModelPredictions = model(batch)
+            loss = evaluator(batch, predictions)
         model.zero_grad()
         optimizer.zero_grad()
-        loss.backward()
-        if max_grad_norm:
-            t.nn.utils.clip_grad_norm_(parameters, max_grad_norm)
-        optimizer.step()
-        for name, param in model.named_parameters():
-            if param.requires_grad:
-                param.data = ema(name, param.data)
+        if grad_scaler is not None:
+            grad_scaler.scale(loss).backward()
+            if max_grad_norm:
+                grad_scaler.unscale_(optimizer)
+                t.nn.utils.clip_grad_norm_(parameters, max_grad_norm)
+            # Skips the step if the scaled gradients overflowed, and lowers the
+            # scale, in which case the weights and so their EMA don't change
+            scale = grad_scaler.get_scale()
+            grad_scaler.step(optimizer)
+            grad_scaler.update()
+            if grad_scaler.get_scale() >= scale:
+                ema.update()
+        else:
+            loss.backward()
+            if max_grad_norm:
+                t.nn.utils.clip_grad_norm_(parameters, max_grad_norm)
+            optimizer.step()
+            ema.update()
         batch_loss = loss.item()
         return cast(float, batch_loss)
 
+    @staticmethod
+    @contextmanager
+    def autocast(device: t.device, dtype: Optional[t.dtype]) -> Iterator[None]:
+        """
+        Context manager that runs the ops inside it with autocast mixed precision
+        :param device: Device the ops run on
+        :param dtype: Reduced precision dtype to autocast to, or None for a no-op
+        """
+        if dtype is None:
+            yield
+            return
+        with t.autocast(device.type, dtype=dtype):
+            yield
+
+    @classmethod
+    def get_grad_scaler(cls, training_config: TrainingConfig) -> Optional[Any]:
+        """
+        Checks that the training precision is supported and builds the GradScaler
+        it needs. Only float16 needs loss scaling, bfloat16 has the same
+        exponent range as float32
+        :param training_config: Training config to pull parameters from
+        :returns: A GradScaler for float16 training, otherwise None
+        """
+        if training_config.precision not in cls.AUTOCAST_DTYPES:
+            raise Exception(f"Unknown training precision: {training_config.precision}")
+        if training_config.precision == "float32":
+            return None
+        if not hasattr(t, "autocast"):
+            raise Exception("Mixed precision training needs a newer PyTorch version")
+        if training_config.precision != "float16":
+            return None
+        if training_config.device.type != "cuda":
+            raise Exception("float16 training needs a CUDA device, use bfloat16 on CPU")
+        # t.cuda.amp.GradScaler is deprecated since PyTorch 2.4
+        if hasattr(t.amp, "GradScaler"):
+            return t.amp.GradScaler("cuda")
+        return t.cuda.amp.GradScaler()
+
     @classmethod
     def training_run(
         cls,
@@ -126,6 +238,9 @@ class Trainer:
         """
         Trains the given model over the entire data loader for as many epochs as specified, validating on dev
         after every epoch and saving the model to disk after every epoch
+        Training checkpoints with the model, optimizer and EMA states are written in
+        the background after every epoch and every checkpoint_every_steps steps.
+        Resuming from a checkpoint taken mid-epoch restarts that epoch
         :param loader: DataLoader to load the batches
         :param model: Model to train
         :param parameters: Parameters of model to train
@@ -135,15 +250,70 @@ class Trainer:
         :param dev_dataset: EvalDataset to validate on
         :param training_config: TrainingConfig object describing parameters for training
         """
+        save_path = (
+            training_config.model_checkpoint_path + ".pth"
+            if not training_config.model_checkpoint_path.endswith(".pth")
+            else training_config.model_checkpoint_path
+        )
+        checkpointer = AsyncCheckpointer(
+            save_path[: -len(".pth")],
+            training_config.keep_checkpoints,
+            training_config.max_pending_checkpoints,
+        )
+        autocast_dtype = cls.AUTOCAST_DTYPES[training_config.precision]
+        grad_scaler = cls.get_grad_scaler(training_config)
         epoch_losses: List[float] = []
         dev_losses: List[float] = []
         dev_f1s: List[float] = []
         dev_ems: List[float] = []
-        with trange(training_config.num_epochs) as epoch_loop:
+        start_epoch = 0
+        step = 0
+        if training_config.resume_from_checkpoint:
+            state = AsyncCheckpointer.load_latest(checkpointer.prefix)
+            if state is None:
+                print("No checkpoint to resume from, training from scratch")
+            else:
+                model.load_state_dict(state["model"])
+                optimizer.load_state_dict(state["optimizer"])
+                ema.load_state_dict(state["ema"])
+                if grad_scaler is not None and "grad_scaler" in state:
+                    grad_scaler.load_state_dict(state["grad_scaler"])
+                t.set_rng_state(state["rng_state"])
+                if "np_rng_state" in state:
+                    AsyncCheckpointer.set_numpy_rng_state(state["np_rng_state"])
+                start_epoch = state["epoch"]
+                step = state["step"]
+                epoch_losses = state["run_stats"]["all_epoch_losses"]
+                dev_losses = state["run_stats"]["all_dev_losses"]
+                dev_f1s = state["run_stats"]["all_dev_f1s"]
+                dev_ems = state["run_stats"]["all_dev_ems"]
+
+        def get_training_state(epoch: int) -> Dict[str, Any]:
+            state: Dict[str, Any] = {
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "ema": ema.state_dict(),
+                "rng_state": t.get_rng_state(),
+                "np_rng_state": AsyncCheckpointer.get_numpy_rng_state(),
+                "epoch": epoch,
+                "step": step,
+                "run_stats": {
+                    "all_epoch_losses": epoch_losses,
+                    "all_dev_losses": dev_losses,
+                    "all_dev_f1s": dev_f1s,
+                    "all_dev_ems": dev_ems,
+                },
+            }
+            if grad_scaler is not None:
+                state["grad_scaler"] = grad_scaler.state_dict()
+            return state
+
+        with trange(start_epoch, training_config.num_epochs) as epoch_loop:
             for epoch in epoch_loop:
                 epoch_loop.set_description("Epoch %d" % (epoch + 1))
                 model.train()
                 epoch_loss = 0.0
+                num_batches = 0
                 with tqdm(loader) as batch_loop:
                     for batch_num, batch in enumerate(batch_loop):
                         batch_loop.set_description("Batch %d" % (batch_num + 1))
@@ -156,13 +326,26 @@ class Trainer:
                             optimizer,
                             ema,
                             training_config.max_grad_norm,
+                            autocast_dtype,
+                            grad_scaler,
                         ) / len(batch)
                         epoch_loss += batch_loss
+                        num_batches += 1
                         batch_loop.set_postfix(loss=batch_loss)
-                epoch_loss = epoch_loss / len(loader)
-                dev_loss, dev_f1, dev_em = cls.validate(
-                    dev_dataset, model, evaluator, training_config, epoch
-                )
+                        step += 1
+                        if (
+                            training_config.checkpoint_every_steps
+                            and step % training_config.checkpoint_every_steps == 0
+                        ):
+                            checkpointer.save_checkpoint(
+                                step, get_training_state(epoch)
+                            )
+                # Streamed datasets have no length, count the batches instead
+                epoch_loss = epoch_loss / max(num_batches, 1)
+                with ema.average_parameters():
+                    dev_loss, dev_f1, dev_em = cls.validate(
+                        dev_dataset, model, evaluator, training_config, epoch
+                    )
                 epoch_losses.append(epoch_loss)
                 dev_losses.append(dev_loss)
                 dev_f1s.append(dev_f1)
@@ -171,12 +354,9 @@ class Trainer:
                 print(
                     f"Saving model checkpoint to {training_config.model_checkpoint_path}"
                 )
-                save_path = (
-                    training_config.model_checkpoint_path + ".pth"
-                    if not training_config.model_checkpoint_path.endswith(".pth")
-                    else training_config.model_checkpoint_path
-                )
-                t.save(model, save_path)
+                checkpointer.save_checkpoint(step, get_training_state(epoch + 1))
+                with ema.average_parameters():
+                    checkpointer.save_model(model, save_path)
                 run_stats_dict = {
                     "current_epoch": epoch,
                     "current_epoch_loss": epoch_loss,
@@ -188,14 +368,14 @@ class Trainer:
                     "all_dev_f1s": dev_f1s,
                     "all_dev_ems": dev_ems,
                 }
-                with open("run-stats.json", "w") as stats_file:
-                    json.dump(run_stats_dict, stats_file)
+                checkpointer.save_json(run_stats_dict, "run-stats.json")
+        checkpointer.close()
 
     @classmethod
     def train_model(
         cls,
         model: PredictorModel,
-        train_dataset: TrainDataset,
+        train_dataset: Union[TrainDataset, StreamingQADataset],
         dev_dataset: EvalDataset,
         training_config: TrainingConfig,
         debug: bool = False,
@@ -205,7 +385,8 @@ class Trainer:
         the trained model instance
 
         :param model: A PredictorModel to train the parameters of
-        :param train_dataset: A TrainDataset object of training data
+        :param train_dataset: A TrainDataset or StreamingQADataset object of
+            training data
         :param dev_dataset: An EvalDataset object of dev data
         :param training_config: TrainingConfig object describing parameters of training run
         :param debug: If True profile performance (default False)
@@ -214,7 +395,7 @@ class Trainer:
         """
 
         train_evaluator: Evaluator
-        if train_dataset.corpus.stats.single_answer:
+        if train_dataset.stats.single_answer:
             train_evaluator = SingleClassLossEvaluator()
         else:
             train_evaluator = MultiClassLossEvaluator()
@@ -224,20 +405,12 @@ class Trainer:
             lr=training_config.learning_rate,
             weight_decay=training_config.weight_decay,
         )
-        ema: EMA = EMA(training_config.ema_weight)
-        for name, param in model.named_parameters():
-            if param.requires_grad:
-                ema.register(name, param.data)
-        loader: DataLoader = DataLoader(
-            train_dataset,
-            batch_size=training_config.batch_size,
-            shuffle=True,
-            pin_memory=True,
-            num_workers=training_config.loader_num_workers,
-            collate_fn=get_collator(
-                training_config.max_question_size, training_config.max_context_size
-            ),
+        ema: EMA = EMA(
+            training_config.ema_weight,
+            model.named_parameters(),
+            replace_params=not training_config.ema_eval_weights,
         )
+        loader: DataLoader = cls.get_loader(train_dataset, training_config, train=True)
         if debug:
             # Wrap in profiler
             unwrapped_iteration = cls.one_train_iteration
@@ -253,19 +426,90 @@ class Trainer:
                     use_cuda=training_config.device == t.device("cuda"),
                 ),
             )
-        cls.training_run(
-            loader,
-            model,
-            trainable_parameters,
-            train_evaluator,
-            optimizer,
-            ema,
-            dev_dataset,
-            training_config,
-        )
+        try:
+            cls.training_run(
+                loader,
+                model,
+                trainable_parameters,
+                train_evaluator,
+                optimizer,
+                ema,
+                dev_dataset,
+                training_config,
+            )
+        finally:
+            dev_dataset.close_scorer()
         if debug:
             setattr(cls, "one_train_iteration", unwrapped_iteration)
             setattr(cls, "training_run", unwrapped_train_run)
+        # The trained model holds the averaged weights
+        ema.copy_to_parameters()
+
+    @classmethod
+    def get_loader(
+        cls,
+        dataset: Union[QADataset, StreamingQADataset],
+        training_config: TrainingConfig,
+        train: bool = False,
+    ) -> DataLoader:
+        """
+        Builds a DataLoader over the given dataset
+        :param dataset: QADataset or StreamingQADataset to load batches from, a
+            StreamingQADataset is shuffled by itself and can't be bucketed
+        :param training_config: Training config to pull parameters from
+        :param train: If True shuffle the samples and load training sized batches,
+            otherwise load evaluation sized batches in order (default False)
+        :returns: A DataLoader that returns QABatch objects
+        """
+        collator = get_collator(
+            training_config.max_question_size,
+            training_config.max_context_size,
+            training_config.group_contexts,
+        )
+        batch_size = (
+            training_config.batch_size if train else training_config.eval_batch_size
+        )
+        num_workers = (
+            training_config.loader_num_workers
+            if train
+            else training_config.eval_num_workers
+        )
+        if isinstance(dataset, StreamingQADataset):
+            if training_config.bucket_batches or training_config.group_contexts:
+                raise Exception("Streamed datasets can't be bucketed or grouped")
+            return DataLoader(
+                dataset,
+                batch_size=batch_size,
+                pin_memory=train,
+                num_workers=num_workers,
+                collate_fn=collator,
+            )
+        if not (training_config.bucket_batches or training_config.group_contexts):
+            return DataLoader(
+                dataset,
+                batch_size=batch_size,
+                shuffle=train,
+                pin_memory=train,
+                num_workers=num_workers,
+                collate_fn=collator,
+            )
+        batch_sampler = BucketBatchSampler(
+            dataset.get_context_lengths(),
+            batch_size,
+            shuffle=train,
+            max_tokens=training_config.max_batch_tokens,
+            max_length=training_config.max_context_size,
+            context_ids=dataset.get_context_ids()
+            if training_config.group_contexts
+            else None,
+        )
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            pin_memory=train,
+            num_workers=num_workers,
+            collate_fn=collator,
+        )
 
     @classmethod
     def validate(
@@ -278,8 +522,8 @@ class Trainer:
     ) -> Tuple[float, float, float]:
         """
         Validates the given model over the given dataset, both using the official
-        SQuAD evaluation script to obtain F1 and EM scores and using the evaluator
-        to get loss values
+        SQuAD metrics to obtain F1 and EM scores and using the evaluator to get
+        loss values
         :param dataset: QADataset object to validate on
         :param model: PredictorModel to validate
         :param evaluator: Evaluator to compute loss
@@ -291,16 +535,71 @@ class Trainer:
         print(f"\n=== EPOCH {epoch + 1}: Validating on dev set\n\n")
         f1: float = 0.0
         em: float = 0.0
+        dataset_predictions = cls.predict_dataset(
+            dataset, model, training_config, evaluator
+        )
         try:
-            dev_perf = cls.evaluate_on_squad_dataset(dataset, model, training_config)
+            dev_perf = cls.score_answers(
+                dataset,
+                cls.get_answer_texts(dataset, dataset_predictions),
+                training_config.eval_num_workers,
+            )
             f1 = float(dev_perf.get("f1", 0.0))
             em = float(dev_perf.get("exact_match", 0.0))
         except Exception as err:
             print(f"Error when trying to get full evaluation: {err}")
-        dev_loss = cls.get_dataset_loss(dataset, model, evaluator, training_config)
+        dev_loss = dataset_predictions.loss
         print(f"\nDev set loss: {dev_loss}, F1: {f1}, EM: {em}\n\n")
         return (dev_loss, f1, em)
 
+    @classmethod
+    def predict_dataset(
+        cls,
+        dataset: QADataset,
+        model: PredictorModel,
+        training_config: TrainingConfig,
+        evaluator: Optional[Evaluator] = None,
+    ) -> DatasetPredictions:
+        """
+        Runs the model over the entire dataset once, decoding the best span of
+        every question and computing the loss on the same forward passes
+        :param dataset: QADataset object to predict on
+        :param model: PredictorModel to predict with
+        :param training_config: Training config to pull parameters from
+        :param evaluator: Evaluator to compute loss (default None: loss is 0)
+        :returns: A DatasetPredictions object
+        """
+        loader: DataLoader = cls.get_loader(dataset, training_config)
+        total_loss = 0.0
+        qid_to_answer: Dict[QuestionId, Tuple[Any, ...]] = dict()
+        qid_to_no_answer: Dict[QuestionId, float] = dict()
+        batch: QABatch
+        for batch in tqdm(loader, desc="Prediction batch"):
+            with t.no_grad():
+                batch.to(training_config.device)
+                predictions: ModelPredictions = model(batch)
+                if evaluator is not None:
+                    total_loss += evaluator(batch, predictions).item()
+                merge_best_answers(
+                    qid_to_answer,
+                    get_answer_token_idxs(
+                        batch, predictions, training_config.max_answer_size
+                    ).items(),
+                )
+                if predictions.no_ans_logits is not None:
+                    # A question has no answer only if none of its windows do
+                    for qid, no_answer in zip(
+                        batch.question_ids, predictions.no_ans_logits.view(-1).tolist()
+                    ):
+                        qid_to_no_answer[qid] = min(
+                            no_answer, qid_to_no_answer.get(qid, no_answer)
+                        )
+        return DatasetPredictions(
+            loss=total_loss / len(dataset),
+            answer_token_idxs=qid_to_answer,
+            no_answer_scores=qid_to_no_answer,
+        )
+
     @classmethod
     def get_dataset_loss(
         cls,
@@ -316,21 +615,7 @@ class Trainer:
         :param evaluator: Evaluator to compute loss
         :param training_config: Training config to pull parameters from
         """
-        loader: DataLoader = DataLoader(
-            dataset,
-            training_config.batch_size,
-            collate_fn=get_collator(
-                training_config.max_question_size, training_config.max_context_size
-            ),
-        )
-        total_loss = 0.0
-        batch: QABatch
-        for batch in tqdm(loader, desc="Loss computation batch"):
-            with t.no_grad():
-                batch.to(training_config.device)
-                predictions: ModelPredictions = model(batch)
-                total_loss += evaluator(batch, predictions).item()
-        return total_loss / len(dataset)
+        return cls.predict_dataset(dataset, model, training_config, evaluator).loss
 
     @classmethod
     def answer_dataset(
@@ -338,34 +623,39 @@ class Trainer:
     ) -> Dict[QuestionId, str]:
         """
         Generates well-formatted answers for the given dataset using the
-        given model.
+        given model. If the dataset is windowed, each question is answered with
+        the best scoring span over all of its windows
         :param dataset: QADataset object to validate on
         :param model: PredictorModel to validate
         :param training_config: Training config to pull parameters from
         """
-        loader: DataLoader = DataLoader(
-            dataset,
-            training_config.batch_size,
-            collate_fn=get_collator(
-                training_config.max_question_size, training_config.max_context_size
-            ),
+        return cls.get_answer_texts(
+            dataset, cls.predict_dataset(dataset, model, training_config)
+        )
+
+    @classmethod
+    def get_answer_texts(
+        cls, dataset: QADataset, dataset_predictions: DatasetPredictions
+    ) -> Dict[QuestionId, str]:
+        """
+        :param dataset: QADataset the predictions were made on
+        :param dataset_predictions: DatasetPredictions of a model on the dataset
+        :returns: The text of the predicted answer of every question
+        """
+        return dataset.get_answer_texts(
+            {
+                qid: answer[:2]
+                for qid, answer in dataset_predictions.answer_token_idxs.items()
+            }
         )
-        batch: QABatch
-        qid_to_answer: Dict[QuestionId, Tuple[Any, ...]] = dict()
-        for batch_num, batch in enumerate(tqdm(loader, desc="Answer generation batch")):
-            with t.no_grad():
-                batch.to(training_config.device)
-                predictions: ModelPredictions = model(batch)
-                qid_to_answer.update(get_answer_token_idxs(batch, predictions))
-        return dataset.get_answer_texts(qid_to_answer)
 
     @classmethod
     def evaluate_on_squad_dataset(
         cls, dataset: QADataset, model: PredictorModel, training_config: TrainingConfig
-    ) -> Dict[str, str]:
+    ) -> Dict[str, float]:
         """
         Generates well formatted answers for the given dataset using the given
-        model, then runs the official SQuAD evaluation script on it to obtain
+        model, then scores them with the official SQuAD metrics to obtain
         f1 and em scores.
         :param dataset: QADataset object to validate on
         :param model: PredictorModel to validate
@@ -375,15 +665,28 @@ class Trainer:
             answer_dict = cls.answer_dataset(dataset, model, training_config)
         except Exception as ex:
             raise Exception(f"Can't answer dataset: {ex}")
-        with open(dataset.source_file) as dataset_file:
-            dataset_json = json.load(dataset_file)
-            dataset_version = dataset_json["version"]
-            eval_fn: Callable[[Dict[Any, Any], Dict[QuestionId, str]], Dict[str, str]]
-            if dataset_version == "1.1":
-                eval_fn = evaluate_v1_1.evaluate
-            elif dataset_version == "2.0":
-                eval_fn = evaluate_v2_0.evaluate
-            else:
-                raise Exception("Dataset version malformed: {}".format(dataset_version))
-            dataset_dict = dataset_json["data"]
-        return eval_fn(dataset_dict, answer_dict)
+        try:
+            return cls.score_answers(
+                dataset, answer_dict, training_config.eval_num_workers
+            )
+        finally:
+            dataset.close_scorer()
+
+    @classmethod
+    def score_answers(
+        cls,
+        dataset: QADataset,
+        answer_dict: Dict[QuestionId, str],
+        num_workers: int = 0,
+    ) -> Dict[str, float]:
+        """
+        Scores answers to the given dataset with the official SQuAD metrics,
+        against all gold answers of the dataset's questions held in memory. The
+        dataset keeps the scorer's workers running until close_scorer is called
+        :param dataset: QADataset object the answers are for
+        :param answer_dict: Mapping from QuestionId's to answer texts
+        :param num_workers: Number of worker processes to score with (default 0)
+        :returns: Dict of the f1 and exact_match scores and the total number of
+            questions
+        """
+        return dataset.get_scorer(num_workers).score(answer_dict)
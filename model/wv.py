@@ -2,10 +2,12 @@
 Module to encompass logic around word vectors
 """
 
+import os
 import pickle
+from itertools import islice
 import numpy as np
 import torch as t
-from typing import Tuple, List, Dict, Any, ClassVar
+from typing import IO, Tuple, List, Dict, Any, Callable, ClassVar, Mapping
 
 
 class WordVectors:
@@ -15,6 +17,8 @@ class WordVectors:
 
     UNK_TOKEN: ClassVar[str] = "<UNK_TOKEN>"
     PAD_TOKEN: ClassVar[str] = "<PAD_TOKEN>"
+    CACHE_SUFFIX: ClassVar[str] = "-cache"
+    READ_CHUNK_LINES: ClassVar[int] = 10000
 
     file_name: str
     idx_to_word: Dict[int, str]
@@ -43,29 +47,72 @@ class WordVectors:
         """
         Class method that loads vectors from an arbitrary filename
         If the file is a pickle prefix for the processed vectors loads that
-        if that fails tries to read them as text-based word vectors
+        if that fails tries to read them as text-based word vectors.
+        Text-based vectors are cached in binary form under <file_name>-cache the
+        first time they are read and the cache is memory mapped on later loads
+        as long as it is newer than the text file
         """
         vectors: WordVectors
         try:
             vectors = WordVectors.from_disk(file_name)
         except (IOError, pickle.UnpicklingError) as e:
+            cache_prefix = file_name + cls.CACHE_SUFFIX
+            if cls.cache_is_fresh(file_name, cache_prefix):
+                try:
+                    return WordVectors.from_disk(cache_prefix, mmap=True)
+                except (IOError, EOFError, ValueError, pickle.UnpicklingError) as e:
+                    print(
+                        "[WARNING] Could not load cached word vectors from %s, "
+                        "rereading %s: %s" % (cache_prefix, file_name, e)
+                    )
             vectors = WordVectors.from_text_vectors(file_name)
+            try:
+                vectors.save(cache_prefix)
+            except IOError as e:
+                print(
+                    "[WARNING] Could not cache word vectors to %s: %s"
+                    % (cache_prefix, e)
+                )
         return vectors
 
     @classmethod
-    def from_disk(cls, file_name: str) -> "WordVectors":
+    def cache_is_fresh(cls, vector_file: str, cache_prefix: str) -> bool:
+        """
+        Checks whether a binary cache of a text vector file exists and is
+        newer than the text file
+        :param vector_file: Name of the text-formatted word vector file
+        :param cache_prefix: Prefix of the cache files
+        :returns: True if the cache can be used in place of the text file
+        """
+        cache_files = [
+            cache_prefix + suffix
+            for suffix in ["-idx-to-word.pkl", "-word-to-idx.pkl", "-vectors.npy"]
+        ]
+        if not all(os.path.isfile(cache_file) for cache_file in cache_files):
+            return False
+        vector_file_mtime = os.path.getmtime(vector_file)
+        return all(
+            os.path.getmtime(cache_file) >= vector_file_mtime
+            for cache_file in cache_files
+        )
+
+    @classmethod
+    def from_disk(cls, file_name: str, mmap: bool = False) -> "WordVectors":
         """
         Class method that reads pickle files(under same name) from disk
         and restores a WordVectors object
         :param file_name: Prefix of pickle files for these vectors
+        :param mmap: If True memory map the vectors read-only instead of reading
+            them into memory (default False)
         :returns: a WordVectors object
         """
         with open(file_name + "-idx-to-word.pkl", "rb") as f:
             idx_to_word: Dict[int, str] = pickle.load(f)
         with open(file_name + "-word-to-idx.pkl", "rb") as f:
             word_to_idx: Dict[str, int] = pickle.load(f)
-        with open(file_name + "-vectors.npy", "rb") as f:
-            vectors: Any = np.load(f)
+        vectors: Any = np.load(
+            file_name + "-vectors.npy", mmap_mode="r" if mmap else None
+        )
         return cls(vectors, idx_to_word, word_to_idx)
 
     @classmethod
@@ -90,6 +137,7 @@ class WordVectors:
     ) -> Tuple[Any, Dict[str, int], Dict[int, str]]:
         """
         Class method that reads word vectors into a word->numpy array dict
+        Lines are parsed in chunks into a preallocated float32 matrix
         :param vector_file: Name of the word vector file to read from disk
         :param consume_first_line: if True skip first line as it is metadata and not a word vector
         :returns:a Tuple of:
@@ -97,29 +145,68 @@ class WordVectors:
             - word_to_idx: A mapping from each word to its idx in vectors
             - idx_to_word: Reverse of the above mapping
         """
-        vectors_list: List[Any] = []
-        vocab: List[str] = []
+        with open(vector_file, "rb") as bf:
+            num_lines = sum(
+                chunk.count(b"\n") for chunk in iter(lambda: bf.read(1 << 24), b"")
+            )
         with open(vector_file, "r") as f:
             if consume_first_line:
                 next(f)
-            for line in f:
-                word, vec_data = line.rstrip("\n").split(" ", 1)
-                vector = np.array(
-                    [float(num) for num in vec_data.split(" ")], dtype=np.float32
-                )
-                vectors_list.append(vector)
-                vocab.append(word)
-        pad_vector = np.zeros_like(vectors_list[0])
-        vectors_list.insert(0, pad_vector)
-        vocab.insert(0, WordVectors.PAD_TOKEN)
-        unk_vector = np.random.randn((vectors_list[0].shape[0]))
-        vectors_list.insert(1, unk_vector)
-        vocab.insert(1, WordVectors.UNK_TOKEN)
-        vectors = np.stack(vectors_list)
+                num_lines -= 1
+            first_line = f.readline()
+            dim = len(first_line.rstrip("\n").split(" ")) - 1
+            # The last line might not be newline-terminated
+            num_lines += 1
+            vectors = np.zeros((num_lines + 2, dim), dtype=np.float32)
+            vocab: List[str] = [WordVectors.PAD_TOKEN, WordVectors.UNK_TOKEN]
+            num_read = 0
+            lines = [first_line]
+            while lines:
+                components: List[str] = []
+                for line in lines:
+                    # Split from the right since some words contain spaces
+                    word_and_vec = line.rstrip("\n").rsplit(" ", dim)
+                    if len(word_and_vec) != dim + 1:
+                        continue
+                    vocab.append(word_and_vec[0])
+                    components.extend(word_and_vec[1:])
+                chunk_size = len(components) // dim
+                vectors[2 + num_read : 2 + num_read + chunk_size] = np.array(
+                    components, dtype=np.float32
+                ).reshape(chunk_size, dim)
+                num_read += chunk_size
+                lines = list(islice(f, WordVectors.READ_CHUNK_LINES))
+        vectors = vectors[: num_read + 2]
+        vectors[1] = np.random.randn(dim)
         idx_to_word: Dict[int, str] = dict(enumerate(vocab))
         word_to_idx: Dict[str, int] = {w: i for i, w in idx_to_word.items()}
         return vectors, word_to_idx, idx_to_word
 
+    def prune(self, token_counts: Mapping[str, int], top_k: int = 0) -> "WordVectors":
+        """
+        Restricts these vectors to the given tokens, i.e. the tokens of the corpora
+        a model is trained and evaluated on
+        Kept words are re-indexed by descending count after the PAD and UNK tokens
+        :param token_counts: Mapping from each token seen in the corpora to its count
+        :param top_k: If nonzero only keep the top_k most frequent words (default 0)
+        :returns: A new WordVectors object holding only the kept words
+        """
+        kept_words = [
+            word
+            for word in token_counts
+            if word in self.word_to_idx
+            and word not in (WordVectors.PAD_TOKEN, WordVectors.UNK_TOKEN)
+        ]
+        kept_words.sort(key=lambda word: (-token_counts[word], self.word_to_idx[word]))
+        if top_k > 0:
+            kept_words = kept_words[:top_k]
+        vocab = [WordVectors.PAD_TOKEN, WordVectors.UNK_TOKEN] + kept_words
+        idxs = [0, 1] + [self.word_to_idx[word] for word in kept_words]
+        vectors = np.array(self.vectors[idxs], dtype=np.float32)
+        idx_to_word: Dict[int, str] = dict(enumerate(vocab))
+        word_to_idx: Dict[str, int] = {w: i for i, w in idx_to_word.items()}
+        return WordVectors(vectors, idx_to_word, word_to_idx)
+
     def save(self, file_name: str) -> None:
         """
         Serializes the vectors to a collection of files.
@@ -127,11 +214,17 @@ class WordVectors:
             - <file_name>-idx-to-word.pkl
             - <file_name>-word-to-idx.pkl
             - <file_name>-vectors.pkl
+        Every file is written to a temporary file first and renamed into place,
+        the vectors last, so an interrupted save never leaves truncated files
         :param file_name: Prefix for files to be saved
         """
-        with open(file_name + "-idx-to-word.pkl", "wb") as f:
-            pickle.dump(self.idx_to_word, f)
-        with open(file_name + "-word-to-idx.pkl", "wb") as f:
-            pickle.dump(self.word_to_idx, f)
-        with open(file_name + "-vectors.npy", "wb") as f:
-            np.save(f, self.vectors)
+        writes: List[Tuple[str, Callable[[IO[bytes]], None]]] = [
+            ("-idx-to-word.pkl", lambda f: pickle.dump(self.idx_to_word, f)),
+            ("-word-to-idx.pkl", lambda f: pickle.dump(self.word_to_idx, f)),
+            ("-vectors.npy", lambda f: np.save(f, self.vectors)),
+        ]
+        for suffix, write in writes:
+            tmp_file_name = f"{file_name}{suffix}.tmp"
+            with open(tmp_file_name, "wb") as f:
+                write(f)
+            os.replace(tmp_file_name, file_name + suffix)
@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from model.inference import InferenceConfig, InferenceEngine
+from model.serving import AnswerServer, DynamicBatcher
+from model.util import get_device
+
+
+def parse_args() -> argparse.Namespace:
+    # Don't format args
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run-name", type=str, default="train-run", help="name of the training run to serve, used to find <run name>.pth and <run name>-char-mapping.json")
+    parser.add_argument("--word-vector-file", type=str, default="data/word-vectors/glove/glove.6B.100d.txt", help="word vectors the model was trained with (<run name>-vocab for pruned runs)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=32, help="maximum number of questions to answer in one batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="maximum time to wait for a batch to fill up")
+    parser.add_argument("--max-question-size", type=int, default=100, help="Trim questions to this length (0 for unlimited)")
+    parser.add_argument("--max-context-size", type=int, default=0, help="Trim contexts to this length (0 for unlimited)")
+    parser.add_argument("--max-answer-size", type=int, default=0, help="Only predict answer spans of at most this many tokens (0 for unlimited)")
+    parser.add_argument("--context-cache-mb", type=int, default=256, help="cache the encodings of recently seen contexts in this many MB (0 to disable)")
+    parser.add_argument("--disable-cuda", action="store_true", help="if specified don't use CUDA even if available")
+    # fmt: on
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    config = InferenceConfig(
+        batch_size=args.max_batch_size,
+        max_question_size=args.max_question_size,
+        max_context_size=args.max_context_size,
+        max_answer_size=args.max_answer_size,
+        context_cache_mb=args.context_cache_mb,
+        device=get_device(args.disable_cuda),
+    )
+    print(f"Loading model from {args.run_name}.pth")
+    engine = InferenceEngine.from_files(
+        f"{args.run_name}.pth",
+        args.word_vector_file,
+        f"{args.run_name}-char-mapping.json",
+        config,
+    )
+    # A single model thread keeps batches from competing for the device
+    batcher = DynamicBatcher(
+        engine,
+        args.max_batch_size,
+        args.max_wait_ms,
+        executor=ThreadPoolExecutor(max_workers=1),
+    )
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(AnswerServer(batcher).serve(args.host, args.port))
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Module for testing attention modules
+"""
+import unittest
+
+import torch as t
+
+from model.modules.attention import (
+    BaseBidirectionalAttention,
+    BidafBidirectionalAttention,
+    SelfAttention,
+)
+
+
+class BlockedAttentionTestCase(unittest.TestCase):
+    def check_blocked_matches_dense(
+        self, attention: BaseBidirectionalAttention, block_size: int
+    ) -> None:
+        t.manual_seed(0)
+        context = t.randn((3, 11, 6), requires_grad=True)
+        question = (
+            context
+            if attention.self_attention
+            else t.randn((3, 7, 6), requires_grad=True)
+        )
+        context_mask = t.ones((3, 11))
+
+        attention.block_size = 0
+        dense_out = attention(context, question, context_mask)
+        dense_grads = t.autograd.grad(dense_out.sum(), [context, question])
+
+        attention.block_size = block_size
+        blocked_out = attention(context, question, context_mask)
+        blocked_grads = t.autograd.grad(blocked_out.sum(), [context, question])
+
+        self.assertTrue(t.allclose(dense_out, blocked_out, atol=1e-5))
+        for dense_grad, blocked_grad in zip(dense_grads, blocked_grads):
+            self.assertTrue(t.allclose(dense_grad, blocked_grad, atol=1e-5))
+
+    def test_bidirectional_blocked_matches_dense(self) -> None:
+        """
+        Tests that blocked bidirectional attention computes the same outputs and
+        gradients as the dense computation when blocks don't divide the lengths
+        """
+        self.check_blocked_matches_dense(BidafBidirectionalAttention(6), 4)
+
+    def test_self_attention_blocked_matches_dense(self) -> None:
+        """
+        Tests that blocked self attention still masks out the diagonal
+        """
+        self.check_blocked_matches_dense(SelfAttention(6, 5), 3)
+
+    def test_blocked_eval_matches_dense(self) -> None:
+        """
+        Tests that the uncheckpointed blocked path used in eval mode matches
+        """
+        attention = BidafBidirectionalAttention(6)
+        attention.eval()
+        self.check_blocked_matches_dense(attention, 2)
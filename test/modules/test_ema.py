@@ -0,0 +1,62 @@
+"""
+Module for testing the parameter moving averages
+"""
+import unittest
+
+import torch as t
+import torch.nn as nn
+
+from model.modules.ema import EMA
+
+
+class EMATestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        t.manual_seed(0)
+        self.model = nn.Linear(3, 2)
+        self.initial = [param.data.clone() for param in self.model.parameters()]
+
+    def step(self) -> None:
+        for param in self.model.parameters():
+            param.data.add_(1.0)
+
+    def test_replaces_params(self) -> None:
+        """
+        Tests that by default parameters are overwritten with their averages
+        """
+        ema = EMA(0.9, self.model.named_parameters())
+        self.step()
+        ema.update()
+        for param, initial in zip(self.model.parameters(), self.initial):
+            self.assertTrue(t.allclose(param.data, initial + 0.9))
+
+    def test_eval_weights(self) -> None:
+        """
+        Tests that separate averages leave the training weights alone and are
+        only swapped in within average_parameters
+        """
+        ema = EMA(0.9, self.model.named_parameters(), replace_params=False)
+        self.step()
+        ema.update()
+        self.step()
+        ema.update()
+        # shadow = 0.9 * (initial + 2) + 0.1 * (initial + 0.9)
+        for param, initial in zip(self.model.parameters(), self.initial):
+            self.assertTrue(t.allclose(param.data, initial + 2))
+        with ema.average_parameters():
+            for param, initial in zip(self.model.parameters(), self.initial):
+                self.assertTrue(t.allclose(param.data, initial + 1.89))
+        for param, initial in zip(self.model.parameters(), self.initial):
+            self.assertTrue(t.allclose(param.data, initial + 2))
+
+    def test_state_dict_round_trip(self) -> None:
+        """
+        Tests that loading a state dict updates the shadows in place
+        """
+        ema = EMA(0.9, self.model.named_parameters(), replace_params=False)
+        state = {"flat_shadow": t.arange(8, dtype=t.float)}
+        ema.load_state_dict(state)
+        ema.copy_to_parameters()
+        self.assertTrue(
+            t.equal(self.model.weight.data, t.arange(6, dtype=t.float).view(2, 3))
+        )
+        self.assertTrue(t.equal(self.model.bias.data, t.Tensor([6, 7])))
@@ -0,0 +1,66 @@
+"""
+Module for testing masked modules at reduced precision
+"""
+import unittest
+
+import torch as t
+
+from model.modules.attention import SelfAttention
+from model.modules.masked import (
+    MaskedLinear,
+    MaskedLogSoftmax,
+    mask_fill_value,
+    mask_sequence,
+)
+
+
+class MaskedPrecisionTestCase(unittest.TestCase):
+    def test_mask_sequence_float32(self) -> None:
+        """
+        Tests that masks are float32 so they don't upcast what they're applied to
+        """
+        mask = mask_sequence(t.LongTensor([[3, 4, 0]]))
+        self.assertEqual(mask.dtype, t.float32)
+        self.assertTrue(t.equal(mask, t.tensor([[1.0, 1.0, 0.0]])))
+
+    def test_fill_value_representable(self) -> None:
+        """
+        Tests that fill values are clamped to the finite range of each dtype
+        """
+        self.assertEqual(mask_fill_value(t.float32), -1e30)
+        self.assertEqual(mask_fill_value(t.float16), t.finfo(t.float16).min)
+        self.assertEqual(mask_fill_value(t.bfloat16, 1e10), -1e10)
+
+    def test_log_softmax_half_precision(self) -> None:
+        """
+        Tests that masked log softmax of reduced precision scores is computed in
+        float32 and gives no probability to padding
+        """
+        mask = t.tensor([[1.0, 1.0, 0.0]])
+        for dtype in [t.float16, t.bfloat16]:
+            log_probs = MaskedLogSoftmax(dim=1)(
+                t.tensor([[1.0, 2.0, 3.0]], dtype=dtype), mask=mask
+            )
+            self.assertEqual(log_probs.dtype, t.float32)
+            self.assertTrue(t.isfinite(log_probs).all())
+            self.assertAlmostEqual(log_probs[0, :2].exp().sum().item(), 1.0, places=5)
+
+    def test_masked_linear_keeps_dtype(self) -> None:
+        """
+        Tests that multiplying by a float32 mask doesn't upcast the output
+        """
+        linear = MaskedLinear(4, 2).to(t.bfloat16)
+        output = linear(t.ones((1, 3, 4), dtype=t.bfloat16), mask=t.ones((1, 3)))
+        self.assertEqual(output.dtype, t.bfloat16)
+
+    def test_self_attention_half_precision(self) -> None:
+        """
+        Tests that masking the diagonal of the self attention similarities
+        doesn't overflow into NaNs in float16, dense or blocked
+        """
+        attention = SelfAttention(6, 5).to(t.float16)
+        context = t.randn((2, 7, 6)).to(t.float16)
+        for block_size in [0, 3]:
+            attention.block_size = block_size
+            output = attention(context, context, t.ones((2, 7)))
+            self.assertFalse(t.isnan(output).any())
@@ -6,8 +6,14 @@ from unittest.mock import Mock, MagicMock
 import numpy as np
 import torch as t
 
-from typing import List, Set, Dict
-from model.batcher import QABatch, collate_batch, pad_and_sort
+from typing import Any, List, Optional, Sequence, Set, Dict, Tuple
+from model.batcher import (
+    QABatch,
+    BucketBatchSampler,
+    collate_batch,
+    pad_and_sort,
+    pad_chars,
+)
 from model.qa import (
     Answer,
     QuestionId,
@@ -355,3 +361,221 @@ class BatcherTestCase(unittest.TestCase):
                         self.char_mapping[word[char_idx]] if char_idx < len(word) else 0
                     )
                     self.assertEqual(sample, real_char)
+
+
+class CollateTestCase(unittest.TestCase):
+    """
+    Tests collation with samples built directly from their encodings
+    """
+
+    def setUp(self) -> None:
+        vocab = ["c1", "c2", "c3", "c4", "c00"]
+        self.token_id_mapping = {word: idx for idx, word in enumerate(vocab, 1)}
+        self.id_token_mapping = dict(enumerate(vocab, 1))
+        self.char_mapping = {
+            char: idx for idx, char in enumerate(sorted(set("".join(vocab))), 1)
+        }
+
+    def encode(self, text: str) -> Tuple[Any, Any, Any]:
+        """
+        :param text: Space separated words of the vocab
+        :returns: Tuple of the word ids, flat char ids and char offsets of text
+        """
+        words = text.split()
+        return (
+            np.array([self.token_id_mapping[word] for word in words]),
+            np.array([self.char_mapping[char] for word in words for char in word]),
+            np.cumsum([0] + [len(word) for word in words]),
+        )
+
+    def make_sample(
+        self,
+        context_text: str,
+        question_id: str,
+        question_text: str,
+        answer_spans: Sequence[Tuple[int, int]] = (),
+        context_id: Optional[int] = None,
+    ) -> EncodedSample:
+        context_words, context_chars, context_char_offsets = self.encode(context_text)
+        question_words, question_chars, question_char_offsets = self.encode(
+            question_text
+        )
+        return EncodedSample.from_arrays(
+            QuestionId(question_id),
+            context_words,
+            context_chars,
+            context_char_offsets,
+            question_words,
+            question_chars,
+            question_char_offsets,
+            np.array([start for start, _ in answer_spans], dtype=np.int64),
+            np.array([end for _, end in answer_spans], dtype=np.int64),
+            context_id=context_id,
+        )
+
+    def test_collate_batch_trimmed_chars(self) -> None:
+        """
+        Tests that chars of trimmed words are dropped and chars are int64
+        """
+        samples = [
+            self.make_sample("c00 c1 c2", "q0", "c1 c00"),
+            self.make_sample("c1", "q1", "c00 c2"),
+        ]
+        batch: QABatch = collate_batch(samples, 1, 2)
+        self.assertEqual(batch.question_chars.dtype, t.long)
+        self.assertEqual(batch.question_chars.shape, t.Size([2, 1, 3]))
+        self.assertEqual(batch.context_chars.shape, t.Size([2, 2, 3]))
+        self.check_collated_chars(batch.question_chars, batch.question_words)
+        self.check_collated_chars(batch.context_chars, batch.context_words)
+
+    def test_pad_chars(self) -> None:
+        """
+        Tests that flat chars are scattered into the right word and char positions
+        """
+        flat_chars = [np.array([1, 2, 3, 4]), np.array([5, 6, 7])]
+        char_offsets = [np.array([0, 1, 4]), np.array([0, 2, 2, 3])]
+        padded = pad_chars(flat_chars, char_offsets)
+        expected = t.LongTensor(
+            [[[1, 0, 0], [2, 3, 4], [0, 0, 0]], [[5, 6, 0], [0, 0, 0], [7, 0, 0]]]
+        )
+        self.assertTrue(t.equal(padded, expected))
+
+    def test_pad_and_sort_single_seq_trimmed(self) -> None:
+        """
+        Tests that single sequence batches are trimmed and have integer indices
+        """
+        batch, orig_idxs, length_idxs, lengths = pad_and_sort([np.array([1, 2, 3])], 2)
+        self.assertEqual(batch.tolist(), [[1, 2]])
+        self.assertEqual(lengths.tolist(), [2])
+        self.assertEqual(orig_idxs.dtype, t.long)
+        self.assertEqual(length_idxs.dtype, t.long)
+
+    def test_collate_grouped_batch(self) -> None:
+        """
+        Tests that context-grouped batches hold each context once and match
+        the per-sample batch otherwise
+        """
+        samples = [
+            self.make_sample("c00 c1 c2", "q0", "c1 c00", [(1, 2)], context_id=0),
+            self.make_sample("c1", "q1", "c00 c2", context_id=1),
+            self.make_sample("c00 c1 c2", "q2", "c2", [(0, 0)], context_id=0),
+        ]
+        batch: QABatch = collate_batch(samples)
+        grouped_batch: QABatch = collate_batch(samples, group_contexts=True)
+        self.assertTrue(grouped_batch.is_context_grouped)
+        self.assertEqual(grouped_batch.context_idxs.tolist(), [0, 1, 0])
+        self.assertEqual(grouped_batch.unique_context_chars.shape, t.Size([2, 3, 3]))
+        self.check_collated_chars(
+            grouped_batch.unique_context_chars, grouped_batch.unique_context_words
+        )
+        self.assertTrue(
+            t.equal(
+                grouped_batch.unique_context_words[grouped_batch.context_idxs],
+                batch.context_words,
+            )
+        )
+        for field in [
+            "question_words",
+            "question_chars",
+            "context_words",
+            "context_mask",
+            "context_lens",
+            "answer_span_starts",
+            "answer_span_ends",
+        ]:
+            self.assertTrue(
+                t.equal(getattr(grouped_batch, field), getattr(batch, field)), field
+            )
+
+    def check_collated_chars(self, chars: t.Tensor, words: t.Tensor) -> None:
+        for batch_idx in range(chars.shape[0]):
+            for word_idx in range(chars.shape[1]):
+                word = self.id_token_mapping.get(words[batch_idx, word_idx].item(), "")
+                for char_idx in range(chars.shape[2]):
+                    real_char = (
+                        self.char_mapping[word[char_idx]] if char_idx < len(word) else 0
+                    )
+                    self.assertEqual(chars[batch_idx, word_idx, char_idx], real_char)
+
+
+class BucketBatchSamplerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        np.random.seed(0)
+        self.lengths = np.random.randint(1, 100, size=200)
+
+    def check_covers_dataset(self, batches: List[List[int]]) -> None:
+        all_idxs = sorted(idx for batch in batches for idx in batch)
+        self.assertEqual(all_idxs, list(range(len(self.lengths))))
+
+    def test_sequential_batches_sorted(self) -> None:
+        """
+        Tests that without shuffling batches are in increasing length order
+        """
+        sampler = BucketBatchSampler(self.lengths, 10, shuffle=False)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.check_covers_dataset(batches)
+        batch_lengths = [self.lengths[idx] for batch in batches for idx in batch]
+        self.assertEqual(batch_lengths, sorted(batch_lengths))
+
+    def test_shuffled_batches_bucketed(self) -> None:
+        """
+        Tests that shuffled batches cover the dataset and only mix samples
+        from the same bucket
+        """
+        sampler = BucketBatchSampler(self.lengths, 10, shuffle=True, bucket_size=2)
+        batches = list(sampler)
+        self.check_covers_dataset(batches)
+        sorted_lengths = np.sort(self.lengths)
+        bucket_edges = sorted_lengths[::20]
+        for batch in batches:
+            self.assertEqual(len(batch), 10)
+            buckets = np.searchsorted(bucket_edges, self.lengths[batch], side="right")
+            self.assertLessEqual(buckets.max() - buckets.min(), 1)
+
+    def test_token_budget(self) -> None:
+        """
+        Tests that batches stay within the padded token budget
+        """
+        sampler = BucketBatchSampler(
+            self.lengths, 10, shuffle=True, max_tokens=300, max_length=50
+        )
+        batches = list(sampler)
+        self.check_covers_dataset(batches)
+        for batch in batches:
+            self.assertLessEqual(
+                len(batch) * min(50, self.lengths[batch].max()), max(300, 50)
+            )
+
+    def test_len_matches_shuffled_epochs(self) -> None:
+        """
+        Tests that the length is the number of batches of each reshuffled epoch,
+        even when the number of batches changes between epochs
+        """
+        sampler = BucketBatchSampler(
+            self.lengths, 10, shuffle=True, bucket_size=1, max_tokens=300
+        )
+        epoch_lengths = []
+        for _ in range(10):
+            num_batches = len(sampler)
+            batches = list(sampler)
+            self.check_covers_dataset(batches)
+            self.assertEqual(len(batches), num_batches)
+            epoch_lengths.append(num_batches)
+        self.assertGreater(len(set(epoch_lengths)), 1)
+
+    def test_context_grouping(self) -> None:
+        """
+        Tests that samples of the same context are put in the same batch
+        """
+        context_ids = np.repeat(np.arange(40), 5)
+        lengths = np.random.randint(1, 100, size=40)[context_ids]
+        sampler = BucketBatchSampler(
+            lengths, 10, shuffle=True, bucket_size=2, context_ids=context_ids
+        )
+        batches = list(sampler)
+        self.assertEqual(
+            sorted(idx for batch in batches for idx in batch), list(range(200))
+        )
+        for batch in batches:
+            self.assertEqual(len(set(context_ids[batch])), 2)
@@ -0,0 +1,112 @@
+"""
+Module for testing background checkpointing
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import torch as t
+
+from model.checkpoint import AsyncCheckpointer
+
+
+class AsyncCheckpointerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.prefix = os.path.join(self.tempdir.name, "run")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_keeps_last_checkpoints(self) -> None:
+        """
+        Tests that only the most recent checkpoints are kept and the latest one
+        is loaded back
+        """
+        checkpointer = AsyncCheckpointer(self.prefix, keep_last=2)
+        for step in [5, 10, 100]:
+            checkpointer.save_checkpoint(step, {"step": step, "weight": t.ones(3)})
+        checkpointer.close()
+        self.assertEqual(
+            AsyncCheckpointer.list_checkpoints(self.prefix),
+            [f"{self.prefix}-step000000010.ckpt", f"{self.prefix}-step000000100.ckpt"],
+        )
+        self.assertEqual(AsyncCheckpointer.load_latest(self.prefix)["step"], 100)
+        self.assertFalse(
+            any(path.endswith(".tmp") for path in os.listdir(self.tempdir.name))
+        )
+
+    def test_snapshots_state(self) -> None:
+        """
+        Tests that changes to the state after saving aren't written
+        """
+        checkpointer = AsyncCheckpointer(self.prefix)
+        weight = t.zeros(3)
+        stats = {"losses": [1.0]}
+        checkpointer.save_checkpoint(1, {"weight": weight})
+        checkpointer.save_json(stats, os.path.join(self.tempdir.name, "stats.json"))
+        weight.add_(1)
+        stats["losses"].append(2.0)
+        checkpointer.close()
+        self.assertTrue(
+            t.equal(AsyncCheckpointer.load_latest(self.prefix)["weight"], t.zeros(3))
+        )
+        with open(os.path.join(self.tempdir.name, "stats.json")) as stats_file:
+            self.assertEqual(json.load(stats_file), {"losses": [1.0]})
+
+    def test_no_checkpoint(self) -> None:
+        """
+        Tests that loading without any checkpoint returns None
+        """
+        self.assertIsNone(AsyncCheckpointer.load_latest(self.prefix))
+
+    def test_model_snapshot(self) -> None:
+        """
+        Tests that a saved model is a CPU copy that's loaded back whole and that
+        later updates to the model aren't written
+        """
+        checkpointer = AsyncCheckpointer(self.prefix)
+        model = t.nn.BatchNorm1d(3)
+        path = os.path.join(self.tempdir.name, "model.pth")
+        checkpointer.save_model(model, path)
+        with t.no_grad():
+            model.weight.add_(1)
+            model.running_mean.add_(1)
+        checkpointer.close()
+        saved = t.load(path, weights_only=False)
+        self.assertTrue(t.equal(saved.weight, t.ones(3)))
+        self.assertTrue(t.equal(saved.running_mean, t.zeros(3)))
+        self.assertIsNot(saved, model)
+
+    def test_bounded_pending_writes(self) -> None:
+        """
+        Tests that saving doesn't wait for earlier writes until max_pending
+        snapshots are queued
+        """
+        release = threading.Event()
+        checkpointer = AsyncCheckpointer(self.prefix, max_pending=2)
+        checkpointer.submit(release.wait)
+        checkpointer.submit(lambda: None)
+        self.assertEqual(len(checkpointer.pending), 2)
+        release.set()
+        checkpointer.submit(lambda: None)
+        self.assertLessEqual(len(checkpointer.pending), 2)
+        checkpointer.close()
+        self.assertEqual(checkpointer.pending, [])
+
+    def test_numpy_rng_state(self) -> None:
+        """
+        Tests that numpy's RNG state survives a checkpoint
+        """
+        checkpointer = AsyncCheckpointer(self.prefix)
+        checkpointer.save_checkpoint(
+            1, {"np_rng_state": AsyncCheckpointer.get_numpy_rng_state()}
+        )
+        checkpointer.close()
+        expected = np.random.rand(5)
+        state = AsyncCheckpointer.load_latest(self.prefix)
+        AsyncCheckpointer.set_numpy_rng_state(state["np_rng_state"])
+        self.assertTrue(np.array_equal(np.random.rand(5), expected))
@@ -3,24 +3,36 @@ Module for testing dataset representations
 """
 
 import json
+import os
 import tempfile
-from typing import List
+from typing import Any, List
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+
+import numpy as np
 
 from model.text_processor import TextProcessor
-from model.tokenizer import Tokenizer, Token
+from model.tokenizer import (
+    Tokenizer,
+    CachingTokenizer,
+    NltkTokenizer,
+    RegexTokenizer,
+    Token,
+)
 from model.qa import Answer, QuestionAnswer, ContextQuestionAnswer, QuestionId
 
 from model.corpus import (
     Corpus,
     CorpusStats,
+    ColumnarCorpus,
     EncodedCorpus,
     SampleCorpus,
     QADataset,
     TrainDataset,
     EvalDataset,
+    StreamingQADataset,
 )
+from model.wv import WordVectors
 
 
 class RawCorpusTestCase(unittest.TestCase):
@@ -117,6 +129,44 @@ class RawCorpusTestCase(unittest.TestCase):
         self.assertEqual(len(cqas[0].qas), 1)
         self.assertEqual(len(cqas[0].qas[0].answers), 0)
 
+    def test_parallel_read(self) -> None:
+        """
+        Tests that reading the documents with worker processes produces the same
+        contexts in the same order as the serial path
+        """
+        input_dict = {
+            "data": [
+                {
+                    "paragraphs": [
+                        {
+                            "context": "Doc %d paragraph %d, has some text." % (doc, par),
+                            "qas": [
+                                {
+                                    "answers": [{"answer_start": 0, "text": "Doc"}],
+                                    "id": "%d_%d" % (doc, par),
+                                    "question": "What is in paragraph %d?" % par,
+                                }
+                            ],
+                        }
+                        for par in range(3)
+                    ]
+                }
+                for doc in range(5)
+            ]
+        }
+        json.dump(input_dict, self.tempfile)
+        self.tempfile.flush()
+        tokenizer = NltkTokenizer()
+        processor = TextProcessor({"lowercase": True})
+        serial_cqas = Corpus.read_context_qas(
+            self.tempfile.name, tokenizer, processor, False
+        )
+        parallel_cqas = Corpus.read_context_qas(
+            self.tempfile.name, tokenizer, processor, False, num_workers=2
+        )
+        self.assertEqual(len(serial_cqas), 15)
+        self.assertEqual(serial_cqas, parallel_cqas)
+
     def test_multiple_questions(self) -> None:
         pass
 
@@ -161,6 +211,410 @@ class SampleCorpusTestCase(unittest.TestCase):
         pass
 
 
+class ColumnarCorpusTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempfile = tempfile.NamedTemporaryFile(mode="w")
+        self.tempdir = tempfile.TemporaryDirectory()
+
+        def split_tokenize(txt: str) -> List[Token]:
+            toks = txt.split()
+            starts = [3 * start for start in range(len(toks))]
+            ends = [(3 * end - 1) for end in range(1, len(toks) + 1)]
+            return [
+                Token(word=tok[0], span=(tok[1], tok[2]))
+                for tok in zip(toks, starts, ends)
+            ]
+
+        self.tokenizer = Mock(Tokenizer)
+        self.tokenizer.tokenize.side_effect = lambda txt: split_tokenize(txt)
+        self.processor = Mock(TextProcessor)
+        self.processor.process.side_effect = lambda txt: txt
+        self.vectors = Mock(WordVectors)
+        self.vectors.word_to_idx = {"c0": 2, "c1": 3, "c22": 4, "q0": 5}
+        input_dict = {
+            "data": [
+                {
+                    "paragraphs": [
+                        {
+                            "context": "c0 c1 c22",
+                            "qas": [
+                                {
+                                    "answers": [{"answer_start": 3, "text": "c1"}],
+                                    "id": "0",
+                                    "question": "q0 q1",
+                                },
+                                {"answers": [], "id": "1", "question": "q000"},
+                            ],
+                        },
+                        {
+                            "context": "c1 c333",
+                            "qas": [
+                                {
+                                    "answers": [{"answer_start": 0, "text": "c1"}],
+                                    "id": "2",
+                                    "question": "q0",
+                                }
+                            ],
+                        },
+                    ]
+                }
+            ]
+        }
+        json.dump(input_dict, self.tempfile)
+        self.tempfile.flush()
+        self.corpus = Corpus.from_raw(
+            self.tempfile.name, self.tokenizer, self.processor, self.vectors
+        )
+
+    def tearDown(self) -> None:
+        self.tempfile.close()
+        self.tempdir.cleanup()
+
+    def test_columnar_samples_match(self) -> None:
+        """
+        Tests that the memory mapped columnar samples match the in-memory samples
+        """
+        sample_corpus = SampleCorpus(self.corpus)
+        prefix = os.path.join(self.tempdir.name, "corpus")
+        ColumnarCorpus.from_corpus(sample_corpus).save(prefix)
+        self.assertTrue(ColumnarCorpus.exists(prefix))
+        self.assertFalse(
+            any(path.endswith(".tmp") for path in os.listdir(self.tempdir.name))
+        )
+        columnar = ColumnarCorpus.from_disk(prefix)
+        self.assertEqual(columnar.stats, self.corpus.stats)
+        self.assertEqual(columnar.char_mapping, self.corpus.char_mapping)
+        self.assertEqual(len(columnar), len(sample_corpus.samples))
+        for sample, columnar_sample in zip(sample_corpus.samples, columnar):
+            self.assertEqual(sample.question_id, columnar_sample.question_id)
+            self.assertTrue(
+                np.array_equal(sample.context_words, columnar_sample.context_words)
+            )
+            self.assertTrue(
+                np.array_equal(sample.question_words, columnar_sample.question_words)
+            )
+            for word, columnar_word in zip(
+                sample.context_chars + sample.question_chars,
+                columnar_sample.context_chars + columnar_sample.question_chars,
+            ):
+                self.assertTrue(np.array_equal(word, columnar_word))
+            self.assertEqual(sample.has_answer, columnar_sample.has_answer)
+            self.assertTrue(
+                np.array_equal(sample.span_starts, columnar_sample.span_starts)
+            )
+            self.assertTrue(np.array_equal(sample.span_ends, columnar_sample.span_ends))
+
+    def test_dataset_writes_columns(self) -> None:
+        """
+        Tests that a QADataset writes missing columns and serves samples from them
+        """
+        prefix = os.path.join(self.tempdir.name, "dataset")
+        dataset = QADataset(self.corpus, columnar_prefix=prefix)
+        self.assertTrue(ColumnarCorpus.exists(prefix))
+        self.assertEqual(len(dataset), 3)
+        self.assertEqual([dataset[idx].question_id for idx in range(3)], ["0", "1", "2"])
+
+    def test_dataset_without_corpus(self) -> None:
+        """
+        Tests that a columnar dataset doesn't keep the corpus, and that it answers
+        like the in-memory dataset when it's loaded from the columns alone
+        """
+        prefix = os.path.join(self.tempdir.name, "dataset")
+        written = TrainDataset(self.corpus, columnar_prefix=prefix)
+        self.assertIsNone(written.corpus)
+        in_memory = TrainDataset(self.corpus)
+        dataset = TrainDataset(None, columnar_prefix=prefix)
+        self.assertIsNone(dataset.token_mapping)
+        self.assertEqual(dataset.char_mapping, in_memory.char_mapping)
+        self.assertEqual(dataset.stats, in_memory.stats)
+        self.assertEqual(dataset.source_file, self.tempfile.name)
+        spans = {"0": (1, 1), "1": (0, 2), "2": (0, 0)}
+        self.assertEqual(
+            dataset.get_answer_texts(spans), in_memory.get_answer_texts(spans)
+        )
+        self.assertEqual(dataset.get_answer_texts(spans)["0"], "c1")
+        self.assertEqual(dataset.get_answer_texts({"2": (0, 5)}), {"2": ""})
+        self.assertEqual(dataset.get_gold_answers(), {"0": "c1", "1": "", "2": "c1"})
+
+    def test_incomplete_columns(self) -> None:
+        """
+        Tests that columns without the metadata written after them aren't loaded,
+        and that they can't be loaded without a corpus to rewrite them from
+        """
+        prefix = os.path.join(self.tempdir.name, "dataset")
+        QADataset(self.corpus, columnar_prefix=prefix)
+        os.remove(f"{prefix}-metadata.json")
+        self.assertFalse(ColumnarCorpus.exists(prefix))
+        with self.assertRaises(ValueError):
+            QADataset(None, columnar_prefix=prefix)
+        QADataset(self.corpus, columnar_prefix=prefix)
+        self.assertTrue(ColumnarCorpus.exists(prefix))
+
+    def test_windowed_dataset(self) -> None:
+        """
+        Tests that a windowed QADataset serves every window of every sample and
+        gives windows of the same context and start the same context id
+        """
+        dataset = QADataset(self.corpus, window_size=2, window_stride=1)
+        self.assertEqual(len(dataset), 5)
+        self.assertEqual(
+            [
+                (dataset[idx].question_id, dataset[idx].context_offset)
+                for idx in range(5)
+            ],
+            [("0", 0), ("0", 1), ("1", 0), ("1", 1), ("2", 0)],
+        )
+        self.assertTrue(np.array_equal(dataset.get_context_lengths(), [2] * 5))
+        self.assertTrue(np.array_equal(dataset.get_context_ids(), [0, 1, 0, 1, 2]))
+        self.assertEqual([dataset[idx].context_id for idx in range(5)], [0, 1, 0, 1, 2])
+
+    def test_train_windows_keep_answers(self) -> None:
+        """
+        Tests that a windowed TrainDataset only keeps windows containing an answer,
+        and the first window of samples without answers
+        """
+        dataset = TrainDataset(self.corpus, window_size=1, window_stride=1)
+        self.assertEqual(
+            [
+                (dataset[idx].question_id, dataset[idx].context_offset)
+                for idx in range(3)
+            ],
+            [("0", 1), ("1", 0), ("2", 0)],
+        )
+        self.assertTrue(all(dataset[idx].has_answer for idx in [0, 2]))
+
+
+class CorpusCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempfile = tempfile.NamedTemporaryFile(mode="w")
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.tokenizer = RegexTokenizer()
+        self.processor = TextProcessor({"lowercase": True})
+        self.vectors = WordVectors(
+            np.zeros((4, 2)),
+            {0: WordVectors.PAD_TOKEN, 1: WordVectors.UNK_TOKEN, 2: "a", 3: "b"},
+            {WordVectors.PAD_TOKEN: 0, WordVectors.UNK_TOKEN: 1, "a": 2, "b": 3},
+        )
+        self.write_data("A b c.")
+
+    def tearDown(self) -> None:
+        self.tempfile.close()
+        self.tempdir.cleanup()
+
+    def write_data(self, context: str) -> None:
+        self.tempfile.seek(0)
+        self.tempfile.truncate()
+        json.dump(
+            {
+                "data": [
+                    {
+                        "paragraphs": [
+                            {
+                                "context": context,
+                                "qas": [
+                                    {
+                                        "answers": [{"answer_start": 0, "text": "A"}],
+                                        "id": "0",
+                                        "question": "Which b?",
+                                    }
+                                ],
+                            }
+                        ]
+                    }
+                ]
+            },
+            self.tempfile,
+        )
+        self.tempfile.flush()
+
+    def load(self) -> Corpus:
+        return Corpus.from_file(
+            self.tempfile.name,
+            self.tokenizer,
+            self.processor,
+            self.vectors,
+            cache_dir=self.tempdir.name,
+        )
+
+    def test_reuses_cache(self) -> None:
+        """
+        Tests that a corpus is preprocessed once and loaded from the cache after
+        """
+        corpus = self.load()
+        self.assertIsNotNone(corpus.cache_key)
+        with patch.object(Corpus, "from_raw") as from_raw:
+            cached_corpus = self.load()
+        from_raw.assert_not_called()
+        self.assertEqual(cached_corpus.cache_key, corpus.cache_key)
+        self.assertEqual(cached_corpus.context_qas, corpus.context_qas)
+        self.assertEqual(cached_corpus.stats, corpus.stats)
+
+    def test_serialized_by_extension(self) -> None:
+        """
+        Tests that files with a serialized corpus extension are loaded without
+        being preprocessed, and any other file is read as raw QA data
+        """
+        corpus = self.load()
+        for extension in Corpus.SERIALIZED_EXTENSIONS:
+            serialized_file = os.path.join(self.tempdir.name, f"saved{extension}")
+            corpus.save(serialized_file)
+            with patch.object(Corpus, "from_raw") as from_raw:
+                loaded = Corpus.from_file(
+                    serialized_file, self.tokenizer, self.processor, self.vectors
+                )
+            from_raw.assert_not_called()
+            self.assertIsNone(loaded.cache_key)
+            self.assertEqual(loaded.context_qas, corpus.context_qas)
+        with patch.object(Corpus, "from_disk") as from_disk:
+            Corpus.from_file(
+                self.tempfile.name, self.tokenizer, self.processor, self.vectors
+            )
+        from_disk.assert_not_called()
+
+    def test_cache_key_changes(self) -> None:
+        """
+        Tests that changing the data or any preprocessing setting changes the
+        cache key, and that wrapping the tokenizer in a cache doesn't
+        """
+
+        def key(**kwargs: Any) -> str:
+            settings = {
+                "tokenizer": self.tokenizer,
+                "processor": self.processor,
+                "word_vectors": self.vectors,
+            }
+            settings.update(kwargs)
+            return Corpus.get_cache_key(self.tempfile.name, **settings)
+
+        base_key = key()
+        self.assertEqual(key(), base_key)
+        self.assertEqual(key(tokenizer=CachingTokenizer(self.tokenizer)), base_key)
+        changed_keys = [
+            key(tokenizer=NltkTokenizer()),
+            key(processor=TextProcessor({"lowercase": False})),
+            key(word_vectors=self.vectors.prune({"a": 1})),
+            key(force_single_answer=True),
+            key(char_mapping={"a": 2}),
+        ]
+        self.write_data("A b d.")
+        changed_keys.append(key())
+        self.assertNotIn(base_key, changed_keys)
+        self.assertEqual(len(set(changed_keys)), len(changed_keys))
+
+
+class StreamingQADatasetTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempfile = tempfile.NamedTemporaryFile(mode="w")
+        self.tokenizer = RegexTokenizer()
+        self.processor = TextProcessor({"lowercase": True})
+        self.vectors = WordVectors(
+            np.zeros((4, 2)),
+            {0: WordVectors.PAD_TOKEN, 1: WordVectors.UNK_TOKEN, 2: "a", 3: "b"},
+            {WordVectors.PAD_TOKEN: 0, WordVectors.UNK_TOKEN: 1, "a": 2, "b": 3},
+        )
+        input_dict = {
+            "data": [
+                {
+                    "paragraphs": [
+                        {
+                            "context": f"A b c{doc} d{par} e f g h.",
+                            "qas": [
+                                {
+                                    "answers": [
+                                        {
+                                            "answer_start": 6 + len(str(doc)),
+                                            "text": f"d{par}",
+                                        }
+                                    ],
+                                    "id": f"{doc}_{par}_{q}",
+                                    "question": f"Which {q}?",
+                                }
+                                for q in range(2)
+                            ],
+                        }
+                        for par in range(3)
+                    ]
+                }
+                for doc in range(4)
+            ]
+        }
+        json.dump(input_dict, self.tempfile)
+        self.tempfile.flush()
+        self.corpus = Corpus.from_file(
+            self.tempfile.name, self.tokenizer, self.processor, self.vectors
+        )
+
+    def tearDown(self) -> None:
+        self.tempfile.close()
+
+    def stream(self, **kwargs: Any) -> StreamingQADataset:
+        return StreamingQADataset.from_file(
+            self.tempfile.name,
+            self.tokenizer,
+            self.processor,
+            self.vectors,
+            force_single_answer=False,
+            **kwargs,
+        )
+
+    def assert_samples_equal(self, samples: List[Any], other: List[Any]) -> None:
+        self.assertEqual(len(samples), len(other))
+        for sample, other_sample in zip(samples, other):
+            self.assertEqual(sample.question_id, other_sample.question_id)
+            self.assertEqual(sample.context_offset, other_sample.context_offset)
+            self.assertTrue(
+                np.array_equal(sample.context_words, other_sample.context_words)
+            )
+            self.assertTrue(
+                np.array_equal(
+                    sample.context_flat_chars, other_sample.context_flat_chars
+                )
+            )
+            self.assertTrue(
+                np.array_equal(sample.span_starts, other_sample.span_starts)
+            )
+
+    def test_stats_match_corpus(self) -> None:
+        """
+        Tests that the streaming pass computes the same stats as loading the corpus
+        """
+        dataset = self.stream()
+        self.assertEqual(dataset.stats, self.corpus.stats)
+        self.assertEqual(set(dataset.char_mapping), set(self.corpus.char_mapping))
+
+    def test_samples_match_dataset(self) -> None:
+        """
+        Tests that the streamed samples (and windows) match the in-memory ones
+        """
+        for window_size in [0, 3]:
+            dataset = self.stream(
+                char_mapping=self.corpus.char_mapping,
+                window_size=window_size,
+                window_stride=2,
+            )
+            in_memory = TrainDataset(self.corpus, None, window_size, 2)
+            self.assert_samples_equal(
+                list(dataset), [in_memory[idx] for idx in range(len(in_memory))]
+            )
+
+    def test_workers_and_shuffle(self) -> None:
+        """
+        Tests that workers split the paragraphs between them and that shuffling
+        keeps every sample exactly once
+        """
+        dataset = self.stream(shuffle_buffer_size=5)
+        question_ids = [sample.question_id for sample in dataset.iter_samples(0, 1)]
+        worker_ids = [
+            [sample.question_id for sample in dataset.iter_samples(worker, 3)]
+            for worker in range(3)
+        ]
+        self.assertEqual(sorted(sum(worker_ids, [])), sorted(question_ids))
+        self.assertTrue(all(len(ids) == 8 for ids in worker_ids))
+        self.assertEqual(
+            sorted(sample.question_id for sample in dataset), sorted(question_ids)
+        )
+
+
 class QADatasetTestCase(unittest.TestCase):
     def setUp(self) -> None:
         pass
@@ -0,0 +1,82 @@
+"""
+Module for testing evaluator utilities
+"""
+import unittest
+
+import torch as t
+
+from model.evaluator import get_best_spans, merge_best_answers
+
+
+class BestSpansTestCase(unittest.TestCase):
+    def brute_force_best_span(self, start_logits, end_logits, context_len, max_len=0):
+        best_score = None
+        best_span = (0, 0)
+        for start_idx in range(context_len):
+            for end_idx in range(start_idx, context_len):
+                if max_len and end_idx - start_idx >= max_len:
+                    break
+                score = start_logits[start_idx] + end_logits[end_idx]
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_span = (start_idx, end_idx)
+        return best_span, best_score
+
+    def check_against_brute_force(self, max_len: int) -> None:
+        t.manual_seed(0)
+        context_lens = [7, 3, 5, 1]
+        start_logits = t.randn((len(context_lens), max(context_lens)))
+        end_logits = t.randn((len(context_lens), max(context_lens)))
+        context_mask = t.zeros((len(context_lens), max(context_lens)))
+        for idx, context_len in enumerate(context_lens):
+            context_mask[idx, :context_len] = 1
+        best_spans = get_best_spans(start_logits, end_logits, context_mask, max_len)
+        for idx, context_len in enumerate(context_lens):
+            span, score = self.brute_force_best_span(
+                start_logits[idx].tolist(),
+                end_logits[idx].tolist(),
+                context_len,
+                max_len,
+            )
+            self.assertEqual(
+                (best_spans.span_starts[idx].item(), best_spans.span_ends[idx].item()),
+                span,
+            )
+            self.assertAlmostEqual(best_spans.scores[idx].item(), score, places=5)
+
+    def test_best_spans_unlimited(self) -> None:
+        """
+        Tests that the batched decoder finds the same spans as exhaustive search
+        """
+        self.check_against_brute_force(0)
+
+    def test_best_spans_max_len(self) -> None:
+        """
+        Tests that the batched decoder respects the maximum answer length
+        """
+        self.check_against_brute_force(2)
+
+    def test_best_spans_single_token(self) -> None:
+        """
+        Tests that with max length 1 only single token spans are predicted
+        """
+        start_logits = t.Tensor([[0.0, -5.0, -5.0]])
+        end_logits = t.Tensor([[-5.0, -5.0, 0.0]])
+        best_spans = get_best_spans(start_logits, end_logits, t.ones((1, 3)), 1)
+        self.assertEqual(
+            best_spans.span_starts[0].item(), best_spans.span_ends[0].item()
+        )
+
+
+class MergeBestAnswersTestCase(unittest.TestCase):
+    def test_keeps_best_window(self) -> None:
+        """
+        Tests that answers predicted on several windows of a question are merged
+        into the highest scoring one
+        """
+        qid_to_answer = {"q0": (3, 4, -2.0)}
+        merge_best_answers(
+            qid_to_answer,
+            [("q0", (10, 12, -1.0)), ("q0", (0, 1, -3.0)), ("q1", (5, 5, -4.0))],
+        )
+        self.assertEqual(qid_to_answer, {"q0": (10, 12, -1.0), "q1": (5, 5, -4.0)})
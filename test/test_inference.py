@@ -0,0 +1,181 @@
+"""
+Module for testing the inference engine
+"""
+import json
+import math
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import torch as t
+
+from model.docqa_predictor import DocQAConfig, DocQAPredictor
+from model.inference import InferenceConfig, InferenceEngine
+from model.modules.embeddor import (
+    EmbeddorConfig,
+    PoolingCharEmbeddorConfig,
+    WordEmbeddorConfig,
+    make_embeddor,
+)
+from model.predictor import ContextualEncoderConfig, ModelPredictions, PredictorModel
+from model.qa import QuestionId
+from model.wv import WordVectors
+
+
+class InferenceEngineTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.model = MagicMock(PredictorModel)
+        self.model.to.return_value = self.model
+        self.model.side_effect = self.predict
+        self.batches = []
+        config = InferenceConfig(
+            batch_size=2,
+            max_question_size=0,
+            max_context_size=0,
+            max_answer_size=0,
+            context_cache_mb=0,
+            device=t.device("cpu"),
+        )
+        self.engine = InferenceEngine(
+            self.model, {"the": 2, "cat": 3}, {"t": 2, "h": 3, "e": 4}, config
+        )
+
+    def predict(self, batch) -> ModelPredictions:
+        """
+        Predicts the span of tokens 1-2 for every sample
+        """
+        self.batches.append(batch)
+        start_logits = t.full(batch.context_mask.shape, -10.0)
+        end_logits = t.full(batch.context_mask.shape, -10.0)
+        start_logits[:, 1] = 0
+        end_logits[:, 2] = 0
+        return ModelPredictions(
+            start_logits=start_logits,
+            end_logits=end_logits,
+            no_ans_logits=t.zeros((len(batch), 1)),
+            start_scores=start_logits,
+            end_scores=end_logits,
+        )
+
+    def test_answer_batch(self) -> None:
+        """
+        Tests that answers are mapped back to the original context text in
+        the order of the pairs
+        """
+        contexts = ["The Cat sat down.", "A dog, barking loudly"]
+        predictions = self.engine.answer_batch(
+            [(contexts[0], "Who sat?"), (contexts[1], "What?"), (contexts[0], "Why?")]
+        )
+        self.assertEqual(
+            [prediction.text for prediction in predictions],
+            ["Cat sat", "dog,", "Cat sat"],
+        )
+        self.assertEqual(predictions[0].char_span, (4, 11))
+        self.assertEqual(predictions[1].char_span, (2, 6))
+        self.assertEqual(predictions[0].score, 0)
+        self.assertEqual(predictions[0].no_answer_score, 0)
+        self.assertEqual(len(self.batches), 2)
+        self.assertEqual(self.batches[0].context_idxs.tolist(), [0, 1])
+        self.assertEqual(
+            self.batches[0].question_ids, [QuestionId("0"), QuestionId("1")]
+        )
+
+    def test_answer_paragraphs(self) -> None:
+        """
+        Tests that the best span over all paragraphs is picked and scored with
+        shared normalization
+        """
+        self.model.side_effect = self.predict_by_length
+        best_idx, prediction = self.engine.answer_paragraphs(
+            "Who sat?", ["A cat sat", "The cat sat down", "It sat down"]
+        )
+        self.assertEqual(best_idx, 1)
+        self.assertEqual(prediction.text, "cat sat")
+        # Normalized over the spans of all paragraphs the best start and end
+        # scores 4 compete with two other paragraphs' scores 3
+        self.assertAlmostEqual(
+            prediction.score, -2 * math.log(1 + 2 * math.exp(-1)), places=4
+        )
+
+    def predict_by_length(self, batch) -> ModelPredictions:
+        """
+        Predicts the span of tokens 1-2 for every sample, scoring the spans of
+        longer contexts higher before normalization
+        """
+        start_scores = t.full(batch.context_mask.shape, -1e4)
+        end_scores = t.full(batch.context_mask.shape, -1e4)
+        bonus = batch.context_mask.sum(1).float()
+        start_scores[:, 1] = bonus
+        end_scores[:, 2] = bonus
+        return ModelPredictions(
+            start_logits=start_scores.log_softmax(1),
+            end_logits=end_scores.log_softmax(1),
+            no_ans_logits=None,
+            start_scores=start_scores,
+            end_scores=end_scores,
+        )
+
+
+class SavedModelTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.vector_file = os.path.join(self.tempdir.name, "vectors.txt")
+        with open(self.vector_file, "w") as f:
+            f.write("the 1 0\ncat 0 1\nsat 1 1")
+        self.char_mapping_file = os.path.join(self.tempdir.name, "chars.json")
+        with open(self.char_mapping_file, "w") as f:
+            json.dump({"t": 2, "h": 3, "e": 4}, f)
+        self.model_file = os.path.join(self.tempdir.name, "run.pth")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_from_files(self) -> None:
+        """
+        Tests that a whole model saved like train.py does is loaded back and
+        answers questions
+        """
+        embeddor = make_embeddor(
+            EmbeddorConfig(
+                highway_layers=0,
+                word_embeddor=WordEmbeddorConfig(
+                    vectors=WordVectors.load_vectors(self.vector_file),
+                    train_vecs=False,
+                ),
+                char_embeddor=PoolingCharEmbeddorConfig(
+                    char_vocab_size=5, embedding_dimension=2
+                ),
+            ),
+            t.device("cpu"),
+        )
+        model = DocQAPredictor(
+            embeddor,
+            DocQAConfig(
+                contextual_encoder_config=ContextualEncoderConfig(
+                    hidden_size=2, num_layers=1, dropout_input=True, dropout_prob=0
+                ),
+                dropout_prob=0,
+                attention_linear_hidden_size=2,
+                use_self_attention=True,
+                batch_size=2,
+                attention_block_size=0,
+            ),
+        )
+        t.save(model, self.model_file)
+        config = InferenceConfig(
+            batch_size=2,
+            max_question_size=0,
+            max_context_size=0,
+            max_answer_size=0,
+            context_cache_mb=0,
+            device=t.device("cpu"),
+        )
+        engine = InferenceEngine.from_files(
+            self.model_file, self.vector_file, self.char_mapping_file, config
+        )
+        self.assertIsInstance(engine.model, DocQAPredictor)
+        for name, value in model.state_dict().items():
+            self.assertTrue(t.equal(engine.model.state_dict()[name], value))
+        prediction = engine.answer("The cat sat.", "Who sat?")
+        self.assertIn(prediction.text, "The cat sat.")
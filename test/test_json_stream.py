@@ -0,0 +1,63 @@
+"""
+Module for testing the incremental JSON reader
+"""
+import io
+import json
+import unittest
+
+from model.json_stream import JsonStreamReader
+
+
+class JsonStreamReaderTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = {
+            "version": "1.1",
+            "data": [
+                {
+                    "title": f"Doc {doc}",
+                    "paragraphs": [
+                        {
+                            "context": f"Paragraph {par} of doc {doc}, été. "
+                            * (par + 1),
+                            "qas": [
+                                {
+                                    "answers": [{"answer_start": 12345, "text": "x"}],
+                                    "id": f"{doc}_{par}",
+                                    "question": "Which [paragraph]?",
+                                }
+                            ],
+                        }
+                        for par in range(3)
+                    ],
+                    "tags": [1, 2.5e3, {"nested": [None, True]}],
+                }
+                for doc in range(5)
+            ],
+            "size": 15,
+        }
+        self.paragraphs = [
+            paragraph for doc in self.data["data"] for paragraph in doc["paragraphs"]
+        ]
+
+    def test_items_match_json_load(self) -> None:
+        """
+        Tests that the streamed items match the fully loaded ones, regardless of
+        formatting and of how many reads a single value spans
+        """
+        for indent in [None, 2]:
+            text = json.dumps(self.data, indent=indent, ensure_ascii=False)
+            for read_size in [1, 3, 64, JsonStreamReader.READ_SIZE]:
+                reader = JsonStreamReader(io.StringIO(text), read_size)
+                self.assertEqual(
+                    list(reader.iter_items(["data", "paragraphs"])), self.paragraphs
+                )
+                reader = JsonStreamReader(io.StringIO(text), read_size)
+                self.assertEqual(list(reader.iter_items(["data"])), self.data["data"])
+
+    def test_malformed_json(self) -> None:
+        """
+        Tests that malformed JSON raises a JSONDecodeError
+        """
+        for text in ['{"data": [1,]}', '{"data": [] x', '{"data" []}', '{"data": [']:
+            with self.assertRaises(json.JSONDecodeError):
+                list(JsonStreamReader(io.StringIO(text), 2).iter_items(["data"]))
@@ -15,7 +15,14 @@ from torch.nn.utils.rnn import (
     pad_sequence,
 )
 
-from model.predictor import DocQAConfig
+from model.batcher import collate_batch
+from model.docqa_predictor import DocQAConfig
+from model.predictor import (
+    ContextualEncoder,
+    ContextualEncoderConfig,
+    PredictorModel,
+)
+from model.qa import EncodedSample, QuestionId
 from model.util import get_last_hidden_states
 
 
@@ -129,3 +136,85 @@ class PredictorTestCase(unittest.TestCase):
             states, self.config.n_directions, self.config.total_hidden_size
         )
         self.check_match(all_states, last_hidden_state, lens)
+
+
+class WordEmbeddingStub(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.embedding = nn.Embedding(10, 4)
+        self.num_calls = 0
+
+    def forward(self, words: t.Tensor, chars: t.Tensor) -> t.Tensor:
+        self.num_calls += 1
+        return self.embedding(words) + chars.sum(2, keepdim=True).float()
+
+
+class ContextEncodingCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        t.manual_seed(0)
+        self.model = PredictorModel()
+        self.model.embed = WordEmbeddingStub()
+        self.model.embedding_encoder = ContextualEncoder(
+            4, ContextualEncoderConfig(3, 1, False, 0)
+        )
+        self.model.eval()
+
+    def make_sample(self, qid: str, context_id: int, context: list) -> EncodedSample:
+        context_words = np.array(context)
+        return EncodedSample.from_arrays(
+            QuestionId(qid),
+            context_words,
+            context_words % 3,
+            np.arange(len(context) + 1),
+            np.array([1, 2]),
+            np.array([1, 2]),
+            np.arange(3),
+            np.array([0]),
+            np.array([0]),
+            context_id=context_id,
+        )
+
+    def check_matches_uncached(self, group_contexts: bool) -> None:
+        samples = [
+            self.make_sample("q0", 0, [1, 2, 3]),
+            self.make_sample("q1", 1, [4, 5, 6, 7, 8]),
+            self.make_sample("q2", 0, [1, 2, 3]),
+        ]
+        batch = collate_batch(samples, group_contexts=group_contexts)
+        with t.no_grad():
+            expected = self.model.encode_context(batch)
+            self.model.enable_context_cache(2 ** 20)
+            cached = self.model.encode_context(batch)
+            num_calls = self.model.embed.num_calls
+            cached_again = self.model.encode_context(batch)
+        self.assertEqual(len(self.model.context_cache), 2)
+        self.assertEqual(self.model.embed.num_calls, num_calls)
+        self.assertTrue(t.allclose(cached, expected, atol=1e-6))
+        self.assertTrue(t.allclose(cached_again, expected, atol=1e-6))
+
+    def test_cached_encoding_matches(self) -> None:
+        """
+        Tests that cached context encodings match the uncached encodings and
+        repeated contexts aren't re-encoded
+        """
+        self.check_matches_uncached(group_contexts=False)
+
+    def test_cached_encoding_matches_grouped(self) -> None:
+        """
+        Tests cached context encodings for context-grouped batches
+        """
+        self.check_matches_uncached(group_contexts=True)
+
+    def test_cache_memory_cap(self) -> None:
+        """
+        Tests that the least recently used encodings are evicted to stay
+        within the memory cap
+        """
+        encoding_bytes = 3 * 6 * 4
+        self.model.enable_context_cache(2 * encoding_bytes)
+        cache = self.model.context_cache
+        for key in ["a", "b", "a", "c"]:
+            if cache.get(key) is None:
+                cache.put(key, t.zeros((3, 6)))
+        self.assertEqual(list(cache.encodings.keys()), ["a", "c"])
+        self.assertEqual(cache.num_bytes, 2 * encoding_bytes)
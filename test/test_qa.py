@@ -1,6 +1,7 @@
 """
 Module for testing data encoding
 """
+import pickle
 import unittest
 from unittest.mock import Mock, MagicMock
 
@@ -8,7 +9,7 @@ import numpy as np
 
 from typing import List
 from model.text_processor import TextProcessor
-from model.tokenizer import Tokenizer, Token
+from model.tokenizer import Tokenizer, Token, RegexTokenizer
 from model.qa import (
     Answer,
     QuestionAnswer,
@@ -96,6 +97,32 @@ class EncodingTestCase(unittest.TestCase):
         self.assertEqual(context_text, cqa_obj.text)
         self.assertEqual(context_tokens, cqa_obj.tokens)
 
+    def test_processed_text_not_stored(self):
+        """
+        Tests that only the original text is stored and the processed text is
+        recomputed with a processor that's pickled once for the whole context
+        """
+        processor = TextProcessor({"lowercase": True})
+        tokenizer = RegexTokenizer()
+        qas = [
+            QuestionAnswer(
+                "qa_%d" % i,
+                "Question %d?" % i,
+                {Answer("The Cat", 0, tokenizer, processor)},
+                tokenizer,
+                processor,
+            )
+            for i in range(2)
+        ]
+        cqa_obj = ContextQuestionAnswer("The Cat sat.", qas, tokenizer, processor)
+        self.assertFalse(hasattr(cqa_obj, "__dict__"))
+        self.assertEqual(cqa_obj.text, "the cat sat.")
+        self.assertEqual(cqa_obj.tokens.words, ["the", "cat", "sat", "."])
+        unpickled = pickle.loads(pickle.dumps(cqa_obj))
+        self.assertEqual(unpickled, cqa_obj)
+        self.assertIs(unpickled.processor, unpickled.qas[1].processor)
+        self.assertEqual(list(unpickled.qas[0].answers)[0].span_end, 7)
+
     def test_answer_encoding(self):
         """
         Tests that the EncodedAnswer class maps answer spans to post-tokenization
@@ -108,6 +135,36 @@ class EncodingTestCase(unittest.TestCase):
         self.assertEqual(encoded_answer.span_start, 3)
         self.assertEqual(encoded_answer.span_end, 4)
 
+    def test_answer_alignment_between_tokens(self):
+        """
+        Tests that answers whose spans start or end on whitespace are aligned to
+        the tokens inside them and flagged, and that aligning all answers at once
+        matches aligning them one by one
+        """
+        processor = TextProcessor({"lowercase": True})
+        tokenizer = RegexTokenizer()
+        context_tokens = ContextQuestionAnswer(
+            "The cat sat on the mat.", [], tokenizer, processor
+        ).tokens
+        answers = [
+            Answer("cat sat", 4, tokenizer, processor),
+            Answer(" cat", 3, tokenizer, processor),
+            Answer("on the ", 12, tokenizer, processor),
+            Answer("at", 5, tokenizer, processor),
+        ]
+        encoded_answers = EncodedAnswer.align(answers, context_tokens)
+        self.assertEqual(
+            [(ans.span_start, ans.span_end) for ans in encoded_answers],
+            [(1, 2), (1, 1), (3, 4), (1, 1)],
+        )
+        self.assertEqual(
+            [ans.misaligned for ans in encoded_answers], [False, True, True, False]
+        )
+        self.assertEqual(
+            encoded_answers,
+            [EncodedAnswer(answer, list(context_tokens)) for answer in answers],
+        )
+
     def test_encoded_qa(self):
         """
         Tests that EncodedQuestionAnswer objects are initialized correctly
@@ -285,3 +342,39 @@ class EncodingTestCase(unittest.TestCase):
         self.assertTrue(encoded_sample.has_answer)
         self.assertTrue(np.allclose(encoded_sample.span_starts, answer_starts))
         self.assertTrue(np.allclose(encoded_sample.span_ends, answer_ends))
+
+    def test_sample_window(self):
+        """
+        Tests that windows of a sample slice its context and only keep the
+        answers that lie entirely within the window
+        """
+        sample = EncodedSample.from_arrays(
+            "qid_0",
+            np.array([5, 6, 7, 8, 9]),
+            np.array([1, 2, 3, 4, 5, 6]),
+            np.array([0, 1, 2, 3, 5, 6]),
+            np.array([5]),
+            np.array([1]),
+            np.array([0, 1]),
+            np.array([1, 3]),
+            np.array([2, 3]),
+        )
+        window = sample.window(2, 3, context_id=7)
+        self.assertEqual(window.context_offset, 2)
+        self.assertEqual(window.context_id, 7)
+        self.assertTrue(np.array_equal(window.context_words, [7, 8, 9]))
+        self.assertTrue(
+            all(
+                np.array_equal(word, gold)
+                for word, gold in zip(window.context_chars, [[3], [4, 5], [6]])
+            )
+        )
+        # The answer spanning tokens 1-2 is cut by the window start
+        self.assertTrue(window.has_answer)
+        self.assertTrue(np.array_equal(window.span_starts, [0, 1, 0]))
+        self.assertTrue(np.array_equal(window.span_ends, [0, 1, 0]))
+
+        cut_window = sample.window(0, 2)
+        self.assertFalse(cut_window.has_answer)
+        self.assertFalse(cut_window.span_starts.any())
+        self.assertFalse(cut_window.span_ends.any())
@@ -0,0 +1,60 @@
+"""
+Module for testing paragraph retrieval
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from model.inference import AnswerPrediction, InferenceEngine
+from model.retrieval import DocumentAnswerer, ParagraphIndex, RetrievedParagraph
+from model.text_processor import TextProcessor
+from model.tokenizer import RegexTokenizer
+
+
+class ParagraphIndexTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.paragraphs = [
+            "the cat sat on the mat",
+            "a dog chased the cat around the garden",
+            "stock prices fell sharply",
+            "the mat was red",
+        ]
+        self.index = ParagraphIndex.from_texts(
+            self.paragraphs, RegexTokenizer(), TextProcessor({"lowercase": True})
+        )
+
+    def test_retrieve_ranks_matching_paragraphs(self) -> None:
+        """
+        Tests that paragraphs sharing rarer terms with the query rank higher and
+        that paragraphs sharing no term are never retrieved
+        """
+        retrieved = self.index.retrieve(["cat", "mat"], top_k=10)
+        self.assertEqual(
+            [paragraph.paragraph_idx for paragraph in retrieved], [0, 3, 1]
+        )
+        self.assertTrue(retrieved[0].score > retrieved[1].score > 0)
+
+    def test_retrieve_top_k(self) -> None:
+        """
+        Tests that at most top_k paragraphs are retrieved
+        """
+        self.assertEqual(len(self.index.retrieve(["the", "cat"], top_k=2)), 2)
+        self.assertEqual(self.index.retrieve(["unicorn"], top_k=2), [])
+
+    def test_document_answerer(self) -> None:
+        """
+        Tests that the answerer answers against the retrieved paragraphs and maps
+        the chosen paragraph back to its index in the document
+        """
+        engine = MagicMock(InferenceEngine)
+        engine.tokenizer = RegexTokenizer()
+        engine.processor = TextProcessor({"lowercase": True})
+        prediction = AnswerPrediction("red", (12, 15), -0.5, None)
+        engine.answer_paragraphs.return_value = (1, prediction)
+        answerer = DocumentAnswerer(engine, self.paragraphs, 2, self.index)
+        answer = answerer.answer("What color was the Mat?")
+        engine.answer_paragraphs.assert_called_once_with(
+            "What color was the Mat?", [self.paragraphs[3], self.paragraphs[0]]
+        )
+        self.assertEqual(answer.prediction, prediction)
+        self.assertEqual(answer.paragraph_idx, 0)
+        self.assertIsInstance(answer.retrieved[0], RetrievedParagraph)
@@ -0,0 +1,128 @@
+"""
+Module for testing the in-memory SQuAD scorer
+"""
+import json
+import tempfile
+import unittest
+
+import scripts.evaluate_v1_1 as evaluate_v1_1  # type: ignore
+import scripts.evaluate_v2_0 as evaluate_v2_0  # type: ignore
+
+from model.qa import QuestionId
+from model.scorer import SquadScorer, normalize_answer
+
+
+class SquadScorerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.golds = {
+            QuestionId("q0"): ["The Eiffel Tower", "Eiffel Tower!"],
+            QuestionId("q1"): ["in 1889", "1889", "an iron lattice tower"],
+            QuestionId("q2"): [],
+            QuestionId("q3"): ["Gustave Eiffel's company"],
+        }
+        self.predictions = {
+            QuestionId("q0"): "eiffel tower",
+            QuestionId("q1"): "built in 1889 as a tower",
+            QuestionId("q2"): "",
+            QuestionId("q3"): "Paris",
+        }
+
+    def test_normalize_matches_official(self) -> None:
+        """
+        Tests that answers are normalized exactly like the official scripts do
+        """
+        for text in [
+            "The  Eiffel-Tower, (Paris)!",
+            "an apple a day",
+            "theatre Anthem",
+            "  ",
+        ]:
+            self.assertEqual(
+                normalize_answer(text), evaluate_v1_1.normalize_answer(text)
+            )
+
+    def test_scores_match_official(self) -> None:
+        """
+        Tests that every question gets the same exact match and F1 as the
+        official v2.0 script, which also scores unanswerable questions
+        """
+        scorer = SquadScorer(self.golds)
+        for qid, prediction in self.predictions.items():
+            golds = self.golds[qid] or [""]
+            exact, f1 = scorer.score_prediction(qid, prediction)
+            self.assertEqual(
+                exact,
+                max(evaluate_v2_0.compute_exact(gold, prediction) for gold in golds),
+            )
+            self.assertAlmostEqual(
+                f1, max(evaluate_v2_0.compute_f1(gold, prediction) for gold in golds)
+            )
+
+    def test_incremental_update(self) -> None:
+        """
+        Tests that predictions can be scored in several updates, that missing
+        predictions score 0 and that later predictions replace earlier ones
+        """
+        scorer = SquadScorer(self.golds)
+        scorer.update({QuestionId("q0"): "eiffel tower", QuestionId("q3"): "Paris"})
+        self.assertEqual(scorer.metrics()["exact_match"], 25.0)
+        scorer.update({QuestionId("q2"): "", QuestionId("q3"): "Gustave Eiffel's"})
+        metrics = scorer.metrics()
+        self.assertEqual(metrics["exact_match"], 50.0)
+        self.assertAlmostEqual(metrics["f1"], 100.0 * (2 + 0.8) / 4)
+        self.assertEqual(metrics["total"], 4)
+        self.assertEqual(scorer.score({})["f1"], 0.0)
+
+    def test_parallel_matches_serial(self) -> None:
+        """
+        Tests that scoring in worker processes gives the same metrics
+        """
+        golds = {
+            QuestionId(str(idx)): [f"answer {idx % 7}"]
+            for idx in range(2 * SquadScorer.PARALLEL_CHUNK_SIZE + 1)
+        }
+        predictions = {qid: f"answer {int(qid) % 5}" for qid in golds}
+        serial_metrics = SquadScorer(golds).score(predictions)
+        parallel_scorer = SquadScorer(golds, num_workers=2)
+        try:
+            self.assertEqual(parallel_scorer.score(predictions), serial_metrics)
+        finally:
+            parallel_scorer.close()
+
+    def test_from_file_reads_all_answers(self) -> None:
+        """
+        Tests that a scorer read from a SQuAD file has every annotated answer and
+        stops its workers when used as a context manager
+        """
+        data = {
+            "data": [
+                {
+                    "paragraphs": [
+                        {
+                            "context": "The Eiffel Tower was built in 1889.",
+                            "qas": [
+                                {
+                                    "id": qid,
+                                    "question": "?",
+                                    "answers": [
+                                        {"answer_start": 0, "text": text}
+                                        for text in texts
+                                    ],
+                                }
+                                for qid, texts in self.golds.items()
+                            ],
+                        }
+                    ]
+                }
+            ]
+        }
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".json") as data_file:
+            json.dump(data, data_file)
+            data_file.flush()
+            self.assertEqual(SquadScorer.read_gold_answers(data_file.name), self.golds)
+            with SquadScorer.from_file(data_file.name, num_workers=1) as scorer:
+                self.assertEqual(
+                    scorer.score(self.predictions),
+                    SquadScorer(self.golds).score(self.predictions),
+                )
+            self.assertIsNone(scorer.executor)
@@ -0,0 +1,82 @@
+"""
+Module for testing the serving components
+"""
+import asyncio
+import json
+import unittest
+from typing import Any, Awaitable, Callable
+from unittest.mock import Mock
+
+from model.inference import AnswerPrediction, InferenceEngine
+from model.serving import AnswerServer, DynamicBatcher
+
+
+class DynamicBatcherTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.engine = Mock(InferenceEngine)
+        self.engine.answer_batch.side_effect = lambda pairs: [
+            AnswerPrediction(question, (0, len(question)), 0.0, None)
+            for _, question in pairs
+        ]
+
+    def run_with_batcher(
+        self, batcher: DynamicBatcher, make_awaitable: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        async def run() -> Any:
+            batcher_task = asyncio.ensure_future(batcher.run())
+            try:
+                return await make_awaitable()
+            finally:
+                batcher_task.cancel()
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_concurrent_requests_batched(self) -> None:
+        """
+        Tests that concurrent requests are answered in batches of at most
+        max_batch_size and results are sent back to the right request
+        """
+        batcher = DynamicBatcher(self.engine, max_batch_size=3, max_wait_ms=50)
+        questions = ["q%d" % idx for idx in range(5)]
+        timed_predictions = self.run_with_batcher(
+            batcher,
+            lambda: asyncio.gather(
+                *[batcher.submit("ctx", question) for question in questions]
+            ),
+        )
+        self.assertEqual(
+            [timed.prediction.text for timed in timed_predictions], questions
+        )
+        self.assertEqual(
+            [len(call[0][0]) for call in self.engine.answer_batch.call_args_list],
+            [3, 2],
+        )
+        for timed in timed_predictions:
+            self.assertGreaterEqual(timed.queue_ms, 0)
+            self.assertGreaterEqual(timed.compute_ms, 0)
+
+    def test_answer_endpoint(self) -> None:
+        """
+        Tests that the answer endpoint answers single and batched request bodies
+        """
+        batcher = DynamicBatcher(self.engine, max_batch_size=4, max_wait_ms=1)
+        server = AnswerServer(batcher)
+        body = json.dumps(
+            [{"context": "ctx", "question": "a"}, {"context": "ctx", "question": "b"}]
+        ).encode("utf-8")
+        responses = self.run_with_batcher(
+            batcher,
+            lambda: asyncio.gather(
+                server.handle_request("POST", "/answer", body),
+                server.handle_request("POST", "/answer", b"{}"),
+                server.handle_request("GET", "/missing", b""),
+            ),
+        )
+        status, response = responses[0]
+        self.assertEqual(status, 200)
+        self.assertEqual([answer["text"] for answer in response], ["a", "b"])
+        self.assertEqual([status for status, _ in responses[1:]], [400, 404])
@@ -1,13 +1,23 @@
 """
 Module for testing dataset representations
 """
+import pickle
 import unittest
 from unittest.mock import Mock, MagicMock
 
+import numpy as np
+
 from nltk.tokenize import WordPunctTokenizer
 
 from typing import List
-from model.tokenizer import Tokenizer, NltkTokenizer, Token
+from model.tokenizer import (
+    Tokenizer,
+    NltkTokenizer,
+    RegexTokenizer,
+    CachingTokenizer,
+    Token,
+    TokenList,
+)
 
 
 class BatcherTestCase(unittest.TestCase):
@@ -22,3 +32,61 @@ class BatcherTestCase(unittest.TestCase):
             - Make sure the Token objects are built correctly
         """
         pass
+
+    def test_regex_tokenizer_matches_nltk(self):
+        """
+        Tests that the regex tokenizer produces the same tokens as NLTK
+        """
+        texts = [
+            "The quick brown fox's tail, (allegedly) 3.5m long!",
+            "  leading and  trailing\twhitespace\n ",
+            "Émile Zola naît à Paris — 1840...",
+            "e-mail: foo@bar.com;;; 100%?!",
+            "",
+        ]
+        nltk_tokenizer = NltkTokenizer()
+        regex_tokenizer = RegexTokenizer()
+        for text in texts:
+            self.assertEqual(
+                regex_tokenizer.tokenize(text), nltk_tokenizer.tokenize(text)
+            )
+        self.assertEqual(
+            regex_tokenizer.tokenize_batch(texts), nltk_tokenizer.tokenize_batch(texts)
+        )
+
+    def test_caching_tokenizer(self):
+        """
+        Tests that repeated texts are served from the cache and the least
+        recently used texts are evicted
+        """
+        inner_tokenizer = Mock(Tokenizer)
+        inner_tokenizer.tokenize.side_effect = RegexTokenizer().tokenize
+        inner_tokenizer.tokenize_batch.side_effect = RegexTokenizer().tokenize_batch
+        tokenizer = CachingTokenizer(inner_tokenizer, max_size=2)
+        self.assertEqual(tokenizer.tokenize("a b"), RegexTokenizer().tokenize("a b"))
+        tokenizer.tokenize("a b")
+        self.assertEqual(inner_tokenizer.tokenize.call_count, 1)
+        tokens = tokenizer.tokenize_batch(["c", "a b", "c", "d"])
+        self.assertEqual(tokens, RegexTokenizer().tokenize_batch(["c", "a b", "c", "d"]))
+        inner_tokenizer.tokenize_batch.assert_called_once_with(["c", "d"])
+        self.assertEqual(list(tokenizer.cache.keys()), ["c", "d"])
+
+    def test_token_list(self):
+        """
+        Tests that a TokenList reads back the same tokens it was built from and
+        survives pickling
+        """
+        tokens = RegexTokenizer().tokenize("Émile Zola, born 1840 in Paris.")
+        token_list = TokenList.from_tokens(tokens)
+        self.assertEqual(len(token_list), len(tokens))
+        self.assertEqual(token_list, tokens)
+        self.assertEqual(token_list[1], tokens[1])
+        self.assertEqual(token_list[-1], tokens[-1])
+        self.assertEqual(token_list[2:4], tokens[2:4])
+        self.assertEqual(token_list.words, [token.word for token in tokens])
+        self.assertEqual(token_list.starts.tolist(), [tok.span[0] for tok in tokens])
+        self.assertEqual(token_list.spans.dtype, np.int32)
+        self.assertEqual(pickle.loads(pickle.dumps(token_list)), token_list)
+        with self.assertRaises(IndexError):
+            token_list[len(tokens)]
+        self.assertEqual(TokenList.from_tokens([]), [])
@@ -1,18 +1,27 @@
 """
 Module for testing dataset representations
 """
+import os
+import tempfile
 import unittest
 from unittest.mock import Mock, MagicMock
 
+import numpy as np
+import torch as t
+
 from nltk.tokenize import WordPunctTokenizer
 
 from typing import List
+from model.modules.embeddor import WordEmbeddor
 from model.wv import WordVectors
 
 
 class WordVectorsTestCase(unittest.TestCase):
     def setUp(self):
-        pass
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
 
     def test_reading_simple(self):
         """
@@ -56,3 +65,111 @@ class WordVectorsTestCase(unittest.TestCase):
             the original vectors
         """
         pass
+
+    def write_vectors(self, lines: List[str]) -> str:
+        vector_file = os.path.join(self.tempdir.name, "vectors.txt")
+        with open(vector_file, "w") as f:
+            f.write("\n".join(lines))
+        return vector_file
+
+    def test_chunked_reading(self):
+        """
+        Tests that vectors spanning several read chunks are read in order
+        """
+        lines = ["w%d %d.5 %d" % (idx, idx, -idx) for idx in range(25)]
+        vector_file = self.write_vectors(["25 2"] + lines)
+        chunk_lines = WordVectors.READ_CHUNK_LINES
+        WordVectors.READ_CHUNK_LINES = 4
+        self.addCleanup(setattr, WordVectors, "READ_CHUNK_LINES", chunk_lines)
+        vectors = WordVectors.from_text_vectors(vector_file, consume_first_line=True)
+        self.assertEqual(vectors.vectors.shape, (27, 2))
+        self.assertEqual(vectors.vectors.dtype, np.float32)
+        self.assertEqual(vectors.word_to_idx[WordVectors.PAD_TOKEN], 0)
+        self.assertEqual(vectors.word_to_idx[WordVectors.UNK_TOKEN], 1)
+        for idx in range(25):
+            self.assertEqual(vectors.word_to_idx["w%d" % idx], idx + 2)
+            self.assertEqual(vectors.vectors[idx + 2].tolist(), [idx + 0.5, -idx])
+        self.assertEqual(vectors.vectors[0].tolist(), [0, 0])
+
+    def test_binary_cache(self):
+        """
+        Tests that text vectors are cached and later loaded memory mapped
+        """
+        vector_file = self.write_vectors(["a 1 2 3", "b c 4 5 6", "d 7 8 9"])
+        vectors = WordVectors.load_vectors(vector_file)
+        self.assertTrue(
+            WordVectors.cache_is_fresh(
+                vector_file, vector_file + WordVectors.CACHE_SUFFIX
+            )
+        )
+        cached_vectors = WordVectors.load_vectors(vector_file)
+        self.assertIsInstance(cached_vectors.vectors, np.memmap)
+        self.assertEqual(cached_vectors.word_to_idx, vectors.word_to_idx)
+        self.assertTrue(np.array_equal(cached_vectors.vectors, vectors.vectors))
+        self.assertEqual(cached_vectors.word_to_idx["b c"], 3)
+
+    def test_corrupt_cache(self):
+        """
+        Tests that a truncated cache that looks fresh is replaced by rereading
+        the text vectors
+        """
+        vector_file = self.write_vectors(["a 1 2 3", "d 7 8 9"])
+        vectors = WordVectors.load_vectors(vector_file)
+        cache_prefix = vector_file + WordVectors.CACHE_SUFFIX
+        with open(cache_prefix + "-vectors.npy", "r+b") as f:
+            f.truncate(10)
+        self.assertTrue(WordVectors.cache_is_fresh(vector_file, cache_prefix))
+        reread_vectors = WordVectors.load_vectors(vector_file)
+        # The UNK vector is drawn randomly on every read
+        self.assertTrue(
+            np.array_equal(reread_vectors.vectors[2:], vectors.vectors[2:])
+        )
+        cached_vectors = WordVectors.load_vectors(vector_file)
+        self.assertIsInstance(cached_vectors.vectors, np.memmap)
+        self.assertTrue(
+            np.array_equal(cached_vectors.vectors, reread_vectors.vectors)
+        )
+        self.assertFalse(
+            [name for name in os.listdir(self.tempdir.name) if name.endswith(".tmp")]
+        )
+
+    def test_cached_vectors_embedding(self):
+        """
+        Tests that an embeddor built from memory mapped cached vectors owns a
+        writable copy of them, so loading a state dict into it works
+        """
+        vector_file = self.write_vectors(["a 1 2 3", "d 7 8 9"])
+        WordVectors.load_vectors(vector_file)
+        cached_vectors = WordVectors.load_vectors(vector_file)
+        self.assertIsInstance(cached_vectors.vectors, np.memmap)
+        embeddor = WordEmbeddor(cached_vectors, train_vecs=False)
+        state = {
+            name: t.zeros_like(value) for name, value in embeddor.state_dict().items()
+        }
+        embeddor.load_state_dict(state)
+        self.assertEqual(embeddor.embed.weight.abs().sum().item(), 0)
+        self.assertEqual(cached_vectors.vectors[2].tolist(), [1, 2, 3])
+
+    def test_prune(self):
+        """
+        Tests that pruning keeps only counted words, ordered by count
+        """
+        vocab = [WordVectors.PAD_TOKEN, WordVectors.UNK_TOKEN, "a", "b", "c", "d"]
+        vectors = WordVectors(
+            np.arange(12, dtype=np.float32).reshape(6, 2),
+            dict(enumerate(vocab)),
+            {word: idx for idx, word in enumerate(vocab)},
+        )
+        pruned = vectors.prune({"c": 5, "a": 2, "d": 5, "oov": 10})
+        self.assertEqual(
+            [pruned.idx_to_word[idx] for idx in range(len(pruned.idx_to_word))],
+            [WordVectors.PAD_TOKEN, WordVectors.UNK_TOKEN, "c", "d", "a"],
+        )
+        self.assertEqual(
+            pruned.vectors.tolist(), [[0, 1], [2, 3], [8, 9], [10, 11], [4, 5]]
+        )
+        top_pruned = vectors.prune({"c": 5, "a": 2, "d": 5}, top_k=1)
+        self.assertEqual(
+            top_pruned.word_to_idx,
+            {WordVectors.PAD_TOKEN: 0, WordVectors.UNK_TOKEN: 1, "c": 2},
+        )
@@ -1,11 +1,12 @@
 import json
-from typing import Tuple, Optional
+import os
+from typing import Dict, Tuple, Optional, Union
 
 import torch as t
 
 from model.trainer import Trainer
 from model.train_parser import TrainArgs
-from model.tokenizer import Tokenizer, NltkTokenizer
+from model.tokenizer import Tokenizer, CachingTokenizer, RegexTokenizer
 from model.text_processor import TextProcessor
 from model.predictor import PredictorModel, ContextualEncoderConfig
 from model.docqa_predictor import DocQAConfig, DocQAPredictor
@@ -18,13 +19,21 @@ from model.modules.embeddor import (
     WordEmbeddorConfig,
     PoolingCharEmbeddorConfig,
 )
-from model.corpus import TrainDataset, EvalDataset
+from model.corpus import (
+    Corpus,
+    ColumnarCorpus,
+    TrainDataset,
+    EvalDataset,
+    StreamingQADataset,
+)
 from model.util import get_device
 from model.wv import WordVectors
 
 
 def initialize_model(
-    args: TrainArgs, train_dataset: TrainDataset, vectors: WordVectors
+    args: TrainArgs,
+    train_dataset: Union[TrainDataset, StreamingQADataset],
+    vectors: WordVectors,
 ) -> PredictorModel:
     """
     Given the command line args and the dataset and vectors to train on,
@@ -40,7 +49,7 @@ def initialize_model(
     if args.char_embedding_size:
         char_embedding_config = PoolingCharEmbeddorConfig(
             embedding_dimension=args.char_embedding_size,
-            char_vocab_size=train_dataset.corpus.stats.char_vocab_size,
+            char_vocab_size=train_dataset.stats.char_vocab_size,
         )
     else:
         char_embedding_config = None
@@ -52,7 +61,9 @@ def initialize_model(
     )
     embeddor: Embeddor = make_embeddor(embeddor_config, device)
     if args.simple_bidaf:
-        bidaf_predictor_config = BidafConfig.get_default_bidaf_config()
+        bidaf_predictor_config = BidafConfig.get_default_bidaf_config(
+            args.attention_block_size
+        )
         predictor: PredictorModel = BidafPredictor(embeddor, bidaf_predictor_config).to(
             device
         )
@@ -68,12 +79,15 @@ def initialize_model(
             attention_linear_hidden_size=args.attention_linear_hidden_size,
             use_self_attention=(not args.no_self_attention),
             batch_size=args.batch_size,
+            attention_block_size=args.attention_block_size,
         )
         predictor = DocQAPredictor(embeddor, docqa_predictor_config).to(device)
     return predictor
 
 
-def get_datasets(args: TrainArgs) -> Tuple[TrainDataset, EvalDataset, WordVectors]:
+def get_datasets(
+    args: TrainArgs,
+) -> Tuple[Union[TrainDataset, StreamingQADataset], EvalDataset, WordVectors]:
     """
     Returns the Datasets to be used for training (and the word vectors used to embed them,
      parsed form the args
@@ -82,23 +96,215 @@ def get_datasets(args: TrainArgs) -> Tuple[TrainDataset, EvalDataset, WordVector
     """
     device = get_device(args.disable_cuda)
 
-    tokenizer: Tokenizer = NltkTokenizer()
+    tokenizer: Tokenizer = CachingTokenizer(RegexTokenizer())
     processor: TextProcessor = TextProcessor({"lowercase": True})
     vectors: WordVectors = WordVectors.load_vectors(args.word_vector_file)
+    cache_dir = args.preprocess_cache_dir or None
 
-    train_dataset: TrainDataset = TrainDataset.load_dataset(
+    if args.stream_train_file:
+        if args.prune_vectors:
+            raise Exception("Can't prune word vectors with a streamed training file")
+        streaming_dataset = StreamingQADataset.from_file(
+            args.train_file,
+            tokenizer,
+            processor,
+            vectors,
+            force_single_answer=not args.multi_answer,
+            window_size=args.context_window_size,
+            window_stride=args.context_window_stride,
+            shuffle_buffer_size=args.shuffle_buffer_size,
+        )
+        streamed_dev_corpus: Corpus = Corpus.from_file(
+            args.dev_file,
+            tokenizer,
+            processor,
+            vectors,
+            force_single_answer=True,
+            char_mapping=streaming_dataset.char_mapping,
+            num_workers=args.preprocess_num_workers,
+            cache_dir=cache_dir,
+        )
+        return (
+            streaming_dataset,
+            EvalDataset(
+                streamed_dev_corpus,
+                get_columnar_prefix(
+                    args,
+                    streamed_dev_corpus,
+                    args.dev_file,
+                    "-columnar",
+                    tokenizer,
+                    processor,
+                    vectors,
+                    True,
+                ),
+                args.context_window_size,
+                args.context_window_stride,
+            ),
+            vectors,
+        )
+
+    # Datasets backed by cached columns don't need the corpora to be read at all
+    train_prefix = get_cached_columnar_prefix(
+        args, args.train_file, tokenizer, processor, vectors, not args.multi_answer
+    )
+    if train_prefix is not None:
+        dev_prefix = get_cached_columnar_prefix(
+            args,
+            args.dev_file,
+            tokenizer,
+            processor,
+            vectors,
+            True,
+            ColumnarCorpus.from_disk(train_prefix).char_mapping,
+        )
+        if dev_prefix is not None:
+            print("Loading columnar corpora from the preprocessing cache")
+            return (
+                TrainDataset(
+                    None,
+                    train_prefix,
+                    args.context_window_size,
+                    args.context_window_stride,
+                ),
+                EvalDataset(
+                    None,
+                    dev_prefix,
+                    args.context_window_size,
+                    args.context_window_stride,
+                ),
+                vectors,
+            )
+
+    train_corpus: Corpus = Corpus.from_file(
         args.train_file,
-        vectors,
         tokenizer,
         processor,
+        vectors,
         force_single_answer=not args.multi_answer,
+        num_workers=args.preprocess_num_workers,
+        cache_dir=cache_dir,
+    )
+    dev_corpus: Corpus = Corpus.from_file(
+        args.dev_file,
+        tokenizer,
+        processor,
+        vectors,
+        force_single_answer=True,
+        char_mapping=train_corpus.char_mapping,
+        num_workers=args.preprocess_num_workers,
+        cache_dir=cache_dir,
     )
-    dev_dataset: EvalDataset = EvalDataset.load_dataset(
-        args.dev_file, vectors, train_dataset.char_mapping, tokenizer, processor
+    columnar_suffix = "-columnar"
+    if args.prune_vectors:
+        token_counts = Corpus.compute_token_counts([train_corpus, dev_corpus])
+        vectors = vectors.prune(token_counts, args.vocab_top_k)
+        print(f"Pruned word vectors to {len(vectors.word_to_idx)} words")
+        train_corpus.set_token_mapping(vectors.word_to_idx)
+        dev_corpus.set_token_mapping(vectors.word_to_idx)
+        vectors.save(f"{args.run_name}-vocab")
+        # The pruned vocabulary depends on both corpora, key the columns by it
+        vocab_key = Corpus.hash_vocab(vectors.word_to_idx)[:16]
+        columnar_suffix = f"-columnar-pruned-{args.vocab_top_k}-{vocab_key}"
+
+    train_dataset: TrainDataset = TrainDataset(
+        train_corpus,
+        get_columnar_prefix(
+            args,
+            train_corpus,
+            args.train_file,
+            columnar_suffix,
+            tokenizer,
+            processor,
+            vectors,
+            not args.multi_answer,
+        ),
+        args.context_window_size,
+        args.context_window_stride,
+    )
+    dev_dataset: EvalDataset = EvalDataset(
+        dev_corpus,
+        get_columnar_prefix(
+            args,
+            dev_corpus,
+            args.dev_file,
+            columnar_suffix,
+            tokenizer,
+            processor,
+            vectors,
+            True,
+        ),
+        args.context_window_size,
+        args.context_window_stride,
     )
     return train_dataset, dev_dataset, vectors
 
 
+def get_columnar_prefix(
+    args: TrainArgs,
+    corpus: Corpus,
+    data_file: str,
+    columnar_suffix: str,
+    tokenizer: Tokenizer,
+    processor: TextProcessor,
+    vectors: WordVectors,
+    force_single_answer: bool,
+) -> Optional[str]:
+    """
+    Check Corpus.get_cache_key for the preprocessing parameters
+    :param args: CLI args
+    :param corpus: Corpus the columns are encoded from
+    :param data_file: File the corpus was read from
+    :param columnar_suffix: Suffix of the columnar files
+    :returns: The prefix of the columnar files of the corpus, next to its cache
+        entry if it was loaded through the preprocessing cache, or None if columnar
+        corpora are disabled
+    """
+    if not args.columnar_corpus:
+        return None
+    if corpus.cache_key is not None:
+        return os.path.join(
+            args.preprocess_cache_dir, f"{corpus.cache_key}{columnar_suffix}"
+        )
+    # Key the columns by everything they're encoded with like cache entries, so
+    # changing the data or any preprocessing setting doesn't reuse stale columns
+    key = Corpus.get_cache_key(
+        data_file,
+        tokenizer,
+        processor,
+        vectors,
+        force_single_answer,
+        corpus.char_mapping,
+    )
+    return f"{data_file}{columnar_suffix}-{key[:16]}"
+
+
+def get_cached_columnar_prefix(
+    args: TrainArgs,
+    data_file: str,
+    tokenizer: Tokenizer,
+    processor: TextProcessor,
+    vectors: WordVectors,
+    force_single_answer: bool,
+    char_mapping: Optional[Dict[str, int]] = None,
+) -> Optional[str]:
+    """
+    Check Corpus.get_cache_key for the parameters the key is computed from
+    :param args: CLI args
+    :param data_file: Raw QA data file
+    :returns: The prefix of the columnar files of the data file in the
+        preprocessing cache if they were written already, None otherwise or if
+        the columns depend on the pruned vocabulary that needs the corpora
+    """
+    if not args.columnar_corpus or not args.preprocess_cache_dir or args.prune_vectors:
+        return None
+    cache_key = Corpus.get_cache_key(
+        data_file, tokenizer, processor, vectors, force_single_answer, char_mapping
+    )
+    prefix = os.path.join(args.preprocess_cache_dir, f"{cache_key}-columnar")
+    return prefix if ColumnarCorpus.exists(prefix) else None
+
+
 def get_training_config(args: TrainArgs) -> Trainer.TrainingConfig:
     """
     Parse the command line args builds a TrainingConfig object
@@ -111,13 +317,25 @@ def get_training_config(args: TrainArgs) -> Trainer.TrainingConfig:
         weight_decay=args.weight_decay,
         max_grad_norm=args.max_grad_norm,
         ema_weight=args.ema_weight,
+        ema_eval_weights=args.ema_eval_weights,
         num_epochs=args.num_epochs,
         batch_size=args.batch_size,
         max_question_size=args.max_question_size,
         max_context_size=args.max_context_size,
+        max_answer_size=args.max_answer_size,
         device=get_device(args.disable_cuda),
+        precision=args.precision,
         loader_num_workers=args.loader_num_workers,
+        bucket_batches=args.bucket_batches,
+        max_batch_tokens=args.max_batch_tokens,
+        group_contexts=args.group_contexts,
+        eval_batch_size=args.eval_batch_size,
+        eval_num_workers=args.eval_num_workers,
         model_checkpoint_path=args.run_name,
+        checkpoint_every_steps=args.checkpoint_every_steps,
+        keep_checkpoints=args.keep_checkpoints,
+        max_pending_checkpoints=args.max_pending_checkpoints,
+        resume_from_checkpoint=args.resume,
     )
 
 
@@ -127,10 +345,14 @@ def main() -> None:
     training_config = get_training_config(args)
     with open(f"{args.run_name}_config.json", "w") as config_file:
         json.dump(vars(args), config_file, indent=2)
+    with open(f"{args.run_name}-char-mapping.json", "w") as char_mapping_file:
+        json.dump(train_dataset.char_mapping, char_mapping_file)
 
     try:
         print(f"Attempting to load model to train from {args.run_name}.pth")
-        model = t.load(f"{args.run_name}.pth").to(training_config.device)
+        model = t.load(f"{args.run_name}.pth", weights_only=False).to(
+            training_config.device
+        )
     except IOError as e:
         print(f"Can't load model: {e}, initializing from scratch")
         model = initialize_model(args, train_dataset, vectors)
@@ -151,9 +373,10 @@ def main() -> None:
     with open("dev-pred-with-gold.json", "w") as f:
         json.dump(qid_to_answers, f)
     print("Final evaluation on dev")
-    eval_results = Trainer.evaluate_on_squad_dataset(
-        dev_dataset, model, training_config
+    eval_results = Trainer.score_answers(
+        dev_dataset, dev_answers, training_config.eval_num_workers
     )
+    dev_dataset.close_scorer()
     print(eval_results)
 
     print(f"Saving model to {args.run_name}.pth")